@@ -0,0 +1,106 @@
+# HABMODEL_RunPipeline.py
+#
+# Description: Builds a species' MaxEnt SWD file in one step, running the stages of
+#  HABMODEL_CreateDataFile.py, HABMODEL_SHCorrelate.py, HABMODEL_CalculateCrossCorrelations.py
+#  and HABMODEL_CreateSWDFile.py in a single process. The data table extracted from the
+#  environment variables table is handed from stage to stage in memory (see HABMODEL_utils.py)
+#  rather than written to and read back from AllHUC8Records.csv; the files each stage writes
+#  (AllHUC8Records.csv, SH_Correlations.csv, RV_Correlations.csv, <species>_SWD.csv and their
+#  metadata files) are written to the species folder once all the stages are done.
+#
+#  The redundant variables are read from <species>_RedundantVars.html in the species folder,
+#  if saved there (from the page created by HABMODEL_VisualizeCorrelations.py). Otherwise they
+#  are chosen by ranking the variables on their correlation with presence: each variable
+#  removes the lower ranked variables correlated with it at or above the threshold. These
+#  are then written to <species>_RedundantVars.html, which may be edited and the tool re-run.
+#
+#  This tool is not in GeoWET_V0.tbx; it is run from the command line (with the parameters
+#  of the toolbox's stage tools).
+#
+# Usage: HABMODEL_RunPipeline.py <species table> <species name> <environment variables table>
+#                                <stats folder> [cross correlation threshold]
+
+import sys, os, arcpy, StringIO
+arcpy.env.overwriteOutput = 1
+
+#HABMODEL stage functions; SWD writer (in the DataPrep scripts folder)
+import HABMODEL_utils as hu
+from HABMODEL_utils import su, msg
+
+# Input variables
+speciesTbl = arcpy.GetParameterAsText(0)    # Table of all ENDRIES surveyed catchments with a binary column for each species presence...
+speciesName = arcpy.GetParameterAsText(1)   # Species to model; this should be a field in the above table
+envVarsTbl = arcpy.GetParameterAsText(2)    # Table listing all the catchment attributes to be used as environment layer values
+statsFolder = arcpy.GetParameterAsText(3)   # Root folder into which a species subfolder will be created
+threshold = arcpy.GetParameterAsText(4)     # Cross correlation above which variables are redundant
+if threshold in ("","#"): threshold = 0.75
+else: threshold = float(threshold)
+
+# Output variables
+sppFolder = os.path.join(statsFolder,speciesName)
+speciesCSV = hu.dataFile(sppFolder)
+correlationCSV = hu.shCorrelationsFile(sppFolder)
+coeffCSV = hu.rvCorrelationsFile(sppFolder)
+varFilterHTML = hu.redundantVarsFile(sppFolder,speciesName)
+swdCSV = hu.swdFile(sppFolder,speciesName)
+arcpy.SetParameterAsText(5,swdCSV)
+
+## ---Processes---
+# Create the output folder, if not present
+if not os.path.exists(sppFolder):
+    msg("...{} does not exist, creating it".format(sppFolder))
+    os.mkdir(sppFolder)
+
+# Stage 1: build the data table of the catchments in the species' HUC8s
+msg("Building the data table")
+dataLog = StringIO.StringIO()
+hu.logHeader(dataLog)
+dataDF = hu.createDataTable(speciesTbl,speciesName,envVarsTbl,dataLog)
+
+# Stage 2: find the variables significantly correlated with presence
+msg("Calculating species-habitat correlations")
+shLog = StringIO.StringIO()
+hu.logHeader(shLog,"INFO ON SPECIES-HABITAT CORRELATIONS")
+correlated, dropped = hu.shCorrelations(dataDF)
+for envName, coeff, pValue in dropped:
+    msg("--> [%s] was dropped (p=%2.2f)"%(envName,pValue),"warning")
+    shLog.write("--> [%s] was dropped (p=%2.2f)\n"%(envName,pValue))
+envNames = [var for var, coeff, pValue in correlated]
+msg("...{} variables correlated with presence".format(len(envNames)))
+
+# Stage 3: find the pairs of redundant variables
+msg("Computing cross correlations")
+pairs = hu.crossCorrelations(dataDF,envNames,threshold)
+if os.path.exists(varFilterHTML):
+    msg("...Reading redundant variables from {}".format(varFilterHTML))
+    redundantVars = hu.readRedundantVariables(varFilterHTML)
+    writeRedundant = False
+else:
+    msg("...Ranking variables on their correlation with presence to remove redundant ones")
+    redundantVars = hu.redundantVariables(dataDF,correlated,threshold)
+    writeRedundant = True
+
+# Stage 4: build the SWD table, less the redundant variables
+msg("Building the SWD table")
+swdVars = []
+for fld in envNames:
+    if fld in redundantVars:
+        msg("   Removing <{}> (redundant)".format(fld))
+    else:
+        swdVars.append(fld)
+swdDF = hu.swdTable(dataDF,speciesName,swdVars)
+
+## WRITE THE OUTPUT FILES ##
+msg("Writing outputs to {}".format(sppFolder))
+hu.writeDataFile(speciesCSV,dataDF)
+with open(hu.metadataFile(speciesCSV),'w') as logFile: logFile.write(dataLog.getvalue())
+hu.writeSHCorrelations(correlationCSV,correlated)
+with open(hu.metadataFile(correlationCSV),'w') as logFile: logFile.write(shLog.getvalue())
+su.writeCorrelatedPairs(coeffCSV,envNames,pairs)
+if writeRedundant: hu.writeRedundantVariables(varFilterHTML,redundantVars)
+su.writeSWD(swdCSV,swdDF)
+
+presenceCounter = (dataDF["Species"] == 1).sum()
+msg("{} species records written to file".format(presenceCounter))
+msg("{} background records written to file".format(len(dataDF) - presenceCounter))
+msg("Finished")
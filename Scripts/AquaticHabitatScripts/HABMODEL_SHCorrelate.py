@@ -7,7 +7,8 @@
 #  between a given response variable and the binary presence/absence variable.
 #  If the correlation is not significant (p < 0.05), the response variable is
 #  considered more noise than signal and is tagged for eliminated from the
-#  habitat modeling.
+#  habitat modeling. The correlations of all variables are computed at once (see
+#  presenceCorrelations in SPECIES_utils.py) rather than one scipy call per variable.
 #
 #  *****************************************************************************
 #  ** This module requires the SciPy module to be installed. When installing, **
@@ -18,28 +19,22 @@
 # Spring 2015
 # John.Fay@duke.edu
 
-import sys, os, arcpy, numpy, datetime
+import sys, os, arcpy
 arcpy.env.overwriteOutput = 1
 
+#HABMODEL stage functions (see shCorrelations in HABMODEL_utils.py)
+import HABMODEL_utils as hu
+from HABMODEL_utils import msg
+
 # Input variables
 speciesCSV = arcpy.GetParameterAsText(0) #Catchment table of species p/a with all other response variables
 
 # Output variables
 statsFolder = os.path.dirname(speciesCSV)
-correlationCSV = os.path.join(statsFolder,"SH_Correlations.csv")
-logFilename = correlationCSV[:-4] + "_metadata.txt"
+correlationCSV = hu.shCorrelationsFile(statsFolder)
+logFilename = hu.metadataFile(correlationCSV)
 arcpy.SetParameterAsText(1,correlationCSV) #Table of only significant response variables and their coefficients
 
-## ---Functions---
-def msg(txt,type="message"):
-    print txt
-    if type == "message":
-        arcpy.AddMessage(txt)
-    elif type == "warning":
-        arcpy.AddWarning(txt)
-    elif type == "error":
-        arcpy.AddError(txt)
-
 ## ---Processes---
 #Check to see whether a SciPy exists
 try:
@@ -50,54 +45,23 @@ except:
     sys.exit()
 
 #Initialize the log file
-now = datetime.datetime.now()
 logFile = open(logFilename,'w')
-logFile.write("INFO ON SPECIES-HABITAT CORRELATIONS\n")
-logFile.write("File created at {}:{} on {}/{}/{}\n".format(now.hour,now.minute,now.month,now.day,now.year))
+hu.logHeader(logFile,"INFO ON SPECIES-HABITAT CORRELATIONS")
 
-#Read in the column headers
-f = open(speciesCSV,'rt')
-headerText = f.readline()
-headerText = headerText[:-1] #Strip the newline char
-headerItems = headerText.split(",")
-f.close()
-
-#Read in the csv file as a numpy vector
+#Read in the data file
 msg("...Reading in data")
-arrData = numpy.genfromtxt(speciesCSV,delimiter=",")
-
-#Create variables from data array
-nCols = arrData.shape[1]
+dataDF = hu.readDataFile(speciesCSV)
 
-#Create vectors
-msg("...Extracting occurrence records")
-sppVector = arrData[1:,0]
+#Calculate the correlation of all variables with presence/absence at once
+msg("Calculating correlation coefficients")
+correlated, dropped = hu.shCorrelations(dataDF)
+for envName, coeff, pValue in dropped:
+    msg("--> [%s] was dropped (p=%2.2f)"%(envName,pValue),"warning")
+    logFile.write("--> [%s] was dropped (p=%2.2f)\n"%(envName,pValue))
 
-#Intialize output file
+#Write the significant variables to the output file
 msg("...Creating output file")
-f = open(correlationCSV,'wt')
-f.write("variable, coef, abs_coef, p_value\n")
-
-#Loop through columns and calculate the variables correlation with presence/absence
-msg("Calculating correlation coefficients")
-for i in range(2,nCols):
-    # Get the variable name (from the list created above)
-    envName = headerItems[i]
-    # Skip if name is GRIDCODE or FeatureID
-    if envName in ("GRIDCODE","FeatureID","REACHCODE"): continue
-    # Get the env var column, as a vector
-    envVector = arrData[1:,i]
-    #Calculate correlation --THIS REQUIRES SCIPY--
-    pearson = stats.pearsonr(sppVector, envVector)
-    coeff = pearson[0]
-    pValue = pearson[1]
-    #Print output to the CSV file
-    if abs(pValue) <= 0.05:
-        f.write("%s, %2.4f, %2.4f, %2.3f\n"%(envName,coeff,abs(coeff),pValue))
-    else:
-        msg("--> [%s] was dropped (p=%2.2f)"%(envName,pValue),"warning")
-        logFile.write("--> [%s] was dropped (p=%2.2f)\n"%(envName,pValue))
+hu.writeSHCorrelations(correlationCSV,correlated)
 
 #Wrap up
 logFile.close()
-f.close()          
\ No newline at end of file
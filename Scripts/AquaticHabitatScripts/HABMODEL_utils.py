@@ -0,0 +1,271 @@
+#HABMODEL_utils.py
+#
+# A set of functions used by the HABMODEL scripts, each of which runs one stage in building
+#  a species' MaxEnt SWD file:
+#   1. HABMODEL_CreateDataFile.py - the catchments in the HUC8s in which the species occurs
+#      (AllHUC8Records.csv)
+#   2. HABMODEL_SHCorrelate.py - the variables correlated with presence (SH_Correlations.csv)
+#   3. HABMODEL_CalculateCrossCorrelations.py - the pairs of redundant variables
+#      (RV_Correlations.csv)
+#   4. HABMODEL_CreateSWDFile.py - the SWD file, less the redundant variables listed in
+#      <species>_RedundantVars.html (<species>_SWD.csv)
+#
+#  The stages hand each other a data table: a dataframe of the Species (1 = presence,
+#  0 = background), GRIDCODE and REACHCODE of each catchment and its environment variable
+#  values, typed as in the environment variables table. The stage scripts read their
+#  inputs from (and write their outputs to) the species folder; HABMODEL_RunPipeline.py
+#  runs all the stages in one process and writes the same files once they are done.
+
+import sys, os, datetime, arcpy
+import numpy as np
+import pandas as pd
+
+#Null culling, correlation and SWD writing functions (in the DataPrep scripts folder)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"DataPrep"))
+import SPECIES_utils as su
+
+#Data table columns preceding the environment variables
+keyCols = ("Species","GRIDCODE","REACHCODE")
+
+#Significant digits of the values written to the data file (see writeDataFile); 17 digits
+# round-trip a double exactly, as the repr formatting the data file was written with did
+dataPrecision = 17
+
+#Most runs of object IDs selected by a where clause (see huc8Rows); beyond this the
+# environment variables table is read whole and the HUC8 records selected in memory
+maxRanges = 500
+
+#Significance level of the species-habitat correlations
+pThreshold = 0.05
+
+## ---Functions---
+def msg(txt,type="message"):
+    print txt
+    if type == "message":
+        arcpy.AddMessage(txt)
+    elif type == "warning":
+        arcpy.AddWarning(txt)
+    elif type == "error":
+        arcpy.AddError(txt)
+
+def logHeader(logFile,title=None):
+    '''Writes the title (if any) and creation time to the top of a log file'''
+    now = datetime.datetime.now()
+    if title: logFile.write(title + "\n")
+    logFile.write("File created at {}:{} on {}/{}/{}\n".format(now.hour,now.minute,now.month,now.day,now.year))
+
+##--SPECIES FOLDER FILES--
+def dataFile(sppFolder):
+    '''Returns the name of the species' data file (stage 1)'''
+    return os.path.join(sppFolder,"AllHUC8Records.csv")
+
+def shCorrelationsFile(sppFolder):
+    '''Returns the name of the species-habitat correlations file (stage 2)'''
+    return os.path.join(sppFolder,"SH_Correlations.csv")
+
+def rvCorrelationsFile(sppFolder):
+    '''Returns the name of the redundant variable pairs file (stage 3)'''
+    return os.path.join(sppFolder,"RV_Correlations.csv")
+
+def redundantVarsFile(sppFolder,speciesName):
+    '''Returns the name of the redundant variables file (saved from the page created by
+       HABMODEL_VisualizeCorrelations.py)'''
+    return os.path.join(sppFolder,"{}_RedundantVars.html".format(speciesName))
+
+def swdFile(sppFolder,speciesName):
+    '''Returns the name of the species' SWD file (stage 4)'''
+    return os.path.join(sppFolder,"{}_SWD.csv".format(speciesName))
+
+def metadataFile(outFN):
+    '''Returns the name of the log file written beside an output'''
+    return outFN[:-4] + "_metadata.txt"
+
+##--DATA TABLE--
+def oidRanges(oids):
+    '''Returns the (first, last) object ID of each run of consecutive IDs in a sorted array'''
+    breaks = np.flatnonzero(np.diff(oids) <> 1) + 1
+    return zip(oids[np.r_[0,breaks]],oids[np.r_[breaks - 1,len(oids) - 1]])
+
+def huc8Rows(envVarsTbl,HUC8s):
+    '''Returns the where clause selecting the rows of the environment variables table in the
+       HUC8s listed (as runs of object IDs, or None if there are more than maxRanges runs),
+       and the boolean array flagging these rows in table order'''
+    oidFld = arcpy.Describe(envVarsTbl).OIDFieldName
+    keyArr = arcpy.da.TableToNumPyArray(envVarsTbl,[oidFld,"REACHCODE"],null_value={"REACHCODE":""})
+    #Match the first 8 characters of each REACHCODE to the set of HUC8s
+    inHUC8s = np.in1d(keyArr["REACHCODE"].astype("S8"),np.array(sorted(HUC8s),dtype="S8"))
+    ranges = oidRanges(np.sort(keyArr[oidFld][inHUC8s]))
+    if len(ranges) > maxRanges:
+        return None, inHUC8s
+    whereClause = " OR ".join(["({0} >= {1} AND {0} <= {2})".format(oidFld,first,last) for first, last in ranges])
+    return whereClause, inHUC8s
+
+def createDataTable(speciesTbl,speciesName,envVarsTbl,logFile):
+    '''Returns the data table of the catchments in the HUC8s in which the species was
+       observed, presences first, with the environment variables having no missing values
+       in these HUC8s; the HUC8s and the variables removed are written to the log file'''
+    # Extract Catchments with species
+    msg("...Pulling catchment records for {}".format(speciesName))
+    sppArr = arcpy.da.TableToNumPyArray(speciesTbl,["GRIDCODE","REACHCODE"],'"{}" = 1'.format(speciesName))
+    msg("{} records extracted".format(len(sppArr)))
+
+    # Make the sets of HUC8s and HUC6s
+    msg("...Making a list of HUCs in which {} was observed".format(speciesName))
+    HUC8s = set(sppArr["REACHCODE"].astype("S8"))
+    HUC6s = set([HUC8[:6] for HUC8 in HUC8s])
+    msg("{} was found in {} HUC6s and {} HUC8s".format(speciesName,len(HUC6s),len(HUC8s)),"warning")
+
+    # Save info on the species (list of HUC8s and HUC6s)
+    logFile.write("{} was found in {} HUC6s and {} HUC8s\n".format(speciesName,len(HUC6s),len(HUC8s)))
+    logFile.write("HUC8s:\n")
+    for HUC8 in sorted(HUC8s):
+        logFile.write("\t{}\n".format(HUC8))
+
+    # Create a list of field names: remove non-numeric fields and extranneous fields
+    outFldList = []
+    for fld in arcpy.ListFields(envVarsTbl):
+        if fld.type not in ("OID","String") and not fld.name in (speciesName,"Shape_Length","Shape_Area"):
+            outFldList.append(fld.name)
+    checkFlds = outFldList[2:] #Skip the first two fields (GRIDCODE and REACHCODE)
+
+    #Select the rows of the response variables that are within the HUC8s by their REACHCODE
+    # prefixes, then extract them with all the fields to check in one pass
+    msg("...Selecting the records in the species' HUC8s")
+    whereClause, inHUC8s = huc8Rows(envVarsTbl,HUC8s)
+    if not inHUC8s.any():
+        msg("No records of {} are in the species' HUC8s.\nExiting.".format(envVarsTbl),"error")
+        sys.exit(1)
+    msg("...Extracting {} records of {} fields".format(inHUC8s.sum(),len(checkFlds)))
+    extractFlds = ["GRIDCODE","REACHCODE"] + checkFlds
+    #NULLs are read as -9999 (Maxent's no data value), so fields with NULLs are removed too
+    nullValues = dict([(fld,-9999) for fld in extractFlds])
+    nullValues["REACHCODE"] = ""
+    envArr = arcpy.da.TableToNumPyArray(envVarsTbl,extractFlds,whereClause,null_value=nullValues)
+    if whereClause is None: envArr = envArr[inHUC8s]
+
+    # Check all the fields for null values in the extracted records at once
+    msg("...Checking {} fields for null values".format(len(checkFlds)))
+    nullFlds = []
+    if checkFlds:
+        nullFlds = su.nullColumns(np.column_stack([envArr[fld] for fld in checkFlds]),checkFlds,noData=(-9998,-9999))
+
+    # Filter the field list: remove fields with null values
+    fldList = []
+    for fld in checkFlds:
+        if fld in nullFlds:
+            msg("   Field <<{}>> has null values and will be removed".format(fld),"warning")
+            logFile.write("Field <<{}>> has null values and will be removed\n".format(fld))
+        else:
+            fldList.append(fld)
+
+    # Insert GRIDCODE and REACHCODE
+    fldList.insert(0,"REACHCODE")
+    fldList.insert(0,"GRIDCODE")
+
+    # Tag the catchments where the species was observed (1) and the background (0),
+    # and order the records presences first
+    presence = np.in1d(envArr["GRIDCODE"],sppArr["GRIDCODE"])
+    order = np.argsort(~presence,kind="mergesort")
+    dataDF = pd.DataFrame(dict([(fld,envArr[fld][order]) for fld in fldList]),columns=fldList)
+    dataDF.insert(0,"Species",presence[order].astype(np.int8))
+    dataDF["REACHCODE"] = dataDF["REACHCODE"].astype(str)
+    nPresence = presence.sum()
+    msg("{} presence records extracted".format(nPresence))
+    logFile.write("{} presence records written to file\n".format(nPresence))
+    msg("{} absence records extracted".format(len(presence) - nPresence))
+    logFile.write("{} absence records writted to file\n".format(len(presence) - nPresence))
+    return dataDF
+
+def readDataFile(speciesCSV,variables=None):
+    '''Reads a species' data file into a data table, with all its variables or only those
+       listed'''
+    columns = None if variables is None else list(keyCols) + list(variables)
+    dataDF = pd.read_csv(speciesCSV,usecols=columns,dtype={"REACHCODE":str})
+    if columns: dataDF = dataDF[columns]
+    return dataDF
+
+def writeDataFile(speciesCSV,dataDF):
+    '''Writes a data table to the species' data file (see su.writeSWD)'''
+    return su.writeSWD(speciesCSV,dataDF,precision=dataPrecision)
+
+def envVariables(dataDF):
+    '''Returns the environment variables of a data table, in column order'''
+    return [col for col in dataDF.columns if not col in keyCols + ("FeatureID",)]
+
+##--SPECIES-HABITAT CORRELATIONS--
+def shCorrelations(dataDF,pThreshold=pThreshold):
+    '''Returns the (variable, coefficient, p value) of the environment variables whose
+       correlation with presence is significant, and of those whose correlation is not'''
+    variables = envVariables(dataDF)
+    if not variables: return [], []
+    values = np.column_stack([dataDF[var].values for var in variables])
+    coeffs, pValues = su.presenceCorrelations(values,dataDF["Species"].values)
+    correlated = []
+    dropped = []
+    for var, coeff, pValue in zip(variables,coeffs,pValues):
+        if abs(pValue) <= pThreshold:
+            correlated.append((var,coeff,pValue))
+        else:
+            dropped.append((var,coeff,pValue))
+    return correlated, dropped
+
+def writeSHCorrelations(correlationCSV,correlated):
+    '''Writes the significant species-habitat correlations to a CSV file'''
+    with open(correlationCSV,'wt') as f:
+        f.write("variable, coef, abs_coef, p_value\n")
+        for envName, coeff, pValue in correlated:
+            f.write("%s, %2.4f, %2.4f, %2.3f\n"%(envName,coeff,abs(coeff),pValue))
+    return correlationCSV
+
+def readSHCorrelations(correlationCSV):
+    '''Returns the variables listed in a species-habitat correlations file, in file order'''
+    colNames = []
+    with open(correlationCSV,'rt') as f:
+        f.readline()                    # Skip the header line
+        for line in f:
+            lineData = line.split(",")
+            if len(lineData) > 1:       # If the line includes field names (the last one may not)
+                colNames.append(lineData[0].strip().replace('"',''))
+    return colNames
+
+##--REDUNDANT VARIABLES--
+def crossCorrelations(dataDF,variables,threshold):
+    '''Returns the (i, j, coefficient) of each pair of the listed variables correlated at
+       or above the threshold (see su.correlatedPairs)'''
+    if not variables: return []
+    values = np.column_stack([dataDF[var].values for var in variables])
+    return su.correlatedPairs(su.correlationMatrix(values),threshold)
+
+def redundantVariables(dataDF,correlated,threshold):
+    '''Returns the variables to remove as redundant: ranking the variables on the strength
+       of their correlation with presence, each drops the lower ranked variables correlated
+       with it at or above the threshold (see su.pruneCorrelated)'''
+    ranked = [var for var, coeff, pValue in sorted(correlated,key=lambda c: -abs(c[1]))]
+    if not ranked: return []
+    values = np.column_stack([dataDF[var].values for var in ranked])
+    dropped, pairs = su.pruneCorrelated(su.correlationMatrix(values),threshold)
+    return [var for var, drop in zip(ranked,dropped) if drop]
+
+def readRedundantVariables(varFilterHTML):
+    '''Returns the variables listed in a redundant variables file'''
+    f = open(varFilterHTML, 'rt')               #open the file
+    lineString = f.readline()                   #get the info
+    f.close()                                   #close the file
+    return lineString.split("<br>")[1:-1]       #Get the fields from the line
+
+def writeRedundantVariables(varFilterHTML,redundantVars):
+    '''Writes a redundant variables file in the format saved from the page created by
+       HABMODEL_VisualizeCorrelations.py'''
+    with open(varFilterHTML,'wt') as f:
+        f.write("<u>Redundant Nodes</u>:<br>" + "".join([var + "<br>" for var in redundantVars]) + "\n")
+    return varFilterHTML
+
+##--SWD TABLE--
+def swdTable(dataDF,speciesName,variables):
+    '''Returns the SWD table of a species: the species name (or "Background") as SPECIES,
+       GRIDCODE (as X), REACHCODE (as Y) and the listed variables of each catchment. Y is the
+       REACHCODE as a number (without its leading zero), as ArcGIS reads it from the data file.'''
+    swdDF = dataDF[["GRIDCODE","REACHCODE"] + list(variables)].rename(columns={"GRIDCODE":"X","REACHCODE":"Y"})
+    swdDF["Y"] = swdDF["Y"].astype(np.int64)
+    swdDF.insert(0,"SPECIES",np.where(dataDF["Species"].values == 1,speciesName,"Background"))
+    return swdDF
@@ -23,22 +23,72 @@
 #  - Identify and remove COLUMNS that don't have a correlation with presence/absence
 #  - Identify cross correlated columns; remove lower ranking column
 #  - Arranges columns for MaxEnt processing 
-#  - Writes out the records as CSV file in MaxEnt SWD format
+#  - Writes out the records as CSV file in MaxEnt SWD format, with attribute values to
+#    swdPrecision significant digits (see the SWD WRITER functions in SPECIES_utils.py)
+#
+#  The records of all species are read in one pass (batchMode), the background table of
+#  each range (set of HUC8s) is shared by the species with that range and reused for the
+#  ranges within it, and species already built from the same inputs are skipped (see the
+#  BATCH EXTRACTION, SPECIES SCREENING and BUILD CACHE functions in SPECIES_utils.py).
+#  Optional arguments set the number of worker processes and the memory budget of each (see
+#  RANGE JOBS), the chunk size for screening species from the attribute store (see STREAMING
+#  SCREENING), and the maximum background records and presences per HUC12 kept (see
+#  BACKGROUND SAMPLING and PRESENCE THINNING).
+#   Usage: AQUATIC_CreateAllSpeciesSWDFiles.py [number of processes] [worker memory (MB)]
+#                                              [chunk size (rows)] [maximum background]
+#                                              [maximum presences per HUC12]
 #
 # June 2016
 # John.Fay@duke.edu
 
-import sys, os, datetime
+import sys, os, datetime, threading, multiprocessing
 import pandas as pd
 import numpy as np
-from scipy import stats
 import arcpy
 
+#StreamCat attribute store functions (in the DataPrep scripts folder)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))),"DataPrep"))
+import STREAMCAT_utils as sc
+import SPECIES_utils as su
+
 #Script inputs
 rootFldr = os.path.dirname(os.path.dirname(os.path.dirname(sys.argv[0])))
 eoCSV = os.path.join(rootFldr,"Data","ToolData","SpeciesOccurrences.csv")
 streamCatFldr = os.path.join(rootFldr,"Data","StreamCat","AllRegions")
+storeFldr = sc.storeFolder(streamCatFldr)
+catalogFN = sc.catalogFile(os.path.dirname(streamCatFldr))
 speciesFldr = os.path.join(rootFldr,"Data","SpeciesModels")
+#Extract the data for all species in one pass (True) or separately for each species (False)
+batchMode = True
+#Number of species built at once (1 = in this process only)
+nProcesses = 1
+if len(sys.argv) > 1 and sys.argv[1] not in ("","#"): nProcesses = int(sys.argv[1])
+#Memory budget of each worker process (MB); ranges estimated to need more are built in the
+# main process, as are those whose worker goes over it while building them
+workerMemoryMB = 2048
+if len(sys.argv) > 2 and sys.argv[2] not in ("","#"): workerMemoryMB = int(sys.argv[2])
+#Rows per chunk when screening species from the attribute store; 0 = screen in memory
+chunkRows = 0
+if len(sys.argv) > 3 and sys.argv[3] not in ("","#"): chunkRows = int(sys.argv[3])
+#Maximum background records in a species' SWD file (0 = keep all), sampled from each HUC8
+# (stratumDigits = 8) or HUC10 (10) with a fixed seed, so the sample is reproducible
+maxBackground = 0
+if len(sys.argv) > 4 and sys.argv[4] not in ("","#"): maxBackground = int(sys.argv[4])
+stratumDigits = 8
+sampleSeed = su.sampleSeed
+#Maximum presence records kept in each HUC12 (thinDigits = 12) or coarser HUC (0 = keep all),
+# drawn with the same seed
+maxPresences = 0
+if len(sys.argv) > 5 and sys.argv[5] not in ("","#"): maxPresences = int(sys.argv[5])
+thinDigits = 12
+#Significant digits of the attribute values written to SWD files
+swdPrecision = su.swdPrecision
+#Attributes whose correlation with presence/absence has a p value above this are culled
+pThreshold = su.pThreshold
+#Of two attributes correlated above this, the one less correlated with presence is culled
+xcorrThreshold = su.xcorrThreshold
+#Set in worker processes
+workerMode = False
 #sppName = sys.argv[1] #'Nocomis_leptocephalus'
 #streamCatFldr = sys.argv[1] #r'C:\workspace\GeoWET\Data\StreamCat\AllRegions'
 #eoCSV = sys.argv[2] #r'C:\workspace\GeoWET\Data\ToolData\SpeciesOccurrences.csv'
@@ -47,6 +97,8 @@ speciesFldr = os.path.join(rootFldr,"Data","SpeciesModels")
 ##--------Functions--------##
 def msg(txt,severity=""):
     '''Reports message to interactive windor or ArcPy, if loaded'''
+    #Worker processes report to the species logs only
+    if workerMode: return
     print txt
     try:
         if severity=="Warning":
@@ -57,147 +109,24 @@ def msg(txt,severity=""):
             arcpy.AddMessage(txt)
     except:
         pass
-def checkSpeciesName(speciesName,sppFN):
-    '''Ensures that the supplied species name exists in the observation table'''
-    import csv
-    fileObj = open(eoCSV,'rt')
-    csvReader = csv.reader(fileObj)
-    fldNames = csvReader.next()
-    fileObj.close()
-    if not speciesName in fldNames:
-        msg("***{}*** does not occur in the \n   {} file".format(speciesName,sppFN),"Error")
-        sys.exit(1)
-    else:
-        return      
-
-def getHUC8s(sppFN,speciesName):
-    '''Returns a list of the HUC8s in which a species occurs'''
-    #Create a data frame from the species data
-    useCols = ["REACHCODE",speciesName]
-    eoDF = pd.read_csv(sppFN,usecols=useCols,dtype={'REACHCODE':str})
-    #Pull just the records where the species occurs
-    sppDF = eoDF[eoDF[speciesName] == 1]
-    #Get a list of the huc8s in which the spp is found
-    huc8s = sppDF['REACHCODE'].str[:8].unique()
-    #Return the list
-    return huc8s.tolist()
-
-def spatialSelect(dataFN,huc8List):
-    '''Returns a dataframe of the catchment attributes for the HUC8s in the list'''
-    #Load the catchment attributes into a data frame
-    dtypes = {"GRIDCODE":np.str,"FEATUREID":np.str,"REACHCODE":np.str,"HUC_12":np.str} 
-    dataDF = pd.read_csv(dataFN,dtype=dtypes)#,index_col="FEATUREID")
-
-    #Filter the cachment attributes for the HUC8s
-    selectDF = dataDF[dataDF["HUC_12"].str[:8].isin(huc8s)]
-    return selectDF
-
-def mergePresAbs(sppFN,speciesName,dataDF):
-    '''Adds a column of species presence/absence to the dataFN'''
-    #Create a data frame from the species data
-    useCols = ["FEATUREID",speciesName]
-    eoDF = pd.read_csv(sppFN,usecols=useCols,dtype={'FEATUREID':str})
-
-    #Join the presence absence data to the catchment data frame
-    outDF = pd.merge(eoDF,dataDF,how='right',on="FEATUREID")    
-    
-    #Set Nan to Zeros
-    outDF[speciesName] = outDF[speciesName].fillna(0)
-
-    return outDF
 
-def removeAbsenceNullRows(theDF,speciesName):
-    '''Remove ROWS where spp is absence and attribute has -9999'''
-    #Loop through each field
-    for fld in list(theDF.columns):
-        theDF2 = theDF[~((theDF[speciesName] == 0) & (theDF[fld] == -9999))]
-    return theDF2
-
-def removePresenceNullColumns(theDF,log=""):
-    '''Remove COLUMNS with missing data in species presence rows'''
-    for fld in list(theDF.columns):
-        #Get the min value of the field
-        if theDF[fld].min() == -9999:
-            #Drop the fields
-            if log:
-                log.write("   ...Removing: {}\n".format(fld))
-            theDF.drop(fld,axis=1,inplace=True)
-    return theDF
-
-def removeUncorrelated(theDF,speciesName,log=""):
-    '''Remove attributes with no correlation with presence/absence'''
-    '''Returns: the culled data frame & a dict of fields and their correlations'''
-    #Initialize the correlation dictionary
-    corDict = {}
-    sppVector = theDF[speciesName]
-    #Compute correlation with presence/absence
-    for fld in list(theDF.columns)[6:]:
-        envVector = theDF[fld]
-        pearson = stats.pearsonr(sppVector, envVector)
-        coeff = pearson[0]
-        pValue = pearson[1]
-        #Print output to the CSV file
-        if abs(pValue) > 0.05:
-            log.write("   ...Removing %s [p=%2.3f]\n"%(fld,pValue))
-            theDF.drop(fld,axis=1,inplace=True)
-        else:
-            #Add the field to the correlation dictionary
-            corDict[fld] = coeff
-    #Return column values
-    sppVector.replace(0,"Background",inplace=True)
-    sppVector.replace(1,sppName,inplace=True)
-    return theDF, corDict
-
-def removeXCorrelated(theDF, corrDict, log, threshold=0.75):
-    #Initialize the list of fields to drop
-    dropFlds = []
-    #Create a list of fields from the corrDict keys, sorted on value
-    flds = sorted(corrDict,key=corrDict.get)
-    nCols = len(flds)
-    #Compute cross correlation pairs; add field to drop list
-    for i in range(0,nCols):
-        #Get the ith field; skip already marked for deletion
-        iFld = flds[i]
-        if iFld in dropFlds:
-            continue
-        #Get the correlation
-        for j in range(0,nCols):
-            if j > i: #Only process half the matrix
-                #Get the jth field
-                jFld =flds[j]
-                #Skip if one of the fields is already marked for deletion
-                if jFld in dropFlds:
-                    continue
-                #Get the value vectors for each field
-                v1 = theDF[iFld]
-                v2 = theDF[jFld]
-                # Calculate the correlation coefficient
-                pearson = stats.pearsonr(v1, v2)[0]
-                # If the coefficient is > the threshold consider them redundant and add to the CSV
-                if abs(pearson) >= float(threshold):
-                    log.write("     %s & %s xcorrelated @ %2.2f; "%(iFld,jFld,pearson))
-                    #Because the fields are sorted, drop the 2nd field (lower correlation)
-                    if not (jFld in dropFlds): dropFlds.append(jFld)
-    #Drop cross correlated fields
-    for dropFld in dropFlds:
-        theDF.drop(dropFld,axis=1,inplace=True)
-    #Return the data frame
-    return theDF
-
-##------Procedures--------
-#Get a list of species names from the Speciesoccurrences.csv file
-with open(eoCSV,'rt') as eoFile:
-    lineText=eoFile.readline()
-allHeaders = lineText.split(",")
-sppNames = allHeaders[4:]
-
-#Loop through all species
-for sppName in sppNames:
+def rangeRecords(huc8s,dataDF,logFile):
+    '''Returns the records of a species range: those supplied (from the batch extract), or
+       else those extracted from the StreamCat data'''
+    if dataDF is not None:
+        logFile.write("   Selecting records from the batch extract\n")
+        return dataDF
+    def report(txt):
+        msg(txt)
+        logFile.write("   {}\n".format(txt))
+    return sc.extractHUC8s(storeFldr,streamCatFldr,catalogFN,huc8s,report)
+
+def createSWDFile(sppName,huc8s,dataDF=None):
+    '''Culls the records of a species' HUC8s and writes them, with the species' presence
+       and absence, to the species' SWD file, logging each step to the species' metadata
+       file. The records are extracted from the StreamCat data if not supplied.'''
     #Set the output filename
     outFN = os.path.join(speciesFldr,'{}_swd.csv'.format(sppName))
-    if os.path.exists(outFN):
-        print "{} exists; skipping".format(sppName)
-        continue
 
     #Aux files
     logFilename = outFN[:-4] + "_metadata.txt"
@@ -208,102 +137,31 @@ for sppName in sppNames:
     logFile.write("SWD FILE CREATION FOR {}\n".format(sppName.upper()))
     logFile.write("File created at {}:{} on {}/{}/{}\n".format(now.hour,now.minute,now.month,now.day,now.year))
                   
-    #Create a list of HUC8s in which the species was observed
-    huc8s = getHUC8s(eoCSV, sppName)
     msg("{} was found in {} HUC8s".format(sppName, len(huc8s)))
     logFile.write("{} was found in {} HUC8s\n".format(sppName, len(huc8s)))
 
-    #Loop through StreamCat file & create dataframes of just the HUC8 records in each
-    allFiles = os.listdir(streamCatFldr)     # List if all files in the StreamCat folder
-    dataFrames = []                     # Initialize the list of dataFrames
-    firstFile = True                    # Initialize variable to see if it's the first variable
-
-    for f in allFiles:                  # Loop through the StreamCat files
-        if f[-4:] == ".csv":            # Only process the CSV files
-            #Get the full file name
-            fullFN = os.path.join(streamCatFldr,f)
-            print ".",
-            #msg("   Extracting records from {}".format(f))
-            logFile.write("   Extracting records from {}\n".format(f))
-            #Retrieve only the HUC8 records as a data frame using above function
-            dataDF = spatialSelect(fullFN,huc8s)
-            #If not the first file, then remove the 1st 5 columns (duplicates)
-            if  firstFile:
-                firstFile = False
-                colNames = list(dataDF.columns)
-            else:
-                #Cross check the column names to skip duplicates
-                newCols = []
-                for col in list(dataDF.columns):
-                    if not (col in colNames):
-                        newCols.append(col)  #Add to list of cols to add
-                        colNames.append(col) #Add to full column list
-                dataDF = dataDF[newCols]
-            #Convert columns to smaller datatypes to save memory
-            for c in dataDF.columns:
-                if dataDF[c].dtype.type == np.float64:
-                    dataDF[c]= dataDF[c].astype(np.float32)
-                if dataDF[c].dtype.type == np.int64:
-                    dataDF[c]= dataDF[c].astype(np.int32)
-            #Append to the list of data frames
-            dataFrames.append(dataDF)
-
-    #Merge all file data frames into one
-    msg("Merging data frames")
-    dataDF = pd.concat(dataFrames,axis=1)
-
-    #Remove single dfs to free memory
-    del dataFrames
-
-    #Add species presence absence data
-    msg("Prepending presence absence to data frame")
-    sppDF = mergePresAbs(eoCSV,sppName,dataDF)
-
-    #Remove the OID column
-    sppDF.drop("OID",axis=1,inplace=True)
-    msg("Resulting table has {0} columns and {1} records".format(sppDF.shape[1],sppDF.shape[0]))
-
-    #Cull absence rows where columns have no data         
-    msg("Removing absence records with no catchment data")
-    logFile.write("Checking for absence records with missing catchment data\n")
-    startRowCount = len(sppDF)
-    sppDF = removeAbsenceNullRows(sppDF,sppName)
-    endRowCount = len(sppDF)
-    droppedRowCount = startRowCount - endRowCount
-    msg("...{} records dropped".format(droppedRowCount))
-    logFile.write("...{} absence records deleted for missing data\n".format(droppedRowCount))
-
-    #Cull catchment attributes with no data
-    msg("Removing catchment attributes with null values")
-    logFile.write("Checking for catchment attributes with null values\n")
-    startColCount = sppDF.shape[1]
-    sppDF = removePresenceNullColumns(sppDF,logFile)
-    endColCount = sppDF.shape[1]
-    droppedColCount = startColCount - endColCount
-    if droppedColCount > 0:
-        msg("...{} columns dropped".format(droppedColCount))
-        logFile.write("   ...{} columns removed for missing data\n".format(droppedColCount))
-
-    #Cull catchment attributes not correlated with presence absence
-    msg("Removing attributes not correlated with presence absence")
-    logFile.write("Removing attributes not correlated with presence absence\n")
-    startColCount = sppDF.shape[1]
-    sppDF,correlationDict = removeUncorrelated(sppDF,sppName,logFile)
-    endColCount = sppDF.shape[1]
-    droppedColCount = startColCount - endColCount
-    if droppedColCount > 0:
-        msg("...{} columns dropped".format(droppedColCount))
-        logFile.write("   ...{} columns removed: no sign. corr.\n".format(droppedColCount))
-
-    msg("Removing cross correlated attributes")
-    logFile.write("Checking for cross correlated columns\n")
-    startColCount = sppDF.shape[1]
-    sppDF = removeXCorrelated(sppDF,correlationDict,logFile)
-    endColCount = sppDF.shape[1]
-    droppedColCount = startColCount - endColCount
-    if droppedColCount > 0:
-        msg("...{} X correlated cols dropped".format(droppedColCount))
-        logFile.write("   ...{} X correlated cols dropped\n".format(droppedColCount))
+    if dataDF is None and chunkRows > 0 and os.path.exists(storeFldr):
+        sppDF = su.streamSpecies(storeFldr,catalogFN,eoCSV,sppName,huc8s,chunkRows,logFile,pThreshold,xcorrThreshold,msg)
+    else:
+        #Records to be extracted may instead be cut from the cached table of a range holding
+        # these HUC8s
+        subset = None
+        if dataDF is None:
+            subset = lambda table: su.tableBackground(su.batchSubset(storeFldr,catalogFN,huc8s,table["data"],None))
+        background = su.rangeBackground(huc8s,lambda: su.tableBackground(rangeRecords(huc8s,dataDF,logFile)),logFile,subset)
+        sppDF = su.screenSpecies(eoCSV,sppName,background,logFile,pThreshold,xcorrThreshold,msg)
+    #Hand the species back to the main process if this worker is over its memory budget
+    checkBudget()
+
+    #Thin the presence records, if a maximum per HUC12 is set
+    if maxPresences > 0:
+        sppDF, nRemoved = su.thinSpeciesPresences(sppDF,sppName,maxPresences,thinDigits,sampleSeed,logFile)
+        if nRemoved: msg("...{} presence records removed by thinning".format(nRemoved))
+
+    #Cap the background records, if a maximum is set
+    if maxBackground > 0:
+        sppDF, nBackground = su.sampleSpeciesBackground(sppDF,sppName,maxBackground,stratumDigits,sampleSeed,logFile)
+        if nBackground: msg("Sampling {} of {} background records".format(maxBackground,nBackground))
 
     msg("Adjusting column names to work with MaxEnt")
     logFile.write("Adjusting column names to work with MaxEnt\n")
@@ -316,9 +174,166 @@ for sppName in sppNames:
 
 
     #write file to csv
+    memReport = sc.memoryReport("culled",sppDF)
+    msg(memReport)
+    logFile.write(memReport + "\n")
     msg("Writing file to {}".format(outFN))
     logFile.write("File written to {}\n".format(outFN))
-    sppDF.to_csv(outFN,index_label="OID",index=False)
+    #(Worker processes can't start processes of their own)
+    su.writeSWD(outFN,sppDF,swdPrecision,nProcesses=1 if workerMode else nProcesses)
 
     #close the log file
-    logFile.close()
\ No newline at end of file
+    logFile.close()
+
+def checkBudget():
+    '''Raises a MemoryError in a worker process using more than its memory budget (its peak
+       use, where the current use is unavailable), so the job is built in the main process'''
+    if not workerMode: return
+    current, peak = sc.memoryUsage()
+    used = peak if current is None else current
+    if used is not None and used > workerMemoryMB:
+        raise MemoryError("{:.0f} MB used, over the worker budget of {} MB".format(used,workerMemoryMB))
+
+def buildSpecies(job):
+    '''Creates the SWD files of the species sharing a range (in a worker process, in parallel
+       mode); returns a list of the species names and error messages (None if the file was
+       created), the number of background tables reused and built (as in cacheCounts), and the
+       species left for the main process if the worker ran out of memory or went over its budget'''
+    sppNames, huc8s, dataDF = job
+    counts = dict(su.cacheCounts)
+    results = []
+    requeued = []
+    for i, sppName in enumerate(sppNames):
+        try:
+            createSWDFile(sppName,huc8s,dataDF)
+        except Exception, e:
+            #Remove any partial output so the species is rebuilt on the next run
+            outFN = os.path.join(speciesFldr,'{}_swd.csv'.format(sppName))
+            if os.path.exists(outFN): os.remove(outFN)
+            if workerMode and isinstance(e,MemoryError):
+                requeued = sppNames[i:]
+                su.backgroundCache.clear()
+                su.blockCache.clear()
+                break
+            results.append((sppName,"{}: {}".format(type(e).__name__,e)))
+        else:
+            results.append((sppName,None))
+    #(The range's background table is kept for later ranges within it)
+    for key in counts:
+        counts[key] = su.cacheCounts[key] - counts[key]
+    return results, counts, requeued
+
+def swdFile(sppName):
+    '''Returns the SWD filename of a species'''
+    return os.path.join(speciesFldr,'{}_swd.csv'.format(sppName))
+
+def initWorker():
+    '''Sets up a worker process: messages go to the species logs only'''
+    global workerMode
+    workerMode = True
+
+##------Procedures--------
+if __name__ == "__main__":
+    #Get a list of species names from the Speciesoccurrences.csv file
+    sppNames = su.speciesNames(eoCSV)
+
+    #List the species whose SWD file is missing or was built from other inputs or settings
+    settings = {"noData":list(su.noDataValues),"pThreshold":pThreshold,
+                "xcorrThreshold":xcorrThreshold,"swdPrecision":swdPrecision,
+                "maxBackground":maxBackground,"stratumDigits":stratumDigits,"sampleSeed":sampleSeed,
+                "maxPresences":maxPresences,"thinDigits":thinDigits}
+    provenance = su.buildKeys(eoCSV,os.path.dirname(streamCatFldr),su.streamCatSources(storeFldr,streamCatFldr),sppNames,settings)
+    todoNames = []
+    for sppName in sppNames:
+        if su.isCurrent(swdFile(sppName),provenance[sppName]):
+            print "{} is up to date; skipping".format(sppName)
+        else:
+            todoNames.append(sppName)
+
+    #Create lists of the HUC8s in which each species was observed
+    sppHUC8s = su.speciesHUC8s(eoCSV,todoNames)
+
+    #In batch mode, extract the records of all the species' HUC8s in one pass over the data
+    chunked = chunkRows > 0 and os.path.exists(storeFldr)
+    allDF = allHUC8Col = None
+    if batchMode and todoNames and not chunked:
+        allHUC8s = su.unionHUC8s(sppHUC8s)
+        msg("Extracting records for {} species in {} HUC8s".format(len(todoNames),len(allHUC8s)))
+        allDF = sc.extractHUC8s(storeFldr,streamCatFldr,catalogFN,allHUC8s,msg)
+        allHUC8Col = allDF["HUC_12"].str[:8]
+        msg(sc.memoryReport("extracted all",allDF))
+
+    #Clear the cached HUC8 statistics if the attribute matrix has changed (before any
+    # worker uses them)
+    if chunkRows > 0 and os.path.exists(sc.matrixFile(storeFldr)):
+        su.huc8StatsFolder(storeFldr)
+
+    #Group the species sharing a range, to build each range's background table once
+    groups = su.rangeGroups(todoNames,sppHUC8s)
+    counts = {"hits":0,"near":0,"misses":0}
+
+    failed = []
+    if nProcesses > 1 and len(groups) > 1:
+        #Ranges whose records would exceed a worker's memory budget are built here, one
+        # at a time, after the others
+        poolGroups = []
+        largeGroups = []
+        unsized = 0
+        for sppNames in groups:
+            jobMB = su.jobMemoryMB(storeFldr,catalogFN,sppHUC8s[sppNames[0]],allDF,allHUC8Col,chunked)
+            if jobMB is None:
+                unsized += 1
+            elif jobMB > workerMemoryMB:
+                largeGroups.append(sppNames)
+            else:
+                poolGroups.append(sppNames)
+        if unsized:
+            msg("No attribute store or catalog to size {} ranges by; they are checked against the worker memory budget only as they are built".format(unsized),"warning")
+        nPool = sum([len(sppNames) for sppNames in poolGroups])
+        msg("Building {} species ({} ranges) in {} processes".format(nPool,len(poolGroups),nProcesses))
+
+        #Build the ranges in parallel, holding the records of at most one range per worker
+        slots = threading.BoundedSemaphore(nProcesses)
+        pool = multiprocessing.Pool(nProcesses,initWorker)
+        jobs = su.rangeJobs(poolGroups,sppHUC8s,storeFldr,catalogFN,allDF,allHUC8Col,slots)
+        nDone = 0
+        for results, jobCounts, requeued in pool.imap_unordered(buildSpecies,jobs):
+            slots.release()
+            for key in counts: counts[key] += jobCounts[key]
+            if requeued:
+                #Build the rest of the range in this process, after the others
+                largeGroups.append(requeued)
+                nPool -= len(requeued)
+                msg("{} over the worker memory budget; building in this process".format(", ".join(requeued)),"Warning")
+            for sppName, error in results:
+                nDone += 1
+                if error:
+                    failed.append((sppName,error))
+                else:
+                    su.writeProvenance(swdFile(sppName),provenance[sppName])
+                msg("{} {} ({} of {})".format(sppName,"failed" if error else "done",nDone,nPool))
+        pool.close()
+        pool.join()
+    else:
+        largeGroups = groups
+
+    #Build the remaining ranges in this process
+    for results, jobCounts, requeued in map(buildSpecies,su.rangeJobs(largeGroups,sppHUC8s,storeFldr,catalogFN,allDF,allHUC8Col)):
+        for key in counts: counts[key] += jobCounts[key]
+        for sppName, error in results:
+            if error:
+                failed.append((sppName,error))
+            else:
+                su.writeProvenance(swdFile(sppName),provenance[sppName])
+
+    #Report how often species shared a background table
+    nTables = sum(counts.values())
+    if nTables > 0:
+        msg("Background tables: {} built, {} cut from a wider range's, {} reused ({:.0%} hit rate)".format(
+            counts["misses"],counts["near"],counts["hits"],counts["hits"] / float(nTables)))
+
+    if failed:
+        msg("{} species failed:".format(len(failed)),"Error")
+        for sppName, error in failed:
+            msg("   {} ({})".format(sppName,error),"Error")
+        sys.exit(1)
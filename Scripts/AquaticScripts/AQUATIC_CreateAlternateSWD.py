@@ -24,6 +24,11 @@ import sys, os, arcpy
 import pandas as pd
 import numpy as np
 
+#StreamCat attribute store functions (in the DataPrep scripts folder)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))),"DataPrep"))
+import STREAMCAT_utils as sc
+import SPECIES_utils as su
+
 arcpy.env.overwriteOutput = True
 arcpy.CheckOutExtension("spatial")
 if not arcpy.env.scratchWorkspace:
@@ -33,6 +38,7 @@ if not arcpy.env.scratchWorkspace:
 projectFC = sys.argv[1]     #r'C:\workspace\GeoWET\Data\Templates\ExampleProject.shp'
 projectType = sys.argv[2]   #'Wetland'
 dataFolder = sys.argv[3]    #r'C:\workspace\GeoWET\Data\StreamCat\AllRegions'
+storeFldr = sc.storeFolder(dataFolder)
 
 #Static inputs
 fieldMapXLS = sys.argv[4]   #r'C:\workspace\GeoWET\Data\StreamCat\StreamCatInfo.csv'
@@ -49,6 +55,8 @@ flowNetFC = os.path.join(os.path.dirname(flowNet),"NHDFlowlines")
 projectSWDFile = sys.argv[10]#r'C:\workspace\GeoWET\Scratch\ExampleProject_SWD.csv'
 currentSWDFile = projectSWDFile.replace(".csv","CUR.csv")
 changeFile = projectSWDFile.replace(".csv","NLCD.csv")
+#Significant digits of the attribute values written to the SWD files
+swdPrecision = su.swdPrecision
 
 ##-----------FUNCTIONS----------
 def msg(txt,severity=""):
@@ -105,18 +113,29 @@ def getDownstreamGridCodes(gridcode,catchFC,flownet,flownetFC):
 def getCatchmentData(csvFile,downstreamCodes):
     '''Creates a dataframe of the HUC8 Records from a catchment attribute file'''
     #Convert CSV to pandas data frame
-    dtypes = {"GRIDCODE":np.long,"FEATUREID":np.str,"REACHCODE":np.str,"HUC_12":np.str} 
-    fullDF = pd.read_csv(csvFile,dtype=dtypes)
+    dtypes = sc.keyDtypes
+    #Read just the selected rows from the attribute store, if it has been created
+    if os.path.exists(storeFldr):
+        rows = sc.gridcodeRows(storeFldr,downstreamCodes)
+        return sc.readStore(storeFldr,os.path.basename(csvFile),rows=rows,dtypes=dtypes)
+    fullDF = sc.readCSV(csvFile)
     #Subset records
     selectDF = fullDF[fullDF["GRIDCODE"].isin(downstreamCodes)]
     return selectDF
 
 def makeDataFramefromCSVs(dataFldr,gridcodes):
     '''Returns a dataframe of stream cat attributes for selected gridcodes'''
+    #Read all attributes at once from the attribute matrix, if built
+    if os.path.exists(sc.matrixFile(storeFldr)):
+        msg("Reading catchment attributes from the attribute matrix")
+        return sc.readMatrix(storeFldr,rows=sc.gridcodeRows(storeFldr,gridcodes),dtypes=sc.keyDtypes)
     #Initialize the list of dataframes to merge
     dataFrames = []
-    #Get a listing of all the files in the folder
-    dataFiles = os.listdir(dataFldr)
+    #Get a listing of all the files in the folder (or attribute store)
+    if os.path.exists(storeFldr):
+        dataFiles = sc.storeFiles(storeFldr)
+    else:
+        dataFiles = os.listdir(dataFldr)
     #Loop through each file
     for dataFile in dataFiles:
         #Skip if not a CSV file
@@ -256,7 +275,7 @@ dataDF = makeDataFramefromCSVs(dataFolder,gridCodes)
 msg("{} catchment attributes extracted".format(dataDF.shape[1]))
 #Write out unmodified dataframe as current conditions
 curDF = dataDF.copy()
-curDF.to_csv(currentSWDFile,index_label="OID",index=False)
+su.writeSWD(currentSWDFile,curDF,swdPrecision)
 #Create dataframe to include NLCD changes, for accounting
 diffDF = dataDF.copy()  #Difference file; shows changes
 diffCols = ["GRIDCODE"] #List of columns to keep in diff file; this will grow
@@ -363,7 +382,7 @@ for gridcode in gridCodes:
 
 #Write out data
 msg("Writing data to: {}".format(projectSWDFile))
-dataDF.to_csv(projectSWDFile,index_label="OID",index=False)
+su.writeSWD(projectSWDFile,dataDF,swdPrecision)
 
 #Select only changed columns from diffDF
 msg("Writing change file to: {}".format(changeFile))
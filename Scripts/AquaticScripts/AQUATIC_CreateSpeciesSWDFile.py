@@ -5,7 +5,9 @@
 #  culls data (rows and then columns) to eliminate Null values. 
 #
 # USAGE: ExtractSpeciesData(Species Name, Species Occurrences CSV file,
-#                           Stream Cat data folder, Output SWD filename)
+#                           Stream Cat data folder, Output SWD filename,
+#                           [Maximum background records],
+#                           [Maximum presence records per HUC12])
 #
 # REQUIREMENTS: pandas, numpy, scipy
 #
@@ -22,7 +24,10 @@
 #  - Identify and remove COLUMNS that don't have a correlation with presence/absence
 #  - Identify cross correlated columns; remove lower ranking column
 #  - Arranges columns for MaxEnt processing 
-#  - Writes out the records as CSV file in MaxEnt SWD format
+#  - Optionally thins the presence records to a maximum per HUC12
+#  - Optionally caps the background records, sampling each HUC8 (or HUC10) alike
+#  - Writes out the records as CSV file in MaxEnt SWD format, with attribute values to
+#    swdPrecision significant digits (see the SWD WRITER functions in SPECIES_utils.py)
 #
 # June 2016
 # John.Fay@duke.edu
@@ -30,14 +35,37 @@
 import sys, os, datetime
 import pandas as pd
 import numpy as np
-from scipy import stats
 import arcpy
 
+#StreamCat attribute store functions (in the DataPrep scripts folder)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))),"DataPrep"))
+import STREAMCAT_utils as sc
+import SPECIES_utils as su
+
 #Script inputs
 sppName = sys.argv[1] #'Nocomis_leptocephalus'
 dataFldr = sys.argv[2] #r'C:\workspace\GeoWET\Data\StreamCat\AllRegions'
 eoCSV = sys.argv[3] #r'C:\workspace\GeoWET\Data\ToolData\SpeciesOccurrences.csv'
 outFN = sys.argv[4] #r'C:\workspace\GeoWET\Data\SpeciesModels\{}_swd.csv'.format(sppName)
+storeFldr = sc.storeFolder(dataFldr)
+catalogFN = sc.catalogFile(os.path.dirname(dataFldr))
+#Maximum background records (0 = keep all), sampled from each HUC8 (stratumDigits = 8) or
+# HUC10 (10) with a fixed seed, so the sample is reproducible
+maxBackground = 0
+if len(sys.argv) > 5 and sys.argv[5] not in ("","#"): maxBackground = int(sys.argv[5])
+stratumDigits = 8
+sampleSeed = su.sampleSeed
+#Maximum presence records kept in each HUC12 (thinDigits = 12) or coarser HUC (0 = keep all),
+# drawn with the same seed
+maxPresences = 0
+if len(sys.argv) > 6 and sys.argv[6] not in ("","#"): maxPresences = int(sys.argv[6])
+thinDigits = 12
+#Significant digits of the attribute values written to the SWD file
+swdPrecision = su.swdPrecision
+#Attributes whose correlation with presence/absence has a p value above this are culled
+pThreshold = su.pThreshold
+#Of two attributes correlated above this, the one less correlated with presence is culled
+xcorrThreshold = su.xcorrThreshold
 
 #Aux files
 logFilename = outFN[:-4] + "_metadata.txt"
@@ -55,14 +83,16 @@ def msg(txt,severity=""):
             arcpy.AddMessage(txt)
     except:
         pass
+
+def report(txt):
+    '''Reports a message and writes it to the log file'''
+    msg(txt)
+    logFile.write(txt + "\n")
+
 def checkSpeciesName(speciesName,sppFN):
     '''Ensures that the supplied species name exists in the observation table'''
-    import csv
-    fileObj = open(eoCSV,'rt')
-    csvReader = csv.reader(fileObj)
-    fldNames = csvReader.next()
-    fileObj.close()
-    if not speciesName in fldNames:
+    #Look up the name in the occurrence index
+    if not speciesName in su.occurrenceIndex(eoCSV)["position"]:
         msg("***{}*** does not occur in the \n   {} file".format(speciesName,sppFN),"Error")
         sys.exit(1)
     else:
@@ -70,117 +100,8 @@ def checkSpeciesName(speciesName,sppFN):
 
 def getHUC8s(sppFN,speciesName):
     '''Returns a list of the HUC8s in which a species occurs'''
-    #Create a data frame from the species data
-    useCols = ["REACHCODE",speciesName]
-    eoDF = pd.read_csv(sppFN,usecols=useCols,dtype={'REACHCODE':str})
-    #Pull just the records where the species occurs
-    sppDF = eoDF[eoDF[speciesName] == 1]
-    #Get a list of the huc8s in which the spp is found
-    huc8s = sppDF['REACHCODE'].str[:8].unique()
-    #Return the list
-    return huc8s.tolist()
-
-def spatialSelect(dataFN,huc8List):
-    '''Returns a dataframe of the catchment attributes for the HUC8s in the list'''
-    #Load the catchment attributes into a data frame
-    dtypes = {"GRIDCODE":np.str,"FEATUREID":np.str,"REACHCODE":np.str,"HUC_12":np.str} 
-    dataDF = pd.read_csv(dataFN,dtype=dtypes)#,index_col="FEATUREID")
-
-    #Filter the cachment attributes for the HUC8s
-    selectDF = dataDF[dataDF["HUC_12"].str[:8].isin(huc8s)]
-    return selectDF
-
-def mergePresAbs(sppFN,speciesName,dataDF):
-    '''Adds a column of species presence/absence to the dataFN'''
-    #Create a data frame from the species data
-    useCols = ["FEATUREID",speciesName]
-    eoDF = pd.read_csv(sppFN,usecols=useCols,dtype={'FEATUREID':str})
-
-    #Join the presence absence data to the catchment data frame
-    outDF = pd.merge(eoDF,dataDF,how='right',on="FEATUREID")    
-    
-    #Set Nan to Zeros
-    outDF[speciesName] = outDF[speciesName].fillna(0)
-
-    return outDF
-
-def removeAbsenceNullRows(theDF,speciesName):
-    '''Remove ROWS where spp is absence and attribute has -9999'''
-    #Loop through each field
-    for fld in list(theDF.columns):
-        theDF = theDF[~((theDF[speciesName] == 0) & (theDF[fld] == -9999))]
-    return theDF
-
-def removePresenceNullColumns(theDF,log=""):
-    '''Remove COLUMNS with missing data in species presence rows'''
-    for fld in list(theDF.columns):
-        #Get the min value of the field
-        if theDF[fld].min() == -9999:
-            #Drop the fields
-            if log:
-                log.write("   ...Removing: {}\n".format(fld))
-            theDF.drop(fld,axis=1,inplace=True)
-    return theDF
-
-def removeUncorrelated(theDF,speciesName,log=""):
-    '''Remove attributes with no correlation with presence/absence'''
-    '''Returns: the culled data frame & a dict of fields and their correlations'''
-    #Initialize the correlation dictionary
-    corDict = {}
-    sppVector = theDF[speciesName]
-    #Compute correlation with presence/absence
-    for fld in list(theDF.columns)[6:]:
-        envVector = theDF[fld]
-        pearson = stats.pearsonr(sppVector, envVector)
-        coeff = pearson[0]
-        pValue = pearson[1]
-        #Print output to the CSV file
-        if abs(pValue) > 0.05:
-            log.write("   ...Removing %s [p=%2.3f]\n"%(fld,pValue))
-            theDF.drop(fld,axis=1,inplace=True)
-        else:
-            #Add the field to the correlation dictionary
-            corDict[fld] = coeff
-    #Return column values
-    sppVector.replace(0,"Background",inplace=True)
-    sppVector.replace(1,sppName,inplace=True)
-    return theDF, corDict
-
-def removeXCorrelated(theDF, corrDict, log, threshold=0.75):
-    #Initialize the list of fields to drop
-    dropFlds = []
-    #Create a list of fields from the corrDict keys, sorted on value
-    flds = sorted(corrDict,key=corrDict.get)
-    nCols = len(flds)
-    #Compute cross correlation pairs; add field to drop list
-    for i in range(0,nCols):
-        #Get the ith field; skip already marked for deletion
-        iFld = flds[i]
-        if iFld in dropFlds:
-            continue
-        #Get the correlation
-        for j in range(0,nCols):
-            if j > i: #Only process half the matrix
-                #Get the jth field
-                jFld =flds[j]
-                #Skip if one of the fields is already marked for deletion
-                if jFld in dropFlds:
-                    continue
-                #Get the value vectors for each field
-                v1 = theDF[iFld]
-                v2 = theDF[jFld]
-                # Calculate the correlation coefficient
-                pearson = stats.pearsonr(v1, v2)[0]
-                # If the coefficient is > the threshold consider them redundant and add to the CSV
-                if abs(pearson) >= float(threshold):
-                    log.write("     %s & %s xcorrelated @ %2.2f; "%(iFld,jFld,pearson))
-                    #Because the fields are sorted, drop the 2nd field (lower correlation)
-                    if not (jFld in dropFlds): dropFlds.append(jFld)
-    #Drop cross correlated fields
-    for dropFld in dropFlds:
-        theDF.drop(dropFld,axis=1,inplace=True)
-    #Return the data frame
-    return theDF
+    #Get the list of huc8s in which the spp is found from the occurrence index
+    return su.indexHUC8s(su.occurrenceIndex(sppFN),speciesName)
 
 ##------Procedures--------
 #Check that the species SWD has not been created already
@@ -202,96 +123,21 @@ huc8s = getHUC8s(eoCSV, sppName)
 msg("{} was found in {} HUC8s".format(sppName, len(huc8s)))
 logFile.write("{} was found in {} HUC8s\n".format(sppName, len(huc8s)))
 
-#Loop through StreamCat file & create dataframes of just the HUC8 records in each
-allFiles = os.listdir(dataFldr)     # List if all files in the StreamCat folder
-dataFrames = []                     # Initialize the list of dataFrames
-firstFile = True                    # Initialize variable to see if it's the first variable
-
-for f in allFiles:                  # Loop through the StreamCat files
-    if f[-4:] == ".csv":            # Only process the CSV files
-        #Get the full file name
-        fullFN = os.path.join(dataFldr,f)
-        msg("Extracting records from {}".format(f))
-        logFile.write("Extracting records from {}\n".format(f))
-        #Retrieve only the HUC8 records as a data frame using above function
-        dataDF = spatialSelect(fullFN,huc8s)
-        #If not the first file, then remove the 1st 5 columns (duplicates)
-        if  firstFile:
-            firstFile = False
-            colNames = list(dataDF.columns)
-        else:
-            #Cross check the column names to skip duplicates
-            newCols = []
-            for col in list(dataDF.columns):
-                if not (col in colNames):
-                    newCols.append(col)  #Add to list of cols to add
-                    colNames.append(col) #Add to full column list
-            dataDF = dataDF[newCols]
-        #Convert columns to smaller datatypes to save memory
-        for c in dataDF.columns:
-            if dataDF[c].dtype.type == np.float64:
-                dataDF[c]= dataDF[c].astype(np.float32)
-            if dataDF[c].dtype.type == np.int64:
-                dataDF[c]= dataDF[c].astype(np.int32)
-        #Append to the list of data frames
-        dataFrames.append(dataDF)
-
-#Merge all file data frames into one
-msg("Merging data frames")
-dataDF = pd.concat(dataFrames,axis=1)
-
-#Remove single dfs to free memory
-del dataFrames
-
-#Add species presence absence data
-msg("Prepending presence absence to data frame")
-sppDF = mergePresAbs(eoCSV,sppName,dataDF)
-
-#Remove the OID column
-sppDF.drop("OID",axis=1,inplace=True)
-msg("Resulting table has {0} columns and {1} records".format(sppDF.shape[1],sppDF.shape[0]))
-
-#Cull absence rows where columns have no data         
-msg("Removing absence records with no catchment data")
-logFile.write("Checking for absence records with missing catchment data\n")
-startRowCount = len(sppDF)
-sppDF = removeAbsenceNullRows(sppDF,sppName)
-endRowCount = len(sppDF)
-droppedRowCount = startRowCount - endRowCount
-msg("...{} records dropped".format(droppedRowCount))
-logFile.write("...{} absence records deleted for missing data\n".format(droppedRowCount))
+#Extract the records of the HUC8s, from the attribute matrix, if built, or else each StreamCat file
+dataDF = sc.extractHUC8s(storeFldr,dataFldr,catalogFN,huc8s,report)
 
-#Cull catchment attributes with no data
-msg("Removing catchment attributes with null values")
-logFile.write("Checking for catchment attributes with null values\n")
-startColCount = sppDF.shape[1]
-sppDF = removePresenceNullColumns(sppDF,logFile)
-endColCount = sppDF.shape[1]
-droppedColCount = startColCount - endColCount
-if droppedColCount > 0:
-    msg("...{} columns dropped".format(droppedColCount))
-    logFile.write("   ...{} columns removed for missing data\n".format(droppedColCount))
+#Add species presence absence data and cull the records and attributes
+sppDF = su.screenSpecies(eoCSV,sppName,su.tableBackground(dataDF),logFile,pThreshold,xcorrThreshold,msg)
 
-#Cull catchment attributes not correlated with presence absence
-msg("Removing attributes not correlated with presence absence")
-logFile.write("Removing attributes not correlated with presence absence\n")
-startColCount = sppDF.shape[1]
-sppDF,correlationDict = removeUncorrelated(sppDF,sppName,logFile)
-endColCount = sppDF.shape[1]
-droppedColCount = startColCount - endColCount
-if droppedColCount > 0:
-    msg("...{} columns dropped".format(droppedColCount))
-    logFile.write("   ...{} columns removed: no sign. corr.\n".format(droppedColCount))
+#Thin the presence records, if a maximum per HUC12 is set
+if maxPresences > 0:
+    sppDF, nRemoved = su.thinSpeciesPresences(sppDF,sppName,maxPresences,thinDigits,sampleSeed,logFile)
+    if nRemoved: msg("...{} presence records removed by thinning".format(nRemoved))
 
-msg("Removing cross correlated attributes")
-logFile.write("Checking for cross correlated columns\n")
-startColCount = sppDF.shape[1]
-sppDF = removeXCorrelated(sppDF,correlationDict,logFile)
-endColCount = sppDF.shape[1]
-droppedColCount = startColCount - endColCount
-if droppedColCount > 0:
-    msg("...{} X correlated cols dropped".format(droppedColCount))
-    logFile.write("   ...{} X correlated cols dropped\n".format(droppedColCount))
+#Cap the background records, if a maximum is set
+if maxBackground > 0:
+    sppDF, nBackground = su.sampleSpeciesBackground(sppDF,sppName,maxBackground,stratumDigits,sampleSeed,logFile)
+    if nBackground: msg("Sampling {} of {} background records".format(maxBackground,nBackground))
 
 msg("Adjusting column names to work with MaxEnt")
 logFile.write("Adjusting column names to work with MaxEnt\n")
@@ -304,9 +150,12 @@ sppDF.drop('HUC_12',axis=1,inplace=True)
 
 
 #write file to csv
+memReport = sc.memoryReport("culled",sppDF)
+msg(memReport)
+logFile.write(memReport + "\n")
 msg("Writing file to {}".format(outFN))
 logFile.write("File written to {}\n".format(outFN))
-sppDF.to_csv(outFN,index_label="OID",index=False)
+su.writeSWD(outFN,sppDF,swdPrecision)
 
 #close the log file
 logFile.close()
\ No newline at end of file
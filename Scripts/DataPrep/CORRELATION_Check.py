@@ -0,0 +1,85 @@
+#CORRELATION_Check.py
+#
+#Checks the vectorized correlation functions in SPECIES_utils.py against scipy.stats.pearsonr
+# applied to each column (or pair of columns) of random data: the correlation with presence
+# and its p-value (presenceCorrelations, and screenCorrelations of a screen accumulated in
+# chunks), and the cross correlations (correlationMatrix, screenMatrix). The data include a
+# constant (zero variance) column, a column equal to presence, and a column of large values
+# varying little, and the check fails if any coefficient or p-value differs from pearsonr's
+# beyond the tolerance, or is NaN where pearsonr's is not (or the reverse).
+#
+#Usage: CORRELATION_Check.py [records] [attributes]
+
+import sys, warnings
+import numpy as np
+from scipy import stats
+import SPECIES_utils as su
+
+#Check size and tolerance
+nRows = 5000
+if len(sys.argv) > 1 and sys.argv[1] not in ("","#"): nRows = int(sys.argv[1])
+nAttributes = 20
+if len(sys.argv) > 2 and sys.argv[2] not in ("","#"): nAttributes = int(sys.argv[2])
+tolerance = 1e-8
+chunkRows = 1000
+
+#Random presence (about 5%) and attributes: some shifted where the species is present (so
+# correlated with presence), plus the special columns
+np.random.seed(2016)
+presence = np.random.rand(nRows) < 0.05
+values = np.random.randn(nRows,nAttributes) * 10.0 ** np.random.randint(-2,4,nAttributes)
+values[:,::3] += presence[:,None] * values[:,::3].std(axis=0)
+values[:,1] = values[:,0] * 2 + np.random.randn(nRows) * 0.1
+values[:,2] = 42.0
+values[:,4] = presence
+values[:,5] = 1e6 + np.random.rand(nRows) * 1e-2
+names = ["Attribute{}".format(i) for i in range(nAttributes)]
+names[2], names[4], names[5] = "Constant", "Presence", "LargeValues"
+
+def pearson(x,y):
+    '''Returns scipy.stats.pearsonr of two vectors, without its warning for constant input'''
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return stats.pearsonr(x,y)
+
+def compare(name,expected,found):
+    '''Prints and returns the number of values differing from those expected'''
+    expected, found = np.asarray(expected,dtype=np.float64), np.asarray(found,dtype=np.float64)
+    nanDiffers = np.isnan(expected) <> np.isnan(found)
+    with np.errstate(invalid='ignore'):
+        valueDiffers = np.abs(expected - found) > tolerance * np.maximum(1.0,np.abs(expected))
+    bad = nanDiffers | (valueDiffers & ~np.isnan(expected))
+    error = np.nanmax(np.abs(expected - found)) if np.isfinite(found - expected).any() else 0.0
+    print "{}: largest difference {:.1e}; {}".format(name,error,"{} of {} differ".format(bad.sum(),bad.size) if bad.any() else "OK")
+    return int(bad.sum())
+
+#scipy.stats.pearsonr of each column with presence and of each pair of columns
+expected = [pearson(values[:,i],presence.astype(np.float64)) for i in range(nAttributes)]
+expectedCoeffs = np.array([r for r, p in expected])
+expectedPValues = np.array([p for r, p in expected])
+expectedMatrix = np.array([[pearson(values[:,i],values[:,j])[0] for j in range(nAttributes)]
+                           for i in range(nAttributes)])
+for name, r, p in zip(names,expectedCoeffs,expectedPValues)[:6]:
+    print "   pearsonr of {} with presence: r={:.4f}, p={:.3g}".format(name,r,p)
+
+#Vectorized functions, in memory and from a screen accumulated in chunks
+coeffs, pValues = su.presenceCorrelations(values,presence)
+screen = su.newScreen(names)
+for start in range(0,nRows,chunkRows):
+    su.accumulate(screen,values[start:start+chunkRows],presence[start:start+chunkRows])
+screenCoeffs, screenPValues = su.screenCorrelations(screen)
+
+#Compare (the diagonal of a correlation matrix is left out: pearsonr gives 1 for a column
+# with itself, except a constant column)
+offDiagonal = ~np.eye(nAttributes,dtype=bool)
+nBad = 0
+nBad += compare("presenceCorrelations r",expectedCoeffs,coeffs)
+nBad += compare("presenceCorrelations p",expectedPValues,pValues)
+nBad += compare("screenCorrelations r",expectedCoeffs,screenCoeffs)
+nBad += compare("screenCorrelations p",expectedPValues,screenPValues)
+nBad += compare("correlationMatrix",expectedMatrix[offDiagonal],su.correlationMatrix(values)[offDiagonal])
+nBad += compare("screenMatrix",expectedMatrix[offDiagonal],su.screenMatrix(screen)[offDiagonal])
+if nBad:
+    print "{} values differ from scipy.stats.pearsonr".format(nBad)
+    sys.exit(1)
+print "All values match scipy.stats.pearsonr"
@@ -18,33 +18,44 @@
 #    merged data frame
 #  - Writes the contents out to a CSV file.
 #
+#  In batch mode (batchMode = True, the default), the StreamCat data are read once, for the
+#   union of the HUC8s of all species, and each species' records are selected from that
+#   extract, rather than re-reading every StreamCat file for each species.
+#
+#  A species' model data file is reused only if it was built from the same species
+#   occurrences and StreamCat files, as recorded in its provenance file (see the BUILD
+#   CACHE functions in SPECIES_utils.py); otherwise it is rebuilt.
+#
 # June 2016
 # John.Fay@duke.edu
 
 import sys, os
 import pandas as pd
 import numpy as np
+import STREAMCAT_utils as sc
+import SPECIES_utils as su
 
 #Species to process
 spp = "Nocomis_leptocephalus"
 
+#Extract the data for all species in one pass (True) or separately for each species (False)
+batchMode = True
+
 #Workspaces
 rootDir = os.path.dirname(os.path.dirname(os.path.dirname(sys.argv[0])))
 dataDir = os.path.join(rootDir,"Data")
 eoCSV = os.path.join(dataDir,'ToolData','SpeciesOccurrences.csv')
 dataFldr = os.path.join(dataDir,'StreamCat')
+storeFldr = os.path.join(dataFldr,'Store')
+catalogFN = sc.catalogFile(dataFldr)
 sppFldr = os.path.join(dataDir,'SpeciesModels')
 if not os.path.exists(sppFldr): os.mkdir(sppFldr)
 
 ##--------Functions--------##
 def checkSpeciesName(speciesName,eoCSV):
     '''Ensures that the supplied species name exists in the observation table'''
-    import csv
-    fileObj = open(eoCSV,'rt')
-    csvReader = csv.reader(fileObj)
-    fldNames = csvReader.next()
-    fileObj.close()
-    if not speciesName in fldNames:
+    #Look up the name in the occurrence index
+    if not speciesName in su.occurrenceIndex(eoCSV)["position"]:
         print "***{}*** does not occur in the \n   {} file".format(speciesName,eoCSV)
         print "   Check your species name and try again..."
         sys.exit(1)
@@ -53,41 +64,21 @@ def checkSpeciesName(speciesName,eoCSV):
 
 def getHUC8s(eoCSV,speciesName):
     '''Returns a list of the HUC8s in which a species occurs'''
-    #Create a data frame from the species data
-    useCols = ["REACHCODE",speciesName]
-    eoDF = pd.read_csv(eoCSV,usecols=useCols,dtype={'REACHCODE':str})
-    #Pull just the records where the species occurs
-    sppDF = eoDF[eoDF[speciesName] == 1]
-    #Get a list of the huc8s in which the spp is found
-    huc8s = sppDF['REACHCODE'].str[:8].unique()
-    #Return the list
-    return huc8s.tolist()
-
-def spatialSelect(dataFN,huc8List):
-    '''Returns a dataframe of the catchment attributes for the HUC8s in the list'''
-    #Load the catchment attributes into a data frame
-    dtypes = {"GRIDCODE":np.str,"FEATUREID":np.str,"REACHCODE":np.str,"HUC_12":np.str} 
-    dataDF = pd.read_csv(dataFN,dtype=dtypes)
-
-    #Filter the cachment attributes for the HUC8s
-    selectDF = dataDF[dataDF["HUC_12"].str[:8].isin(huc8s)]
-    return selectDF
+    #Get the list of huc8s in which the spp is found from the occurrence index
+    return su.indexHUC8s(su.occurrenceIndex(eoCSV),speciesName)
+
+def report(txt):
+    '''Prints a message'''
+    print txt
 
 def mergePresAbs(eoCSV,speciesName,dataDF):
     '''Adds a column of species presence/absence to the dataFN'''
-    #Create a data frame from the species data
-    useCols = ["FEATUREID",speciesName]
-    eoDF = pd.read_csv(eoCSV,usecols=useCols,dtype={'FEATUREID':str})
-    
-    #Join the presence absence data to the catchment data frame
-    outDF = pd.merge(eoDF,dataDF,how='right',left_on="FEATUREID",right_on="FEATUREID")
+    #Join the presence absence data (from the occurrence index) to the catchment data frame
+    outDF = su.mergePresence(eoCSV,speciesName,dataDF)
 
     #Add the species field and set default to "background"
     outDF.insert(0,"Species","Background")
 
-    #Change NaNs to "Background
-    outDF[speciesName] = outDF[speciesName].fillna(0)
-
     #Change Species values in records where observed
     outDF.loc[outDF[speciesName] == 1, 'Species'] = speciesName
 
@@ -98,72 +89,52 @@ def mergePresAbs(eoCSV,speciesName,dataDF):
 
 ##------Procedures--------
 #Create list of species names from SpeciesOccurrences.csv
-with open(eoCSV,'rt') as eoFile:
-    header = eoFile.readline()
-headers = header.split(",")
-sppNames = headers[4:]
+sppNames = su.speciesNames(eoCSV)
+
+#List the species whose model csv file is missing or was built from other inputs
+provenance = su.buildKeys(eoCSV,dataFldr,su.streamCatSources(storeFldr,dataFldr),sppNames,{})
+todoNames = []
+for spp in sppNames:
+    if su.isCurrent(os.path.join(sppFldr,'{}.csv'.format(spp)),provenance[spp]):
+        print "{} is up to date; skipping".format(spp)
+    else:
+        todoNames.append(spp)
+
+#Create lists of the HUC8s in which each species was observed
+sppHUC8s = su.speciesHUC8s(eoCSV,todoNames)
+
+#In batch mode, extract the records of all the species' HUC8s in one pass over the data
+if batchMode and todoNames:
+    allHUC8s = su.unionHUC8s(sppHUC8s)
+    print "Extracting records for {} species in {} HUC8s".format(len(todoNames),len(allHUC8s))
+    allDF = sc.extractHUC8s(storeFldr,dataFldr,catalogFN,allHUC8s,report)
+    allHUC8Col = allDF["HUC_12"].str[:8]
+    print sc.memoryReport("extracted all",allDF)
 
 #Loop trhough each species and create a model csv file
-for i, spp in enumerate(sppNames):
+for i, spp in enumerate(todoNames):
     #Set the output file name
     outFN = os.path.join(sppFldr,'{}.csv'.format(spp))
 
-    if os.path.exists(outFN):
-        print "{} exists; skipping".format(spp)
-        continue
-    
-    print "Processing {} ({} of {})".format(spp,i+1,len(sppNames))
+    print "Processing {} ({} of {})".format(spp,i+1,len(todoNames))
   
-    #Create a list of HUC8s in which the species was observed
-    huc8s = getHUC8s(eoCSV, spp)
+    #Get the list of HUC8s in which the species was observed
+    huc8s = sppHUC8s[spp]
     print "{} was found in {} HUC8s".format(spp, len(huc8s))
 
-    ##Loop through StreamCat tables and create a dataframe of just the records
-    ##in the HUC8s where the species was found...
-    allFiles = os.listdir(dataFldr)     # List if all files in the StreamCat folder
-    allFiles.remove("StreamCatInfo.csv")#  remove the StreamCatInfo.csv 
-    dataFrames = []                     # Initialize the list of dataFrames
-    firstFile = True                    # Initialize variable to see if it's the first variable
-
-    for f in allFiles:                  # Loop through the StreamCat files
-        if f[-4:] == ".csv":            # Only process the CSV files
-            #Get the full file name
-            fullFN = os.path.join(dataFldr,f)
-            sys.stdout.flush()
-            print ".",
-            #print "Extracting records from {}".format(f)
-            #Retrieve only the HUC8 records as a data frame using above function
-            dataDF = spatialSelect(fullFN,huc8s)
-            #print "...{} catchment records extracted".format(len(dataDF))
-            #If not the first file, then remove the 1st 5 columns (duplicates)
-            if  firstFile:
-                firstFile = False
-                colNames = list(dataDF.columns)
-            else:
-                #Cross check the column names to skip duplicates
-                newCols = []
-                for col in list(dataDF.columns):
-                    if not (col in colNames):
-                        newCols.append(col)
-                dataDF = dataDF[newCols]
-            #Convert columns to smaller datatypes to save memory
-            for c in dataDF.columns:
-                if dataDF[c].dtype.type == np.float64:
-                    dataDF[c]= dataDF[c].astype(np.float32)
-            #Append to the list of data frames
-            dataFrames.append(dataDF)
-    print ""
-
-    #Merge all file data frames into one
-    #print "Merging data frames"
-    dataDF = pd.concat(dataFrames,axis=1)
-
-    #Remove single dfs to free memory
-    del dataFrames
+    if batchMode:
+        #Select the species' HUC8 records (and, from the matrix, the attributes with
+        # data in those HUC8s) from the batch extract
+        dataDF = su.batchSubset(storeFldr,catalogFN,huc8s,allDF,allHUC8Col)
+    else:
+        dataDF = sc.extractHUC8s(storeFldr,dataFldr,catalogFN,huc8s,report)
+
+    print sc.memoryReport("extracted",dataDF)
 
     #Add species presence absence data
     #print "Prepending presence absence to data frame"
     outDF = mergePresAbs(eoCSV,spp,dataDF)
+    print sc.memoryReport("merged",outDF)
 
     #Remove the OID column
     outDF.drop("OID",axis=1,inplace=True)
@@ -172,3 +143,4 @@ for i, spp in enumerate(sppNames):
     #Write to a file for the spp
     #print "Saving to {}".format(outFN)
     outDF.to_csv(outFN,index_label="OID")
+    su.writeProvenance(outFN,provenance[spp])
@@ -0,0 +1,1171 @@
+#SPECIES_utils.py
+#
+# A set of functions used by the scripts that build species model (SWD) files from the
+#  species occurrence table (SpeciesOccurrences.csv) and the StreamCat attributes.
+
+import sys, os, shutil, time, itertools, multiprocessing, hashlib, json
+import numpy as np
+import pandas as pd
+import STREAMCAT_utils as sc
+
+#Catchment key columns preceding the species columns in the occurrence table
+occurrenceKeys = ("GRIDCODE","FEATUREID","REACHCODE","HUC_12")
+
+##--SPECIES OCCURRENCES--
+def speciesNames(eoCSV):
+    '''Returns the species (column) names listed in the species occurrence table'''
+    with open(eoCSV,'rt') as fileObj:
+        headers = fileObj.readline().strip().split(",")
+    return [h for h in headers if not h in occurrenceKeys]
+
+def speciesHUC8s(eoCSV,sppNames):
+    '''Returns a dictionary of the HUC8s in which each species in the list occurs, read
+       from the occurrence index'''
+    index = occurrenceIndex(eoCSV)
+    sppHUC8s = {}
+    for sppName in sppNames:
+        sppHUC8s[sppName] = indexHUC8s(index,sppName)
+    return sppHUC8s
+
+def mergePresence(eoCSV,sppName,dataDF):
+    '''Returns the catchment dataframe (reindexed) with a column of the species' presence
+       (1) or absence (0) after its FEATUREID column, as read from the occurrence index'''
+    presence = presenceVector(occurrenceIndex(eoCSV),sppName,dataDF["FEATUREID"].values)
+    others = [col for col in dataDF.columns if col <> "FEATUREID"]
+    return pd.concat([dataDF[["FEATUREID"]].reset_index(drop=True),
+                      pd.DataFrame({sppName:presence.astype(np.float64)}),
+                      dataDF[others].reset_index(drop=True)],axis=1)
+
+def speciesPresence(sppDF,sppName):
+    '''Returns a boolean array flagging a species' presence records (the presence column is
+       1/0 or, once screened in memory, the species name/"Background")'''
+    return ~sppDF[sppName].isin([0,"Background"]).values
+
+##--OCCURRENCE INDEX--
+# The species occurrence table (a catchment x species table of 1/0 values) is converted,
+#  once, into a folder of numpy arrays beside it (e.g. Data/ToolData/SpeciesOccurrences):
+#  the FEATUREIDs of the catchments listed, sorted (the catchment index), with the HUC8
+#  (from REACHCODE) of each, and the species x catchment presence matrix stored sparsely,
+#  as the sorted catchment positions of each species' presences (compressed rows). The
+#  HUC8s of each species and the species of each HUC8 are stored the same way. The arrays
+#  are memory mapped, so species HUC8s and presence vectors are read without parsing the
+#  table. The index is rebuilt if the table changes.
+def occurrenceIndexFolder(eoCSV):
+    '''Returns the folder holding the occurrence index of an occurrence table'''
+    return os.path.splitext(eoCSV)[0]
+
+def compressRows(rowIDs,colIDs,nRows):
+    '''Returns the (pointer, column) arrays of a sparse boolean matrix with True values at
+       the (row, column) pairs given: the columns of row i are column[pointer[i]:pointer[i+1]]'''
+    order = np.lexsort((colIDs,rowIDs))
+    pointers = np.searchsorted(np.asarray(rowIDs)[order],np.arange(nRows + 1))
+    return pointers.astype(np.int64), np.asarray(colIDs)[order].astype(np.int32)
+
+def buildOccurrenceIndex(eoCSV,indexFldr,chunkSize=100000):
+    '''Converts the occurrence table into the occurrence index arrays, reading the table in
+       chunks'''
+    sppNames = speciesNames(eoCSV)
+    featureIDs = []
+    reachCodes = []
+    presences = []
+    nRecords = 0
+    for chunk in pd.read_csv(eoCSV,dtype={"FEATUREID":np.int32,"REACHCODE":np.str},chunksize=chunkSize):
+        featureIDs.append(chunk["FEATUREID"].values)
+        reachCodes.append(chunk["REACHCODE"].fillna("").values.astype('S8'))
+        #Record and species positions of the presences
+        rows, cols = np.nonzero(chunk[sppNames].values == 1)
+        presences.append((rows + nRecords,cols))
+        nRecords += len(chunk)
+    featureIDs = np.concatenate(featureIDs) if featureIDs else np.array([],dtype=np.int32)
+    huc8s = np.concatenate(reachCodes) if reachCodes else np.array([],dtype='S8')
+    #Catchment index: the sorted FEATUREIDs (the first record of any repeated catchment)
+    catchments, first, positions = np.unique(featureIDs,return_index=True,return_inverse=True)
+    huc8Table, huc8Codes = np.unique(huc8s[first],return_inverse=True)
+    records = np.concatenate([r for r, c in presences]) if presences else np.array([],dtype=np.int64)
+    species = np.concatenate([c for r, c in presences]) if presences else np.array([],dtype=np.int64)
+    catchmentIDs = positions[records]
+    #Species x catchment presences, species x HUC8 and HUC8 x species (unique pairs)
+    pairs = np.unique(species.astype(np.int64) * len(catchments) + catchmentIDs)
+    sppPtr, sppCatchments = compressRows(pairs // max(1,len(catchments)),pairs % max(1,len(catchments)),len(sppNames))
+    pairs = np.unique(species.astype(np.int64) * len(huc8Table) + huc8Codes[catchmentIDs])
+    sppIDs, huc8IDs = pairs // max(1,len(huc8Table)), pairs % max(1,len(huc8Table))
+    sppHUC8Ptr, sppHUC8s = compressRows(sppIDs,huc8IDs,len(sppNames))
+    huc8SppPtr, huc8Spp = compressRows(huc8IDs,sppIDs,len(huc8Table))
+    if not os.path.exists(indexFldr): os.makedirs(indexFldr)
+    arrays = {"species":np.array(sppNames,dtype=np.str),"FEATUREID":catchments.astype(np.int32),
+              "HUC8CODE":huc8Codes.astype(np.int32),"huc8Table":huc8Table,
+              "sppPtr":sppPtr,"sppCatchments":sppCatchments,
+              "sppHUC8Ptr":sppHUC8Ptr,"sppHUC8s":sppHUC8s,
+              "huc8SppPtr":huc8SppPtr,"huc8Spp":huc8Spp}
+    for name, arr in arrays.items():
+        np.save(os.path.join(indexFldr,name + ".npy"),arr)
+    #Record the source, so the index is rebuilt when it changes
+    sc.writeManifest(os.path.join(indexFldr,"manifest.csv"),
+                     {"Source":{"File":"Source","Name":os.path.basename(eoCSV),
+                                "Size":str(os.path.getsize(eoCSV)),
+                                "MTime":str(int(os.path.getmtime(eoCSV)))}})
+    return len(catchments)
+
+#Occurrence indexes already loaded in this process: (table and manifest state, index),
+# keyed on the index folder
+loadedIndexes = {}
+
+def indexState(eoCSV,indexFldr):
+    '''Returns the size and mtime of an occurrence table and the mtime of its index manifest'''
+    manifestFN = os.path.join(indexFldr,"manifest.csv")
+    return (os.path.getsize(eoCSV),os.path.getmtime(eoCSV),
+            os.path.getmtime(manifestFN) if os.path.exists(manifestFN) else None)
+
+def occurrenceIndex(eoCSV):
+    '''Returns the occurrence index of an occurrence table as a dictionary of memory mapped
+       arrays (and a "position" dictionary of each species' position), building it first
+       if it does not exist or the table has changed. The index is loaded once per process
+       and reused until the table or its index manifest changes.'''
+    indexFldr = occurrenceIndexFolder(eoCSV)
+    cached = loadedIndexes.get(indexFldr)
+    if cached and cached[0] == indexState(eoCSV,indexFldr):
+        return cached[1]
+    source = sc.readManifest(os.path.join(indexFldr,"manifest.csv")).get("Source")
+    if not (source and source["Name"] == os.path.basename(eoCSV) and
+            source["Size"] == str(os.path.getsize(eoCSV)) and
+            source["MTime"] == str(int(os.path.getmtime(eoCSV)))):
+        print "Building occurrence index from {}".format(eoCSV)
+        buildOccurrenceIndex(eoCSV,indexFldr)
+    index = {}
+    for name in ("species","FEATUREID","HUC8CODE","huc8Table","sppPtr","sppCatchments",
+                 "sppHUC8Ptr","sppHUC8s","huc8SppPtr","huc8Spp"):
+        index[name] = np.load(os.path.join(indexFldr,name + ".npy"),mmap_mode='r')
+    index["position"] = dict([(name,i) for i, name in enumerate(index["species"])])
+    loadedIndexes[indexFldr] = (indexState(eoCSV,indexFldr),index)
+    return index
+
+def indexHUC8s(index,sppName):
+    '''Returns the list of HUC8s in which a species occurs'''
+    i = index["position"][sppName]
+    codes = index["sppHUC8s"][index["sppHUC8Ptr"][i]:index["sppHUC8Ptr"][i+1]]
+    return [str(huc8) for huc8 in index["huc8Table"][codes]]
+
+def indexSpecies(index,huc8):
+    '''Returns the list of species occurring in a HUC8'''
+    pos = np.searchsorted(index["huc8Table"],huc8)
+    if pos == len(index["huc8Table"]) or index["huc8Table"][pos] <> huc8:
+        return []
+    sppIDs = index["huc8Spp"][index["huc8SppPtr"][pos]:index["huc8SppPtr"][pos+1]]
+    return [str(sppName) for sppName in index["species"][sppIDs]]
+
+def presenceIDs(index,sppName):
+    '''Returns the (sorted) FEATUREIDs of the catchments in which a species is present'''
+    i = index["position"][sppName]
+    return np.asarray(index["FEATUREID"])[index["sppCatchments"][index["sppPtr"][i]:index["sppPtr"][i+1]]]
+
+def presenceVector(index,sppName,featureIDs):
+    '''Returns a boolean array flagging the catchments (FEATUREIDs) in which a species is
+       present'''
+    return np.in1d(featureIDs,presenceIDs(index,sppName))
+
+def presenceMatrix(index,featureIDs,sppNames=None):
+    '''Returns a boolean catchment x species array of the presence of each species in the
+       list (default all) in each catchment (FEATUREID)'''
+    if sppNames is None:
+        sppNames = list(index["species"])
+    #Flag the presences in the catchment index (plus a last row for catchments not listed)
+    catchments = np.asarray(index["FEATUREID"])
+    presence = np.zeros((len(catchments) + 1,len(sppNames)),dtype=bool)
+    for j, sppName in enumerate(sppNames):
+        i = index["position"][sppName]
+        presence[index["sppCatchments"][index["sppPtr"][i]:index["sppPtr"][i+1]],j] = True
+    #Catchment index position of each FEATUREID
+    pos = np.searchsorted(catchments,featureIDs)
+    found = pos < len(catchments)
+    found[found] = catchments[pos[found]] == np.asarray(featureIDs)[found]
+    return presence[np.where(found,pos,len(catchments))]
+
+def occurrenceMatrix(index):
+    '''Returns the species x catchment presences as a scipy sparse (CSR) matrix; columns are
+       the catchments of the catchment index'''
+    from scipy import sparse
+    indices = np.asarray(index["sppCatchments"])
+    return sparse.csr_matrix((np.ones(len(indices),dtype=bool),indices,np.asarray(index["sppPtr"])),
+                             shape=(len(index["species"]),len(index["FEATUREID"])))
+
+##--BATCH EXTRACTION--
+# In batch mode, the catchment records of the union of all species' HUC8s are read from
+#  the StreamCat data once, and each species' records are then taken from that table
+#  (with huc8Subset) instead of re-reading the data for every species.
+def unionHUC8s(sppHUC8s):
+    '''Returns the sorted union of the HUC8 lists in a speciesHUC8s dictionary'''
+    allHUC8s = set()
+    for huc8s in sppHUC8s.values():
+        allHUC8s.update(huc8s)
+    return sorted(allHUC8s)
+
+def huc8Subset(dataDF,huc8List,attributes=None,huc8Col=None):
+    '''Returns the records of a catchment dataframe within the HUC8s in the list, in their
+       original order. If a list of attributes is given, other attribute columns (all
+       but the catchment keys) are dropped. huc8Col, the HUC8 of each record, is derived
+       from HUC_12 if not supplied.'''
+    if huc8Col is None:
+        huc8Col = dataDF["HUC_12"].str[:8]
+    subsetDF = dataDF[np.asarray(huc8Col.isin(huc8List))]
+    if attributes is not None:
+        keep = set(attributes)
+        subsetDF = subsetDF[[c for c in dataDF.columns if c in keep or c in ("OID",) + occurrenceKeys]]
+    return subsetDF
+
+##--NULL CULLING--
+# Missing attribute values are flagged with boolean masks over the whole attribute table (one
+#  2D mask per column dtype); the rows and columns to drop are reductions of the masks, so a
+#  table is culled with a single indexing step rather than one filter or drop per column.
+noDataValues = (-9999,)
+
+def nullMask(values,noData=noDataValues):
+    '''Returns a boolean array flagging the missing values in a 2D array (or dataframe) of
+       attribute values'''
+    mask = np.asarray(values == noData[0])
+    for noDataValue in noData[1:]:
+        mask = mask | np.asarray(values == noDataValue)
+    return mask
+
+def nullColumns(values,columns,noData=noDataValues):
+    '''Returns the columns (names listed in columns) of a 2D array or dataframe with a
+       missing value in any row'''
+    nullCols = nullMask(values,noData).any(axis=0)
+    return [col for col, isNull in zip(columns,nullCols) if isNull]
+
+def dtypeGroups(theDF):
+    '''Returns a list of the numeric columns of a dataframe grouped by dtype (one list per
+       dtype), and the list of all its numeric columns'''
+    dtypes = dict(zip(theDF.columns,theDF.dtypes))
+    numCols = [col for col in theDF.columns if dtypes[col].kind in 'iuf']
+    groups = [[col for col in numCols if dtypes[col] == dtype] for dtype in set([dtypes[col] for col in numCols])]
+    return groups, numCols
+
+def nullRows(theDF,noData=noDataValues):
+    '''Returns a boolean array flagging the rows of a dataframe with a missing value in any
+       numeric column. It doesn't depend on the species, so the rows of a background table
+       may be flagged once for all the species sharing it (see cullNulls).'''
+    rowNulls = np.zeros(len(theDF),dtype=bool)
+    for cols in dtypeGroups(theDF)[0]:
+        rowNulls |= nullMask(theDF[cols].values,noData).any(axis=1)
+    return rowNulls
+
+def cullNulls(theDF,presence,noData=noDataValues,rowNulls=None):
+    '''Removes the absence rows with a missing value in any numeric column and then the
+       columns with a missing value in any remaining (presence) row, in one step. presence
+       is a boolean array flagging the species presence rows; rowNulls, if given, flags the
+       rows with missing values (see nullRows). Returns the culled dataframe, the number of
+       rows removed, and the list of columns removed.'''
+    if rowNulls is None:
+        rowNulls = nullRows(theDF,noData)
+    #Rows: absences with any missing value
+    presence = np.asarray(presence)
+    keepRows = presence | ~rowNulls
+    #Columns: any missing value in the rows kept (i.e. the presence rows with missing values)
+    groups, numCols = dtypeGroups(theDF)
+    nullPresence = np.flatnonzero(presence & rowNulls)
+    dropCols = set()
+    for cols in groups:
+        dropCols.update(nullColumns(theDF[cols].values[nullPresence],cols,noData))
+    keepCols = [i for i, col in enumerate(theDF.columns) if not col in dropCols]
+    culledDF = theDF.iloc[np.flatnonzero(keepRows),keepCols]
+    return culledDF, int(len(keepRows) - keepRows.sum()), [col for col in numCols if col in dropCols]
+
+##--CORRELATION SCREENING--
+# The correlation of every attribute with species presence (the point biserial coefficient)
+#  is computed at once: the centered attribute matrix is multiplied by the centered presence
+#  vector, and the p-values (two-sided, from the t distribution with n-2 degrees of freedom)
+#  are computed for all coefficients in one call. Results are those of scipy.stats.pearsonr
+#  applied to each column, including NaN for constant columns.
+pThreshold = 0.05       # Attributes correlated with presence at a p-value above this are culled
+
+def presenceCorrelations(values,presence):
+    '''Returns arrays of the correlation coefficient of each column of a 2D array of
+       attribute values with the presence (1/0) vector, and of its p-value'''
+    values = np.array(values,dtype=np.float64)
+    sppVector = np.asarray(presence,dtype=np.float64)
+    sppVector = sppVector - sppVector.mean()
+    values -= values.mean(axis=0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        coeffs = np.dot(sppVector,values) / np.sqrt((values ** 2).sum(axis=0) * np.dot(sppVector,sppVector))
+    coeffs = np.clip(coeffs,-1.0,1.0)
+    return coeffs, correlationPValues(coeffs,len(sppVector))
+
+def correlationPValues(coeffs,nRows):
+    '''Returns the two-sided p-values of an array of correlation coefficients, each computed
+       from nRows values (a number or an array)'''
+    from scipy import special
+    coeffs = np.asarray(coeffs,dtype=np.float64)
+    df = np.asarray(nRows,dtype=np.float64) - 2
+    with np.errstate(divide='ignore',invalid='ignore'):
+        tSquared = coeffs ** 2 * (df / ((1.0 - coeffs) * (1.0 + coeffs)))
+        pValues = special.betainc(0.5 * df,0.5,np.fmin(df / (df + tSquared),1.0))
+    pValues = np.where(np.abs(coeffs) == 1.0,0.0,pValues)
+    return pValues
+
+def uncorrelatedFields(flds,coeffs,pValues,threshold=pThreshold,logFile=None):
+    '''Returns the fields whose correlation with presence has a p-value above the threshold
+       (logging each) and a dict of the other fields and their correlation coefficients'''
+    dropFlds = []
+    corDict = {}
+    for fld, coeff, pValue in zip(flds,coeffs,pValues):
+        if abs(pValue) > threshold:
+            if logFile: logFile.write("   ...Removing %s [p=%2.3f]\n"%(fld,pValue))
+            dropFlds.append(fld)
+        else:
+            corDict[fld] = coeff
+    return dropFlds, corDict
+
+##--REDUNDANCY PRUNING--
+# Cross correlations are computed as one correlation matrix (the standardized attribute
+#  matrix multiplied by its transpose); redundant pairs are then found by masking the matrix
+#  at the threshold rather than by computing the correlation of each pair of columns.
+xcorrThreshold = 0.75   # Of two attributes correlated above this, the one less correlated with presence is culled
+
+def correlationMatrix(values):
+    '''Returns the matrix of Pearson correlation coefficients between the columns of a 2D
+       array of attribute values (NaN for constant columns)'''
+    values = np.array(values,dtype=np.float64)
+    values -= values.mean(axis=0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        values /= np.sqrt((values ** 2).sum(axis=0))
+    return np.clip(np.dot(values.T,values),-1.0,1.0)
+
+def correlatedPairs(coeffs,threshold):
+    '''Returns the (i, j, coefficient) of each pair of columns, i < j, correlated at or above
+       the threshold (absolute value), ordered on i then j'''
+    with np.errstate(invalid='ignore'):
+        redundant = np.triu(np.abs(coeffs) >= threshold,1)
+    return [(i,j,coeffs[i,j]) for i, j in zip(*np.nonzero(redundant))]
+
+def pruneCorrelated(coeffs,threshold):
+    '''Applies the greedy redundancy rule to a correlation matrix whose columns are in order
+       of priority: each column not yet dropped drops the later columns (not yet dropped)
+       correlated with it at or above the threshold. Returns a boolean array flagging the
+       columns dropped and the list of (i, j, coefficient) pairs causing the drops.'''
+    with np.errstate(invalid='ignore'):
+        redundant = np.abs(coeffs) >= threshold
+    dropped = np.zeros(len(coeffs),dtype=bool)
+    pairs = []
+    for i in range(len(coeffs)):
+        if dropped[i]: continue
+        partners = np.flatnonzero(redundant[i,i+1:] & ~dropped[i+1:]) + i + 1
+        pairs.extend([(i,j,coeffs[i,j]) for j in partners])
+        dropped[partners] = True
+    return dropped, pairs
+
+def xCorrelatedFields(flds,coeffs,threshold=xcorrThreshold,logFile=None):
+    '''Returns the fields (listed in rank order, with their correlation matrix) correlated
+       above the threshold with a higher ranking field kept, logging each pair'''
+    dropped, pairs = pruneCorrelated(coeffs,float(threshold))
+    if logFile:
+        for i, j, pearson in pairs:
+            logFile.write("     %s & %s xcorrelated @ %2.2f; "%(flds[i],flds[j],pearson))
+    return [fld for fld, drop in zip(flds,dropped) if drop]
+
+def writeCorrelatedPairs(pairCSV,names,pairs):
+    '''Writes correlated pairs to a CSV file (Var1, Var2, Coeff), the format read by
+       HABMODEL_VisualizeCorrelations.py'''
+    with open(pairCSV,'wt') as fileObj:
+        fileObj.write("Var1, Var2, Coeff\n")
+        for i, j, coeff in pairs:
+            fileObj.write("{}, {}, {}\n".format(str(names[i]),names[j],coeff))
+
+##--STREAMING SCREENING--
+# When a species' records are too many to hold in memory, they are culled and screened from
+#  statistics accumulated over chunks of the records instead: the counts, sums, sums of squares
+#  and cross products of the attribute values, and of the values with the presence vector.
+#  Missing values are masked pairwise, so each statistic of a pair of attributes is taken over
+#  the rows where neither is missing. Absence rows with a missing value are skipped, as in
+#  cullNulls, so the attributes kept have no missing values and their coefficients are those of
+#  presenceCorrelations and correlationMatrix applied to the culled table. Memory use is set by
+#  the number of attributes (squared), not the number of records. Values are shifted by the
+#  means of the first chunk before they are summed, to limit round off error.
+def newScreen(columns):
+    '''Returns an empty screen: a dictionary of the statistics accumulated for the attribute
+       columns listed'''
+    nCols = len(columns)
+    return {"columns":list(columns),
+            "nRows":0,                                  # Records screened
+            "nDropped":0,                               # Absence records culled
+            "shift":None,                               # Value subtracted from each column
+            "nulls":np.zeros(nCols,dtype=np.int64),     # Missing values (in rows kept)
+            "lo":np.repeat(np.inf,nCols),               # Column minimum
+            "hi":np.repeat(-np.inf,nCols),              # Column maximum
+            "counts":np.zeros((nCols,nCols)),           # Rows with values i and j
+            "sums":np.zeros((nCols,nCols)),             # Sum of values i where j is not missing
+            "squares":np.zeros((nCols,nCols)),          # Sum of squares of i where j is not missing
+            "products":np.zeros((nCols,nCols)),         # Sum of products of i and j
+            "presence":np.zeros(nCols),                 # Presences where i is not missing
+            "presenceProducts":np.zeros(nCols)}         # Sum of products of i and presence
+
+def accumulate(screen,values,presence,noData=noDataValues):
+    '''Adds a chunk of records (a 2D array of the screen's attribute values and a boolean array
+       flagging the presence rows) to a screen. Returns a boolean array flagging the records
+       kept (those not culled for missing values).'''
+    values = np.array(values,dtype=np.float64)
+    presence = np.asarray(presence,dtype=bool)
+    missing = nullMask(values,noData)
+    #Skip the absence rows with any missing value
+    keepRows = presence | ~missing.any(axis=1)
+    screen["nRows"] += len(keepRows)
+    screen["nDropped"] += int(len(keepRows) - keepRows.sum())
+    if not keepRows.any():
+        return keepRows
+    values, missing, presence = values[keepRows], missing[keepRows], presence[keepRows]
+    valid = ~missing
+    screen["nulls"] += missing.sum(axis=0)
+    screen["lo"] = np.fmin(screen["lo"],np.where(valid,values,np.inf).min(axis=0))
+    screen["hi"] = np.fmax(screen["hi"],np.where(valid,values,-np.inf).max(axis=0))
+    if screen["shift"] is None:
+        with np.errstate(invalid='ignore'):
+            shift = np.where(valid,values,0.0).sum(axis=0) / valid.sum(axis=0)
+        screen["shift"] = np.where(np.isfinite(shift),shift,0.0)
+    #Shifted values, with missing values set to zero so they drop out of the sums
+    values = np.where(valid,values - screen["shift"],0.0)
+    valid = valid.astype(np.float64)
+    sppVector = presence.astype(np.float64)
+    screen["counts"] += np.dot(valid.T,valid)
+    screen["sums"] += np.dot(values.T,valid)
+    screen["squares"] += np.dot((values ** 2).T,valid)
+    screen["products"] += np.dot(values.T,values)
+    screen["presence"] += np.dot(sppVector,valid)
+    screen["presenceProducts"] += np.dot(sppVector,values)
+    return keepRows
+
+def screenNullColumns(screen):
+    '''Returns the screen's columns with a missing value in any record kept'''
+    return [col for col, nNulls in zip(screen["columns"],screen["nulls"]) if nNulls > 0]
+
+def screenCorrelations(screen):
+    '''Returns arrays of the correlation coefficient of each of the screen's columns with
+       presence, and of its p-value (as presenceCorrelations)'''
+    counts = np.diag(screen["counts"])
+    sums = np.diag(screen["sums"])
+    with np.errstate(divide='ignore',invalid='ignore'):
+        covariance = screen["presenceProducts"] - sums * screen["presence"] / counts
+        xVariance = np.diag(screen["squares"]) - sums ** 2 / counts
+        yVariance = screen["presence"] - screen["presence"] ** 2 / counts
+        coeffs = covariance / np.sqrt(xVariance * yVariance)
+    #Constant columns have no correlation
+    coeffs[screen["lo"] == screen["hi"]] = np.nan
+    coeffs = np.clip(coeffs,-1.0,1.0)
+    return coeffs, correlationPValues(coeffs,counts)
+
+def screenMatrix(screen):
+    '''Returns the matrix of correlation coefficients between the screen's columns (as
+       correlationMatrix)'''
+    counts = screen["counts"]
+    sums = screen["sums"]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        covariance = screen["products"] - sums * sums.T / counts
+        variance = screen["squares"] - sums ** 2 / counts
+        coeffs = covariance / np.sqrt(variance * variance.T)
+    constant = screen["lo"] == screen["hi"]
+    coeffs[constant,:] = np.nan
+    coeffs[:,constant] = np.nan
+    return np.clip(coeffs,-1.0,1.0)
+
+##--HUC8 STATISTICS BLOCKS--
+# The statistics a species is screened from are additive over HUC8s, so they are cached in
+#  the attribute store, one block per HUC8 (Store/huc8stats/<HUC8>.npz), and a species' screen
+#  is assembled by merging the blocks of its HUC8s. A block holds the count, means, min and
+#  max of each matrix attribute, and the matrix of cross products of the deviations from the
+#  means (co-moments), over the HUC8's complete records: those missing values only in the
+#  attributes with no data in the whole HUC8. These are the absence records kept when the HUC8
+#  is culled with the other HUC8s of a species, provided the species' attributes exclude the
+#  HUC8's empty attributes; otherwise all of the HUC8's absence records are culled. Presence
+#  records are never culled, so a species' presence records not in a block are added to the
+#  merged statistics. Blocks are computed when first needed, and are cleared when the
+#  attribute matrix is rebuilt.
+def huc8StatsFolder(storeFldr):
+    '''Returns the folder of the store's cached HUC8 statistics blocks, creating it, or emptying
+       it if the attribute matrix has changed since the blocks were computed'''
+    statsFldr = os.path.join(storeFldr,"huc8stats")
+    streamCatFldr = os.path.dirname(os.path.abspath(storeFldr))
+    manifestFN = sc.buildManifestFile(streamCatFldr)
+    manifest = sc.readManifest(manifestFN)
+    sourceFiles = [sc.matrixFile(storeFldr)]
+    if sc.needsBuild(statsFldr,sourceFiles,streamCatFldr,manifest):
+        if os.path.exists(statsFldr): shutil.rmtree(statsFldr)
+        os.mkdir(statsFldr)
+        sc.recordBuild(statsFldr,sourceFiles,streamCatFldr,manifest,time.time())
+        sc.writeManifest(manifestFN,manifest)
+    return statsFldr
+
+def blockStats(values):
+    '''Returns the statistics (n, means, comoments, lo, hi) of the columns of a 2D array'''
+    values = np.asarray(values,dtype=np.float64)
+    if len(values) == 0:
+        nCols = values.shape[1]
+        return {"n":0,"means":np.zeros(nCols),"comoments":np.zeros((nCols,nCols)),
+                "lo":np.repeat(np.inf,nCols),"hi":np.repeat(-np.inf,nCols)}
+    means = values.mean(axis=0)
+    deviations = values - means
+    return {"n":len(values),"means":means,"comoments":np.dot(deviations.T,deviations),
+            "lo":values.min(axis=0),"hi":values.max(axis=0)}
+
+def mergeStats(stats1,stats2):
+    '''Returns the statistics of the union of two sets of records, from the statistics of each
+       (either may be None)'''
+    if stats1 is None: return stats2
+    if stats2 is None or stats2["n"] == 0: return stats1
+    n = stats1["n"] + stats2["n"]
+    delta = stats2["means"] - stats1["means"]
+    return {"n":n,
+            "means":stats1["means"] + delta * (stats2["n"] / float(n)),
+            "comoments":stats1["comoments"] + stats2["comoments"] + np.outer(delta,delta) * (stats1["n"] * stats2["n"] / float(n)),
+            "lo":np.fmin(stats1["lo"],stats2["lo"]),
+            "hi":np.fmax(stats1["hi"],stats2["hi"])}
+
+def subsetStats(stats,positions):
+    '''Returns the statistics of the columns at the listed positions'''
+    return {"n":stats["n"],"means":stats["means"][positions],
+            "comoments":stats["comoments"][np.ix_(positions,positions)],
+            "lo":stats["lo"][positions],"hi":stats["hi"][positions]}
+
+def huc8Block(statsFldr,storeFldr,huc8,noData=noDataValues):
+    '''Returns the statistics block of a HUC8 (with its store rows, complete row mask, empty
+       attribute mask and record count), computing and caching it if needed; None is
+       returned if the HUC8 has no catchments in the store'''
+    blockFN = os.path.join(statsFldr,"{}.npz".format(huc8))
+    if os.path.exists(blockFN):
+        arrs = np.load(blockFN)
+        block = dict([(key,arrs[key]) for key in arrs.files])
+        block["n"] = int(block["n"])
+        return block
+    rows = sc.huc8Rows(storeFldr,[huc8])
+    if len(rows) == 0:
+        return None
+    values = sc.readRows(np.load(sc.matrixFile(storeFldr),mmap_mode='r'),rows).astype(np.float64)
+    missing = nullMask(values,noData)
+    empty = missing.all(axis=0)
+    complete = ~(missing & ~empty).any(axis=1)
+    values[missing] = 0.0
+    block = blockStats(values[complete])
+    block.update({"rows":rows,"complete":complete,"empty":empty})
+    #Write to a temporary file of this process so a partial block is never read, even when
+    # workers compute the same block at once; the first block renamed into place is kept
+    tmpFN = "{}.{}.tmp.npz".format(blockFN[:-4],os.getpid())
+    np.savez(tmpFN,**block)
+    if os.path.exists(blockFN):
+        os.remove(tmpFN)
+    else:
+        try:
+            os.rename(tmpFN,blockFN)
+        except OSError:
+            #Another process renamed its block first (Windows won't replace a file)
+            if not os.path.exists(blockFN): raise
+            os.remove(tmpFN)
+    return block
+
+def huc8Background(storeFldr,huc8List,attributes,noData=noDataValues,blocks=None,logFile=None):
+    '''Returns the statistics of the listed matrix attributes for the catchments within the
+       HUC8s in the list, merged from the HUC8 statistics blocks whose empty attributes are
+       all excluded, the number of catchments, and the store rows of the blocks merged. They
+       don't depend on the species, so may be shared by the species with the same HUC8s.
+       blocks, if given, is a dict of the blocks already loaded (by HUC8): the blocks of the
+       HUC8s in the list are taken from it, and it is left holding just those blocks.'''
+    statsFldr = huc8StatsFolder(storeFldr)
+    registry = sc.attributeRegistry(storeFldr)
+    positions = registry.loc[attributes,"Position"].values
+    excluded = np.ones(len(registry),dtype=bool)
+    excluded[positions] = False
+    #Merge the blocks of the HUC8s whose empty attributes are all excluded
+    stats = None
+    nRows = 0
+    blockRows = [np.array([],dtype=np.int64)]
+    if blocks is None:
+        blocks = {}
+    elif logFile:
+        nLoaded = len([huc8 for huc8 in huc8List if huc8 in blocks])
+        if nLoaded: logFile.write("   Reusing {} of the {} HUC8 statistics blocks already loaded\n".format(nLoaded,len(huc8List)))
+    loaded = {}
+    for huc8 in huc8List:
+        if huc8 in blocks:
+            block = blocks[huc8]
+        else:
+            block = huc8Block(statsFldr,storeFldr,huc8,noData)
+        loaded[huc8] = block
+        if block is None: continue
+        nRows += len(block["rows"])
+        if (block["empty"] & ~excluded).any(): continue
+        stats = mergeStats(stats,subsetStats(block,positions))
+        blockRows.append(block["rows"][block["complete"]])
+    blocks.clear()
+    blocks.update(loaded)
+    return stats, nRows, np.concatenate(blockRows)
+
+def huc8Screen(storeFldr,huc8List,attributes,presenceRows,presenceValues,noData=noDataValues,background=None):
+    '''Returns a screen (see newScreen) of the listed matrix attributes for the catchments
+       within the HUC8s in the list, assembled from the HUC8 statistics blocks, and the store
+       rows kept. presenceRows are the store rows of the species' presence records and
+       presenceValues a 2D array of their attribute values; background, if given, is the
+       huc8Background of the HUC8s and attributes.'''
+    if background is None:
+        background = huc8Background(storeFldr,huc8List,attributes,noData)
+    stats, nRows, blockRows = background
+    #Add the presence records not in the blocks (those with missing values)
+    presenceRows = np.asarray(presenceRows,dtype=np.int64)
+    presenceValues = np.array(presenceValues,dtype=np.float64)
+    missing = nullMask(presenceValues,noData)
+    presenceValues[missing] = 0.0
+    inBlocks = np.in1d(presenceRows,blockRows)
+    stats = mergeStats(stats,blockStats(presenceValues[~inBlocks]))
+    if stats is None:
+        stats = blockStats(presenceValues[:0])
+    presenceStats = blockStats(presenceValues)
+    #Convert the statistics to a screen: values are shifted by their means, so their sums are 0
+    screen = newScreen(attributes)
+    screen["nRows"] = nRows
+    screen["nDropped"] = nRows - stats["n"]
+    screen["shift"] = stats["means"]
+    screen["nulls"] = missing.sum(axis=0)
+    screen["lo"] = stats["lo"]
+    screen["hi"] = stats["hi"]
+    screen["counts"][:] = stats["n"]
+    screen["squares"][:] = np.diag(stats["comoments"])[:,np.newaxis]
+    screen["products"] = stats["comoments"]
+    screen["presence"][:] = presenceStats["n"]
+    screen["presenceProducts"] = presenceStats["n"] * (presenceStats["means"] - stats["means"])
+    return screen, np.union1d(blockRows,presenceRows)
+
+##--SPECIES SCREENING--
+# The SWD scripts cull and screen a species' records in the same steps: the absence records
+#  and then the attributes with missing values are removed (see NULL CULLING), then the
+#  attributes not correlated with presence, then the weaker of each pair of cross correlated
+#  attributes (see CORRELATION SCREENING and REDUNDANCY PRUNING). Each step is written to the
+#  species' log file and passed to report (e.g. to print it), if given.
+#
+# The background table of a species range (set of HUC8s) doesn't depend on the species, so
+#  the species sharing a range share it: the last table built is kept in backgroundCache,
+#  keyed on the frozen set of its HUC8s. A table is either a range's records and the rows
+#  with missing values (see tableBackground), or the merged HUC8 statistics blocks (see
+#  huc8Background). Ranges that only overlap a cached one are built from its parts: the
+#  records of a range within a cached range are cut from its table (kept, for the other
+#  ranges within it), and the statistics blocks of the last range merged are kept in
+#  blockCache, so only the blocks of the HUC8s it lacks are loaded. cacheCounts counts the
+#  tables reused (hits), cut from a wider range's table (near) and built (misses).
+backgroundCache = {}
+blockCache = {}
+cacheCounts = {"hits":0,"near":0,"misses":0}
+
+def tableBackground(dataDF):
+    '''Returns the background table of a range's records: the records and a flag of the rows
+       with missing values'''
+    return {"data":dataDF,"nullRows":nullRows(dataDF)}
+
+def rangeBackground(huc8List,build,logFile=None,subset=None):
+    '''Returns the background table of a species range: the cached table, if it was built
+       for the same HUC8s; or, if a subset function is given and a cached table's range holds
+       all of these HUC8s, the table subset cuts from it; or else the table made by the build
+       function (which replaces the cached tables)'''
+    key = frozenset(huc8List)
+    if key in backgroundCache:
+        cacheCounts["hits"] += 1
+        if logFile: logFile.write("   Reusing the background table of the same {} HUC8s\n".format(len(key)))
+        return backgroundCache[key]
+    #Cut the table from that of the smallest cached range holding these HUC8s, keeping both
+    outerKeys = [outerKey for outerKey in backgroundCache if key < outerKey]
+    if subset is not None and outerKeys:
+        outerKey = min(outerKeys,key=len)
+        cacheCounts["near"] += 1
+        if logFile: logFile.write("   Selecting the background table of {} HUC8s from that of {} HUC8s\n".format(len(key),len(outerKey)))
+        table = subset(backgroundCache[outerKey])
+        for otherKey in backgroundCache.keys():
+            if otherKey <> outerKey: del backgroundCache[otherKey]
+        backgroundCache[key] = table
+        return table
+    cacheCounts["misses"] += 1
+    backgroundCache.clear()
+    backgroundCache[key] = build()
+    return backgroundCache[key]
+
+def screenSpecies(eoCSV,sppName,background,logFile,pThreshold=pThreshold,xcorrThreshold=xcorrThreshold,report=None):
+    '''Adds a species' presence/absence to the records of its range's background table (see
+       tableBackground) and culls the records and attributes with missing data, not correlated
+       with presence, or cross correlated. Returns the culled records.'''
+    if report is None:
+        report = lambda txt: None
+    dataDF = background["data"]
+    memReport = sc.memoryReport("extracted",dataDF)
+    report(memReport)
+    logFile.write(memReport + "\n")
+
+    #Add species presence absence data
+    report("Prepending presence absence to data frame")
+    sppDF = mergePresence(eoCSV,sppName,dataDF)
+    memReport = sc.memoryReport("merged",sppDF)
+    report(memReport)
+    logFile.write(memReport + "\n")
+
+    #Remove the OID column
+    sppDF.drop("OID",axis=1,inplace=True)
+    report("Resulting table has {0} columns and {1} records".format(sppDF.shape[1],sppDF.shape[0]))
+
+    #Cull absence rows, then catchment attributes, with missing (-9999) values in one pass
+    report("Removing absence records and catchment attributes with no data")
+    logFile.write("Checking for absence records with missing catchment data\n")
+    sppDF, droppedRowCount, droppedCols = cullNulls(sppDF,(sppDF[sppName] == 1).values,rowNulls=background["nullRows"])
+    report("...{} records dropped".format(droppedRowCount))
+    logFile.write("...{} absence records deleted for missing data\n".format(droppedRowCount))
+    logFile.write("Checking for catchment attributes with null values\n")
+    for fld in droppedCols:
+        logFile.write("   ...Removing: {}\n".format(fld))
+    if len(droppedCols) > 0:
+        report("...{} columns dropped".format(len(droppedCols)))
+        logFile.write("   ...{} columns removed for missing data\n".format(len(droppedCols)))
+
+    #Cull catchment attributes not correlated with presence absence (all but the first
+    # attribute, following the key columns)
+    report("Removing attributes not correlated with presence absence")
+    logFile.write("Removing attributes not correlated with presence absence\n")
+    sppVector = sppDF[sppName]
+    flds = list(sppDF.columns)[6:]
+    coeffs, pValues = presenceCorrelations(sppDF[flds].values,sppVector.values)
+    dropFlds, correlationDict = uncorrelatedFields(flds,coeffs,pValues,pThreshold,logFile)
+    sppDF.drop(dropFlds,axis=1,inplace=True)
+    sppVector.replace(0,"Background",inplace=True)
+    sppVector.replace(1,sppName,inplace=True)
+    if len(dropFlds) > 0:
+        report("...{} columns dropped".format(len(dropFlds)))
+        logFile.write("   ...{} columns removed: no sign. corr.\n".format(len(dropFlds)))
+
+    #Cull the weaker of each pair of cross correlated attributes, ranking them on the strength
+    # (absolute value) of their correlation with presence
+    report("Removing cross correlated attributes")
+    logFile.write("Checking for cross correlated columns\n")
+    xFlds = sorted(correlationDict,key=lambda fld: -abs(correlationDict[fld]))
+    xDropFlds = xCorrelatedFields(xFlds,correlationMatrix(sppDF[xFlds].values),xcorrThreshold,logFile)
+    sppDF.drop(xDropFlds,axis=1,inplace=True)
+    if len(xDropFlds) > 0:
+        report("...{} X correlated cols dropped".format(len(xDropFlds)))
+        logFile.write("   ...{} X correlated cols dropped\n".format(len(xDropFlds)))
+    return sppDF
+
+def streamSpecies(storeFldr,catalogFN,eoCSV,sppName,huc8List,chunkRows,logFile,pThreshold=pThreshold,xcorrThreshold=xcorrThreshold,report=None):
+    '''Culls and screens a species' records (as screenSpecies) from statistics of the records
+       in the attribute store: from the HUC8 statistics blocks if the store has an attribute
+       matrix, or else accumulated over chunks of chunkRows records. Returns the species'
+       presence/absence and the records and attributes kept.'''
+    if report is None:
+        report = lambda txt: None
+    rows = sc.huc8Rows(storeFldr,huc8List)
+    attributes = sc.huc8Attributes(storeFldr,catalogFN,huc8List)
+
+    #Get the catchments in which the species is present
+    presentIDs = presenceIDs(occurrenceIndex(eoCSV),sppName)
+
+    if os.path.exists(sc.matrixFile(storeFldr)):
+        #Merge the statistics of the species' HUC8s, adding its presence records
+        report("Screening {} records from HUC8 statistics".format(len(rows)))
+        logFile.write("   Screening {} records from the HUC8 statistics blocks\n".format(len(rows)))
+        featureIDs = sc.readRows(sc.loadColumn(storeFldr,None,"FEATUREID"),rows)
+        presenceRows = rows[np.in1d(featureIDs,presentIDs)]
+        presenceDF = sc.readRecords(storeFldr,presenceRows,attributes)
+        background = rangeBackground(huc8List,lambda: huc8Background(storeFldr,huc8List,attributes,blocks=blockCache,logFile=logFile),logFile)
+        screen, keptRows = huc8Screen(storeFldr,huc8List,attributes,presenceRows,presenceDF[attributes].values,background=background)
+        keepRows = np.in1d(rows,keptRows)
+    else:
+        #Accumulate the statistics of each chunk, noting the records kept
+        report("Screening {} records in chunks of {} rows".format(len(rows),chunkRows))
+        logFile.write("   Screening {} records from the attribute store in chunks of {} rows\n".format(len(rows),chunkRows))
+        screen = newScreen(attributes)
+        keepRows = np.zeros(len(rows),dtype=bool)
+        for start in range(0,len(rows),chunkRows):
+            chunkDF = sc.readRecords(storeFldr,rows[start:start+chunkRows],attributes)
+            presence = np.in1d(chunkDF["FEATUREID"].values,presentIDs)
+            keepRows[start:start+len(chunkDF)] = accumulate(screen,chunkDF[attributes].values,presence)
+    memReport = sc.memoryReport("screened")
+    report(memReport)
+    logFile.write(memReport + "\n")
+
+    #Cull absence rows, then catchment attributes, with missing (-9999) values
+    report("Removing absence records and catchment attributes with no data")
+    logFile.write("Checking for absence records with missing catchment data\n")
+    report("...{} records dropped".format(screen["nDropped"]))
+    logFile.write("...{} absence records deleted for missing data\n".format(screen["nDropped"]))
+    logFile.write("Checking for catchment attributes with null values\n")
+    droppedCols = screenNullColumns(screen)
+    for fld in droppedCols:
+        logFile.write("   ...Removing: {}\n".format(fld))
+    if len(droppedCols) > 0:
+        report("...{} columns dropped".format(len(droppedCols)))
+        logFile.write("   ...{} columns removed for missing data\n".format(len(droppedCols)))
+    flds = [fld for fld in attributes if not fld in droppedCols]
+    position = dict([(fld,i) for i, fld in enumerate(attributes)])
+
+    #Cull catchment attributes not correlated with presence absence (as in screenSpecies,
+    # the first attribute is not screened)
+    report("Removing attributes not correlated with presence absence")
+    logFile.write("Removing attributes not correlated with presence absence\n")
+    coeffs, pValues = screenCorrelations(screen)
+    cols = [position[fld] for fld in flds[1:]]
+    dropFlds, correlationDict = uncorrelatedFields(flds[1:],coeffs[cols],pValues[cols],pThreshold,logFile)
+    if len(dropFlds) > 0:
+        report("...{} columns dropped".format(len(dropFlds)))
+        logFile.write("   ...{} columns removed: no sign. corr.\n".format(len(dropFlds)))
+
+    report("Removing cross correlated attributes")
+    logFile.write("Checking for cross correlated columns\n")
+    xFlds = sorted(correlationDict,key=lambda fld: -abs(correlationDict[fld]))
+    cols = [position[fld] for fld in xFlds]
+    xDropFlds = xCorrelatedFields(xFlds,screenMatrix(screen)[np.ix_(cols,cols)],xcorrThreshold,logFile)
+    if len(xDropFlds) > 0:
+        report("...{} X correlated cols dropped".format(len(xDropFlds)))
+        logFile.write("   ...{} X correlated cols dropped\n".format(len(xDropFlds)))
+
+    #Read the records and attributes kept and add the species presence absence data
+    keptFlds = [fld for fld in flds if not (fld in dropFlds or fld in xDropFlds)]
+    sppDF = mergePresence(eoCSV,sppName,sc.readRecords(storeFldr,rows[keepRows],keptFlds))
+    sppDF.drop("OID",axis=1,inplace=True)
+    return sppDF
+
+##--RANGE JOBS--
+# The all species SWD script builds the species sharing a range together, as one job, and
+#  may build the jobs in worker processes. The memory a job needs is estimated from its
+#  records: counted in the batch extract, or else in the attribute store or catalog, times
+#  their size in memory, times workMultiple (the copies made while culling them), with the
+#  key columns of each record taken as keyBytes when sized from the store or catalog. The
+#  estimate only decides where a job is sent: the script also checks a worker's actual memory
+#  use as it builds each species, and hands the rest of a job going over the budget back to
+#  the main process.
+workMultiple = 4
+keyBytes = 64
+
+def rangeGroups(sppNames,sppHUC8s):
+    '''Returns lists of the species sharing a range (the same set of HUC8s), widest range
+       first, each followed by the ranges within it (so their background tables may be cut
+       from its table; see rangeBackground); ties in the order of the first species of each'''
+    groups = {}
+    keys = []
+    for sppName in sppNames:
+        key = frozenset(sppHUC8s[sppName])
+        if not key in groups:
+            groups[key] = []
+            keys.append(key)
+        groups[key].append(sppName)
+    keys.sort(key=lambda key: -len(key))
+    ordered = []
+    placed = set()
+    for key in keys:
+        if key in placed: continue
+        for nextKey in [key] + [inner for inner in keys if inner < key and not inner in placed]:
+            ordered.append(nextKey)
+            placed.add(nextKey)
+    return [groups[key] for key in ordered]
+
+def batchSubset(storeFldr,catalogFN,huc8List,allDF,allHUC8Col):
+    '''Returns the records of the HUC8s in the list (and, if read from the attribute matrix,
+       just the attributes with data in those HUC8s) from the batch extract'''
+    attributes = None
+    if os.path.exists(sc.matrixFile(storeFldr)):
+        attributes = sc.validAttributes(storeFldr,catalogFN,huc8List)
+    return huc8Subset(allDF,huc8List,attributes,allHUC8Col)
+
+def rangeJobs(groups,sppHUC8s,storeFldr,catalogFN,allDF=None,allHUC8Col=None,slots=None):
+    '''Yields the (names, HUC8s, records) job of each group of species sharing a range;
+       the records are None if no batch extract is given. If a semaphore is given, a slot
+       is taken before each job is created, limiting the number of ranges' records held
+       at once.'''
+    for sppNames in groups:
+        if slots is not None:
+            slots.acquire()
+        huc8s = sppHUC8s[sppNames[0]]
+        dataDF = None
+        if allDF is not None:
+            dataDF = batchSubset(storeFldr,catalogFN,huc8s,allDF,allHUC8Col)
+        yield sppNames, huc8s, dataDF
+
+def rangeSize(storeFldr,catalogFN,huc8List):
+    '''Returns the number of catchment records in the HUC8s and the number of attributes,
+       from the attribute store, if built, or else the attribute catalog (None, None if
+       neither has been built)'''
+    if os.path.exists(storeFldr):
+        if os.path.exists(sc.matrixFile(storeFldr)):
+            nAttributes = len(sc.attributeRegistry(storeFldr))
+        else:
+            nAttributes = len([col for f, col, dtype in sc.storeSchema(storeFldr) if not col in sc.keyCols])
+        return len(sc.huc8Rows(storeFldr,huc8List)), nAttributes
+    if os.path.exists(catalogFN):
+        statsDF = sc.huc8Stats(catalogFN,huc8List)
+        if len(statsDF) == 0: return 0, 0
+        return int((statsDF["Count"] + statsDF["NullCount"]).max()), len(statsDF)
+    return None, None
+
+def jobMemoryMB(storeFldr,catalogFN,huc8List,allDF=None,allHUC8Col=None,chunked=False):
+    '''Estimates the memory (MB) needed to build the SWD files of a range's species from the
+       size of its records (in chunked mode, once: only the records kept are held). None is
+       returned if the records can't be counted.'''
+    if allDF is not None:
+        bytesPerRow = allDF.memory_usage(deep=True).sum() / float(max(1,len(allDF)))
+        return allHUC8Col.isin(huc8List).sum() * bytesPerRow * workMultiple / 2.0**20
+    nRows, nAttributes = rangeSize(storeFldr,catalogFN,huc8List)
+    if nRows is None:
+        return None
+    bytesPerRow = nAttributes * np.dtype(sc.attributeDtype).itemsize + keyBytes
+    multiple = 1 if chunked else workMultiple
+    return nRows * bytesPerRow * multiple / 2.0**20
+
+##--BACKGROUND SAMPLING--
+# The background (absence) records of a species spread over many HUC8s may be capped by
+#  stratified sampling: the records kept are allocated to the strata (e.g. the HUC8 or HUC10
+#  of each catchment) in proportion to their background records, rounded by largest
+#  remainder, and drawn at random within each stratum. Presence records are all kept. The
+#  draw is seeded, so the same records are kept each time a species is built.
+sampleSeed = 2016
+
+def sampleBackground(strata,presence,maxBackground,seed=sampleSeed):
+    '''Returns a boolean array flagging the records kept when the background records are
+       capped at maxBackground (0 = no cap), sampled alike from each stratum (strata lists
+       the stratum of each record), and a list of (stratum, background records, records
+       kept) tuples, one per stratum (empty if no records were dropped)'''
+    presence = np.asarray(presence,dtype=bool)
+    keep = np.ones(len(presence),dtype=bool)
+    background = np.flatnonzero(~presence)
+    if maxBackground <= 0 or len(background) <= maxBackground:
+        return keep, []
+    names, inverse, counts = np.unique(np.asarray(strata)[background],return_inverse=True,return_counts=True)
+    #Allocate the records kept to the strata in proportion to their background records
+    quotas = counts * (maxBackground / float(len(background)))
+    kept = np.floor(quotas).astype(np.int64)
+    kept[np.argsort(kept - quotas,kind='mergesort')[:maxBackground - kept.sum()]] += 1
+    #Keep the records of each stratum ranked within its quota
+    keep[background] = randomRanks(inverse,counts,seed) < kept[inverse]
+    return keep, zip(names.tolist(),counts.tolist(),kept.tolist())
+
+def sampleSpeciesBackground(sppDF,sppName,maxBackground,stratumDigits=8,seed=sampleSeed,logFile=None):
+    '''Caps a species' background records at maxBackground, sampling each stratum (the HUC
+       of stratumDigits digits of each catchment) alike, and logs the fraction of each
+       stratum's records kept. Returns the records kept and the number of background records
+       sampled from (0 if none were dropped).'''
+    presence = speciesPresence(sppDF,sppName)
+    strata = sppDF["HUC_12"].astype(str).str[:stratumDigits].values
+    keep, strataKept = sampleBackground(strata,presence,maxBackground,seed)
+    if not strataKept:
+        return sppDF, 0
+    nBackground = sum([n for stratum, n, nKept in strataKept])
+    if logFile:
+        logFile.write("Sampling background records from each HUC{} (seed {})\n".format(stratumDigits,seed))
+        for stratum, n, nKept in strataKept:
+            logFile.write("   ...{}: {} of {} kept ({:.3f})\n".format(stratum,nKept,n,nKept / float(n)))
+        logFile.write("   ...{} of {} background records kept\n".format(maxBackground,nBackground))
+    return sppDF.iloc[np.flatnonzero(keep)], nBackground
+
+def randomRanks(inverse,counts,seed=sampleSeed):
+    '''Returns the rank of each record within its group in a (seeded) random order; inverse
+       gives the group number of each record and counts the records in each group'''
+    order = np.lexsort((np.random.RandomState(seed).rand(len(inverse)),inverse))
+    ranks = np.empty(len(inverse),dtype=np.int64)
+    ranks[order] = np.arange(len(inverse)) - np.repeat(np.cumsum(counts) - counts,counts)
+    return ranks
+
+##--PRESENCE THINNING--
+# Densely surveyed basins contribute clusters of adjacent presence catchments. Presences may
+#  be thinned to at most a set number in each unit (the HUC12, or a coarser HUC, of each
+#  catchment), drawn at random with a seeded generator so the same records are kept each
+#  time a species is built.
+def thinPresences(units,presence,maxPerUnit,seed=sampleSeed):
+    '''Returns a boolean array flagging the records kept when the presence records in each
+       unit (units lists the unit of each record) are thinned to at most maxPerUnit (0 = no
+       thinning), and a list of (unit, presence records, records kept) tuples of the units
+       thinned'''
+    presence = np.asarray(presence,dtype=bool)
+    keep = np.ones(len(presence),dtype=bool)
+    rows = np.flatnonzero(presence)
+    if maxPerUnit <= 0 or len(rows) == 0:
+        return keep, []
+    names, inverse, counts = np.unique(np.asarray(units)[rows],return_inverse=True,return_counts=True)
+    keep[rows] = randomRanks(inverse,counts,seed) < maxPerUnit
+    thinned = counts > maxPerUnit
+    return keep, [(name, n, maxPerUnit) for name, n in zip(names[thinned].tolist(),counts[thinned].tolist())]
+
+def thinSpeciesPresences(sppDF,sppName,maxPresences,thinDigits=12,seed=sampleSeed,logFile=None):
+    '''Thins a species' presence records to at most maxPresences in each HUC12 (or the HUC
+       of thinDigits digits), logging the records removed. Returns the records kept and the
+       number of presence records removed.'''
+    presence = speciesPresence(sppDF,sppName)
+    units = sppDF["HUC_12"].astype(str).str[:thinDigits].values
+    keep, unitsThinned = thinPresences(units,presence,maxPresences,seed)
+    if not unitsThinned:
+        return sppDF, 0
+    nRemoved = len(keep) - keep.sum()
+    if logFile:
+        logFile.write("Thinning presence records to {} per HUC{} (seed {})\n".format(maxPresences,thinDigits,seed))
+        for unit, n, nKept in unitsThinned:
+            logFile.write("   ...{}: {} of {} kept\n".format(unit,nKept,n))
+        logFile.write("   ...{} of {} presence records removed\n".format(nRemoved,presence.sum()))
+    return sppDF.iloc[np.flatnonzero(keep)], nRemoved
+
+##--SWD WRITER--
+# SWD files are written with a set number of significant digits for each floating point
+#  (attribute) column, rather than the up to 17 digits pandas writes for float64 values:
+#  the digits written set both the size of a file and the time Maxent takes to parse it.
+#  Rows are written in chunks, each formatted with one string format operation, and the
+#  chunks may be formatted in parallel (in a pool of processes), then written in order.
+#  Missing (NaN) values are written as -9999, Maxent's no data value. Text values and
+#  column names holding a comma, quote or line break are quoted, as the csv module quotes
+#  them. A pool is not started from a process that is itself a pool worker.
+swdPrecision = 7    # Significant digits of floating point values (float32 holds 7)
+
+def csvText(value):
+    '''Returns a value as CSV text, quoted if it holds a comma, quote or line break'''
+    text = "%s" % (value,)
+    if any([c in text for c in ',"\r\n']):
+        return '"' + text.replace('"','""') + '"'
+    return text
+
+def swdFormats(theDF,precision=swdPrecision,columnPrecision=None):
+    '''Returns the format of each column of a dataframe: floating point columns to the number
+       of significant digits listed for the column in the columnPrecision dictionary, or else
+       to precision digits; integers as integers, and other columns as text'''
+    if columnPrecision is None:
+        columnPrecision = {}
+    formats = []
+    for col, dtype in zip(theDF.columns,theDF.dtypes):
+        if dtype.kind == 'f':
+            formats.append("%.{}g".format(columnPrecision.get(col,precision)))
+        elif dtype.kind in 'iub':
+            formats.append("%d")
+        else:
+            formats.append("%s")
+    return formats
+
+def swdChunks(theDF,formats,chunkRows):
+    '''Yields the (row format, list of column values) job of each chunk of rows'''
+    rowFormat = ",".join(formats) + "\n"
+    for start in range(0,len(theDF),chunkRows):
+        columns = []
+        for col in theDF.columns:
+            values = theDF[col].values[start:start+chunkRows]
+            if values.dtype.kind == 'f':
+                values = np.where(np.isnan(values),-9999,values)
+            elif not values.dtype.kind in 'iub':
+                values = np.array([csvText(v) for v in values],dtype=object)
+            columns.append(values.tolist())
+        yield rowFormat, columns
+
+def formatRows(job):
+    '''Returns the text of a chunk of rows (a job yielded by swdChunks)'''
+    rowFormat, columns = job
+    nRows = len(columns[0]) if columns else 0
+    return (rowFormat * nRows) % tuple(itertools.chain.from_iterable(zip(*columns)))
+
+def writeSWD(outFN,theDF,precision=swdPrecision,columnPrecision=None,chunkRows=20000,nProcesses=1):
+    '''Writes a dataframe (without its index) to a CSV file in Maxent samples with data
+       (SWD) format, with floating point values written to the precision given (see
+       swdFormats). Chunks of rows are formatted in nProcesses processes (one, if called
+       from a pool worker, which cannot start processes of its own).'''
+    if multiprocessing.current_process().daemon:
+        nProcesses = 1
+    formats = swdFormats(theDF,precision,columnPrecision)
+    jobs = swdChunks(theDF,formats,chunkRows)
+    with open(outFN,'wb') as fileObj:
+        fileObj.write(",".join([csvText(col) for col in theDF.columns]) + "\n")
+        if nProcesses > 1 and len(theDF) > chunkRows:
+            pool = multiprocessing.Pool(nProcesses)
+            for text in pool.imap(formatRows,jobs):
+                fileObj.write(text)
+            pool.close()
+            pool.join()
+        else:
+            for job in jobs:
+                fileObj.write(formatRows(job))
+    return outFN
+
+##--BUILD CACHE--
+# Each species output (SWD or model data file) is keyed by an MD5 of its inputs: the
+#  species' occurrences (the catchments in which it is present and its HUC8s), the StreamCat
+#  files its records are read from (the attribute store, if built, or else the CSV files;
+#  their checksums, as tracked in the build manifest), and the settings
+#  of the script building it (e.g. the culling and correlation thresholds). The key is
+#  written, with the inputs it was made from, to a provenance file beside the output
+#  (<output>_provenance.json); an output is rebuilt only when its key no longer matches.
+def provenanceFile(outFN):
+    '''Returns the provenance filename of a species output'''
+    return os.path.splitext(outFN)[0] + "_provenance.json"
+
+def occurrenceDigest(index,sppName):
+    '''Returns the MD5 of a species' occurrences: its presence catchments and HUC8s'''
+    md5 = hashlib.md5()
+    md5.update(np.sort(presenceIDs(index,sppName)).astype(np.int64).tostring())
+    md5.update(",".join(indexHUC8s(index,sppName)))
+    return md5.hexdigest()
+
+def streamCatSources(storeFldr,csvFldr):
+    '''Returns the StreamCat files the species scripts read catchment records from (see
+       STREAMCAT_utils.extractHUC8s): the attribute matrix and registry, if built, or else the store's column
+       arrays and schema, with the store's key arrays; or, with no store, the CSV files in
+       the folder'''
+    if os.path.exists(sc.matrixFile(storeFldr)):
+        fileNames = [sc.matrixFile(storeFldr),os.path.join(storeFldr,"registry.csv")]
+    elif os.path.exists(storeFldr):
+        fileNames = [os.path.join(storeFldr,"schema.csv")]
+        fileNames += [os.path.join(storeFldr,f[:-4],col + ".npy") for f, col, dtype in sc.storeSchema(storeFldr)
+                      if not col in sc.keyCols]
+    elif os.path.exists(csvFldr):
+        return [os.path.join(csvFldr,f) for f in sorted(os.listdir(csvFldr))
+                if f[-4:].lower() == ".csv" and not f in ("StreamCatInfo.csv","BuildManifest.csv")]
+    else:
+        return []
+    keysFldr = os.path.join(storeFldr,"keys")
+    return fileNames + [os.path.join(keysFldr,f) for f in sorted(os.listdir(keysFldr))]
+
+def streamCatDigest(streamCatFldr,sourceFiles):
+    '''Returns the MD5 of the checksums of the StreamCat files species records are read from
+       (see streamCatSources), as recorded in the build manifest (which is updated for any
+       file that has changed); an error is raised if there are none'''
+    if not sourceFiles:
+        raise ValueError("No StreamCat files found in {} to key the species outputs on".format(streamCatFldr))
+    manifestFN = sc.buildManifestFile(streamCatFldr)
+    manifest = sc.readManifest(manifestFN)
+    sources = sc.sourceList(sourceFiles,streamCatFldr,manifest)
+    sc.writeManifest(manifestFN,manifest)
+    return hashlib.md5(sources).hexdigest()
+
+def buildKeys(eoCSV,streamCatFldr,sourceFiles,sppNames,settings):
+    '''Returns a dictionary of the provenance (build key, inputs and settings) of each
+       species' output, keyed on species name, from the StreamCat source files listed'''
+    index = occurrenceIndex(eoCSV)
+    streamCatMD5 = streamCatDigest(streamCatFldr,sourceFiles)
+    settingsText = ";".join(["{}={!r}".format(k,settings[k]) for k in sorted(settings)])
+    provenance = {}
+    for sppName in sppNames:
+        occurrenceMD5 = occurrenceDigest(index,sppName)
+        key = hashlib.md5("|".join([occurrenceMD5,streamCatMD5,settingsText])).hexdigest()
+        provenance[sppName] = {"Key":key,"Species":sppName,"Occurrences":occurrenceMD5,
+                               "StreamCat":streamCatMD5,"Settings":settings}
+    return provenance
+
+def readProvenance(outFN):
+    '''Returns the provenance recorded for an output; an empty dictionary is returned if
+       there is none (or it can't be read)'''
+    provFN = provenanceFile(outFN)
+    if not os.path.exists(provFN):
+        return {}
+    try:
+        with open(provFN,'rt') as fileObj:
+            return json.load(fileObj)
+    except ValueError:
+        return {}
+
+def isCurrent(outFN,provenance):
+    '''Returns True if the output exists and was built (see writeProvenance) with the
+       build key of the provenance given'''
+    if not os.path.exists(outFN):
+        return False
+    built = readProvenance(outFN)
+    return built.get("Key") == provenance["Key"] and built.get("Size") == os.path.getsize(outFN)
+
+def writeProvenance(outFN,provenance):
+    '''Writes the provenance of an output just built (with its size and build time)'''
+    record = dict(provenance)
+    record.update({"File":os.path.basename(outFN),"Size":os.path.getsize(outFN),
+                   "Built":time.strftime("%Y-%m-%d %H:%M:%S")})
+    #Write to a temporary file and then swap it in so a crash never leaves a partial record
+    provFN = provenanceFile(outFN)
+    tmpFN = provFN + ".tmp"
+    with open(tmpFN,'wt') as fileObj:
+        json.dump(record,fileObj,indent=1,sort_keys=True)
+    if os.path.exists(provFN): os.remove(provFN)
+    os.rename(tmpFN,provFN)
+    return provFN
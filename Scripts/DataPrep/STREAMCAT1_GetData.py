@@ -2,28 +2,163 @@
 #
 # Description: Downloads StreamCat data via FTP for processing with the GeoWET model
 #
+# Files are fetched over several simultaneous FTP connections in binary mode. Partial
+#  downloads are kept as *.part files and resumed from their byte offset when the script
+#  is re-run (or when a connection drops). Completed files are checked against the remote
+#  file size and against the MD5 checksums recorded in the Regions\manifest.csv file.
+#
+# Usage: STREAMCAT1_GetData.py [mirror folder] [number of connections] [regions (e.g. "03N,05,06")]
+#  If a mirror folder is given, files are copied from that local folder instead of the
+#  FTP server. The mirror is a flat folder of regional StreamCat files (i.e., a copy of
+#  the FTP folder) and may include a manifest.csv file from a previous download, in which
+#  case the checksums listed in it are verified.
+#
 # Summer 2016
 # John.Fay@duke.edu
 
-import sys, os, ftplib
+import sys, os, ftplib, shutil, threading, Queue
+from STREAMCAT_utils import fileMD5, readManifest, writeManifest
 
 #Set variables
 ftpURL="newftp.epa.gov"
 ftpDir="/EPADataCommons/ORD/NHDPlusLandscapeAttributes/StreamCat/HydroRegions/"
+nWorkers = 4        # Number of simultaneous connections
+nRetries = 5        # Number of times a dropped transfer is resumed before giving up
+blockSize = 2**20   # Bytes per transfer block
+mirrorDir = None    # Local folder to read files from in place of the FTP server
+
+#Optional arguments
+if len(sys.argv) > 1 and sys.argv[1] not in ("","#"):
+    mirrorDir = sys.argv[1]
+if len(sys.argv) > 2 and sys.argv[2] not in ("","#"):
+    nWorkers = int(sys.argv[2])
 
 #Regions to grab
 regions = ["03N","05","06"]
-     
+if len(sys.argv) > 3 and sys.argv[3] not in ("","#"):
+    regions = [r.strip() for r in sys.argv[3].split(",")]
+
+#Lock to keep messages from different connections from interleaving
+printLock = threading.Lock()
+
 ##--FUNCTIONS--
-def gettext(ftp, filename, outfile=None):
-    # fetch a text file
-    if outfile is None:
-        outfileObj = sys.stdout
-    else:
-        outfileObj = open(outfile,'wt')
-    # use a lambda to add newlines to the lines read from the server
-    ftp.retrlines("RETR " + filename, lambda s, w=outfileObj.write: w(s+"\n"))
-   
+def msg(txt):
+    with printLock:
+        print txt
+
+def ftpConnect():
+    '''Returns an anonymous FTP session set to the StreamCat folder, in binary mode'''
+    ftp = ftplib.FTP(ftpURL)
+    ftp.login("anonymous","GetWetUser")
+    ftp.cwd(ftpDir)
+    ftp.voidcmd("TYPE I")
+    return ftp
+
+def listFiles():
+    '''Returns a dictionary of file names and sizes from the FTP site (or the mirror)'''
+    fileSizes = {}
+    if mirrorDir:
+        for f in os.listdir(mirrorDir):
+            if f[-4:] == ".csv":
+                fileSizes[f] = os.path.getsize(os.path.join(mirrorDir,f))
+        return fileSizes
+    ftp = ftpConnect()
+    files = []
+    try:
+        files = ftp.nlst()
+    except ftplib.error_perm, resp:
+        if str(resp) == "550 No files found":
+            print "No files in this directory"
+        else:
+            raise
+    for f in files:
+        if f[-4:] == ".csv":
+            fileSizes[f] = ftp.size(f)
+    ftp.quit()
+    return fileSizes
+
+def copyFromMirror(f,partFN,offset):
+    '''Appends the bytes of the mirrored file beyond the offset to the part file'''
+    with open(os.path.join(mirrorDir,f),'rb') as srcObj:
+        srcObj.seek(offset)
+        with open(partFN,'ab') as outObj:
+            shutil.copyfileobj(srcObj,outObj,blockSize)
+
+def fetchFromFTP(ftp,f,partFN,offset):
+    '''Appends the bytes of the remote file beyond the offset to the part file'''
+    with open(partFN,'ab') as outObj:
+        ftp.retrbinary("RETR " + f, outObj.write, blockSize, rest=offset or None)
+
+def getFile(ftp,f,outFN,remoteSize,expectedMD5):
+    '''Downloads (or resumes) a file; returns its MD5 checksum once size and checksum are verified'''
+    partFN = outFN + ".part"
+    #A complete file exists: keep it if it matches the remote size and the recorded checksum
+    if os.path.exists(outFN):
+        localSize = os.path.getsize(outFN)
+        if localSize == remoteSize:
+            localMD5 = fileMD5(outFN)
+            if expectedMD5 in (None,localMD5):
+                msg("{} exists; skipping".format(outFN))
+                return localMD5
+            msg("{} fails checksum; downloading again".format(f))
+            os.remove(outFN)
+        elif localSize < remoteSize:
+            #Truncated by an earlier run; resume it
+            if os.path.exists(partFN): os.remove(partFN)
+            os.rename(outFN,partFN)
+        else:
+            os.remove(outFN)
+    #Fetch the remaining bytes, reconnecting and resuming if the transfer drops
+    for attempt in range(nRetries):
+        offset = os.path.getsize(partFN) if os.path.exists(partFN) else 0
+        if offset > remoteSize:
+            os.remove(partFN)
+            offset = 0
+        if offset < remoteSize:
+            if offset: msg("resuming {} at byte {}".format(f,offset))
+            else: msg("downloading {}".format(f))
+            try:
+                if mirrorDir:
+                    copyFromMirror(f,partFN,offset)
+                else:
+                    if ftp[0] is None: ftp[0] = ftpConnect()
+                    fetchFromFTP(ftp[0],f,partFN,offset)
+            except ftplib.all_errors, e:
+                msg("...transfer of {} interrupted ({}); retrying".format(f,e))
+                try: ftp[0].close()
+                except: pass
+                ftp[0] = None
+                continue
+        #Verify the finished transfer
+        if os.path.getsize(partFN) <> remoteSize: continue
+        localMD5 = fileMD5(partFN)
+        if expectedMD5 not in (None,localMD5):
+            msg("...{} fails checksum; starting over".format(f))
+            os.remove(partFN)
+            continue
+        os.rename(partFN,outFN)
+        msg("...{} complete".format(f))
+        return localMD5
+    msg("***Could not download {}".format(f))
+    return None
+
+def worker(jobQueue,results):
+    '''Processes download jobs over a single connection until the queue is empty'''
+    ftp = [None]   #Connection is opened on demand (and reopened after a drop)
+    while True:
+        try:
+            f, outFN, remoteSize, expectedMD5 = jobQueue.get_nowait()
+        except Queue.Empty:
+            break
+        try:
+            results[f] = getFile(ftp,f,outFN,remoteSize,expectedMD5)
+        except Exception, e:
+            msg("***Error downloading {}: {}".format(f,e))
+            results[f] = None
+    if ftp[0] is not None:
+        try: ftp[0].quit()
+        except: pass
+
 #Get paths; create folders if not present
 scriptDir = os.path.dirname(sys.argv[0])
 rootDir = os.path.dirname(os.path.dirname(scriptDir)) #up two folders
@@ -43,32 +178,54 @@ for region in regions:
         os.mkdir(theDir)
 
 ##--PROCEDURE---
-#Log into the site
-ftp = ftplib.FTP(ftpURL)
-ftp.login("anonymous","GetWetUser")
-
-#Go to the current directory
-ftp.cwd(ftpDir)
-
-#Get a list of files
-files = []
-try:
-    files = ftp.nlst()
-except ftplib.error_perm, resp:
-    if str(resp) == "550 No files found":
-        print "No files in this directory"
-    else:
-        raise
-    
-#Loop through the files in the folder
-for f in files:
+#Read the manifest of previously downloaded files, and the mirror's manifest if provided
+manifestFN = os.path.join(regionDir,"manifest.csv")
+manifest = readManifest(manifestFN)
+if mirrorDir:
+    print "Reading files from mirror folder {}".format(mirrorDir)
+    mirrorManifest = readManifest(os.path.join(mirrorDir,"manifest.csv"))
+else:
+    mirrorManifest = {}
+
+#Get a list of files and their sizes
+fileSizes = listFiles()
+
+#Queue a download job for each regional file
+jobQueue = Queue.Queue()
+for f in sorted(fileSizes.keys()):
     for region in regions:
         regionSearch = region + ".csv"
-        if region in f:
+        if f.endswith(regionSearch):
             outFN = os.path.join(regionDir,region,f)
-            if os.path.exists(outFN):
-                print "{} exists; skipping".format(outFN)
-            else:
-                print "downloading {}".format(f)
-                gettext(ftp,f,outFN)
-            
\ No newline at end of file
+            #Prefer checksums from the mirror; otherwise use those of the last verified download
+            expected = mirrorManifest.get(f) or manifest.get(f)
+            expectedMD5 = None
+            if expected and int(expected["Size"]) == fileSizes[f]:
+                expectedMD5 = expected["MD5"] or None
+            jobQueue.put((f,outFN,fileSizes[f],expectedMD5))
+print "{} files to check using {} connections".format(jobQueue.qsize(),nWorkers)
+
+#Start the workers and wait for them to finish
+results = {}
+threads = []
+for i in range(nWorkers):
+    t = threading.Thread(target=worker,args=(jobQueue,results))
+    t.start()
+    threads.append(t)
+for t in threads:
+    t.join()
+
+#Update the manifest with the verified files
+failed = []
+for f, md5 in results.items():
+    if md5 is None:
+        failed.append(f)
+    else:
+        manifest[f] = {"File":f,"Size":fileSizes[f],"MD5":md5}
+writeManifest(manifestFN,manifest)
+print "{} files verified; manifest written to {}".format(len(results)-len(failed),manifestFN)
+if failed:
+    print "{} files failed; re-run the script to resume them:".format(len(failed))
+    for f in sorted(failed):
+        print "   {}".format(f)
+    sys.exit(1)
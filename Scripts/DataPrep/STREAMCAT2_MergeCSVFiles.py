@@ -1,68 +1,236 @@
 #MergeStreamCatCSVFiles.py
 #
 # Description: Merges regional stream cat data files into a single file. The regional
-#  files need to be downloaded to the StreamCat/Regional/XX folders, where XX is the
-#  region name (.e.g., "03N").
+#  files need to be downloaded to the StreamCat/Regions/XX folders, where XX is the
+#  region name (.e.g., "03N"), and are named <Theme>XX.csv (e.g. "BFI_Region03N.csv").
+#  Any list of NHDPlus regions may be merged; by default all region folders present are.
 #
-#  ALSO, the HUC12Lookup.csv file must reside in the Data/Tooldata folder. The HUC12Lookup
-#  file is used to attach HUC lookup values to each combined table.
+#  ALSO, the HUC12 lookup (HUC12Lookup.csv in the Data/Tooldata folder, or else the
+#  HUC12Lookup.7z archive in Data/ToolData or Data) is used to attach HUC lookup values to
+#  each combined table. It is converted once to a binary, memory mapped lookup (see
+#  huc12Lookup in STREAMCAT_utils.py); reading the archive requires the 7z executable.
 #
 #  This script must be run AFTER having downloaded all the stream cat data and BEFORE
 #  any scripts creating a project. 
 #
+#  Themes are merged in parallel, one per process. By default the regional files are
+#  streamed in chunks: each chunk is joined to the HUC12 lookup (by binary search on its
+#  sorted FEATUREIDs) and appended to the output, so memory use is fixed by the chunk size
+#  rather than the size of the regions. Supply a chunk size of 0 to merge the files
+#  entirely in memory instead. A theme fails (and its output is removed) if any region's
+#  file is missing, has columns differing from the other regions' files, or contributes
+#  no catchments found in the lookup.
+#
+#  Both merges write the records in data order: region by region, each in its file's
+#  row order. OID numbers them consecutively from 0 in that order; it is no longer
+#  the catchment's row in the HUC12 lookup, so the merged files differ in row order and
+#  OID from those written by earlier versions of this script.
+#
+#  The size, mtime and checksum of each regional file and merged output are tracked in
+#  StreamCat/BuildManifest.csv. On re-runs only the themes whose regional files have
+#  changed (or whose output is missing) are merged again, and any species SWD files and
+#  models in Data/SpeciesModels built from older versions of the merged files are listed.
+#
+# Usage: STREAMCAT2_MergeCSVFiles.py [chunk size (rows)] [regions (e.g. "03N,05,06")]
+#                                    [number of processes]
+#
 # June 2016
 # John.Fay@duke.edu
 
-import sys, os, pandas
+import sys, os, time, pandas, multiprocessing
 import numpy as np
+import STREAMCAT_utils as sc
 
 #Workspaces
-rootFldr = os.path.dirname(os.path.dirname(os.path.dirname(sys.argv[0])))
+rootFldr = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))
 baseFldr = os.path.join(rootFldr,"Data","StreamCat")
 regionFldr = os.path.join(baseFldr,"Regions")
-rgn03N = os.path.join(regionFldr,"03N")
-rgn05 =  os.path.join(regionFldr,"05")
-rgn05 =  os.path.join(regionFldr,"06")
+outFldr = os.path.join(baseFldr,"AllRegions")
+speciesFldr = os.path.join(rootFldr,"Data","SpeciesModels")
+manifestFN = sc.buildManifestFile(baseFldr)
 
-#Get list of files
-csvFiles = os.listdir(rgn03N)
+#Rows per chunk when streaming; 0 = merge in memory
+chunkSize = 100000
+if len(sys.argv) > 1 and sys.argv[1] not in ("","#"): chunkSize = int(sys.argv[1])
 
-#Get the catchment lookup table (to add HUC12, GRIDCODE columns)
-nhdTableFN = os.path.join(rootFldr,"Data","Tooldata","HUC12Lookup.csv")
+#Regions to merge; default = all region folders
+if len(sys.argv) > 2 and sys.argv[2] not in ("","#"):
+    regions = [r.strip() for r in sys.argv[2].split(",")]
+else:
+    regions = sorted([r for r in os.listdir(regionFldr) if os.path.isdir(os.path.join(regionFldr,r))])
 
-#Create a dataframe from the HUC12 Lookup
-cols = ("GRIDCODE","FEATUREID","REACHCODE","HUC_12")
-dtypes = {"GRIDCODE":np.str,"FEATUREID":np.str,"REACHCODE":np.str,"HUC_12":np.str}
-dfNHD = pandas.read_csv(nhdTableFN,usecols=cols,dtype=dtypes)
+#Number of themes merged at once
+nProcesses = multiprocessing.cpu_count()
+if len(sys.argv) > 3 and sys.argv[3] not in ("","#"): nProcesses = int(sys.argv[3])
 
-#Loop through each file and merge records into a single file
-for csvFile in csvFiles:
-    if csvFile[-3:] <> "csv": continue
-    print "Merging {}".format(csvFile.replace("03N",""))
+#HUC12 lookup (to add HUC12, GRIDCODE columns); loaded in each process when first used
+lookupFldr = sc.huc12LookupFolder(rootFldr)
+lookupCols = list(sc.lookupCols)
+lookup = None
 
-    #Data Files to be read
-    file03n = os.path.join(rgn03N,csvFile)
-    file05 = file03n.replace("03N","05")
-    file06 = file03n.replace("03N","06")
+##--FUNCTIONS--
+def listThemes(regionFldr,regions):
+    '''Returns a dictionary of the regional files of each theme, keyed on the theme's
+       output file name (e.g. "BFI_Region.csv"); regions lacking the theme are left out'''
+    themes = {}
+    for region in regions:
+        suffix = region + ".csv"
+        for f in os.listdir(os.path.join(regionFldr,region)):
+            if f.endswith(suffix):
+                themes.setdefault(f[:-len(suffix)] + ".csv",{})[region] = os.path.join(regionFldr,region,f)
+    return themes
 
-    #Output file -- in StreamCat folder
-    outFN = os.path.join(baseFldr,"AllRegions",csvFile.replace("03N",""))
-    if os.path.exists(outFN): continue
+def joinLookup(dataDF):
+    '''Returns the records of a regional dataframe found in the HUC12 lookup, with the
+       lookup columns (in place of COMID) prepended'''
+    global lookup
+    if lookup is None:
+        lookup = sc.loadHUC12Lookup(lookupFldr)
+    rows = sc.lookupRows(lookup,dataDF["COMID"].values)
+    found = rows >= 0
+    outDF = sc.lookupFrame(lookup,rows[found])
+    for col in dataDF.columns:
+        if col <> "COMID":
+            outDF[col] = dataDF[col].values[found]
+    return outDF
 
-    #Data frames
-    df03n = pandas.read_csv(file03n,dtype={"COMID":np.str})
-    df05 = pandas.read_csv(file05,dtype={"COMID":np.str})
-    df06 = pandas.read_csv(file06,dtype={"COMID":np.str})
+def headerMismatch(inFiles):
+    '''Returns a message naming the first regional file whose columns differ from those
+       of the first file, and the columns that differ; None if all files match'''
+    headers = []
+    for fn in inFiles:
+        with open(fn,'rb') as inObj:
+            headers.append(inObj.readline().strip().split(","))
+    for fn, header in zip(inFiles[1:],headers[1:]):
+        missing = [c for c in headers[0] if not c in header]
+        extra = [c for c in header if not c in headers[0]]
+        if missing or extra:
+            diffs = []
+            if missing: diffs.append("lacks {}".format(", ".join(missing)))
+            if extra: diffs.append("adds {}".format(", ".join(extra)))
+            return "columns of {} differ from {}: {}".format(os.path.basename(fn),os.path.basename(inFiles[0]),"; ".join(diffs))
+    return None
 
-    #Merge data frames
-    dfAll = [df03n, df05, df06]
-    result = pandas.concat(dfAll)
+def mergeInMemory(inFiles,outFN):
+    '''Reads the regional files whole, merges them, and writes the result; returns the
+       number of records written from each file'''
+    #Join each file's records to the HUC12 lookup columns
+    dfAll = [joinLookup(pandas.read_csv(fn,dtype={"COMID":sc.keyDtypes["COMID"]})) for fn in inFiles]
+    nRows = [len(df) for df in dfAll]
 
-    #Join HUC12 lookup columns
-    indexed_df = result.set_index("COMID")
-    outDF = pandas.merge(dfNHD,indexed_df,left_on="FEATUREID",right_index=True)
+    #Merge data frames (in data order, numbered from 0, as the streaming merge writes them)
+    outDF = pandas.concat(dfAll,ignore_index=True)
 
     #Write to new file
     shp = outDF.shape
     print "...writing {} records and {} columns to {}".format(shp[0],shp[1],outFN)
     outDF.to_csv(outFN,index_label="OID",na_rep="-9999")
+    print sc.memoryReport("merged",outDF)
+    return nRows
+
+def mergeStreaming(inFiles,outFN,chunkSize):
+    '''Joins the regional files to the lookup one chunk at a time, appending to the output;
+       returns the number of records written from each file'''
+    outObj = open(outFN,'wb')
+    dataCols = None
+    nRows = []
+    for fn in inFiles:
+        nRows.append(0)
+        for chunk in pandas.read_csv(fn,dtype={"COMID":sc.keyDtypes["COMID"]},chunksize=chunkSize):
+            #Use the first file's column order for all chunks
+            if dataCols is None:
+                dataCols = [c for c in chunk.columns if c <> "COMID"]
+            #Join the chunk to the lookup on FEATUREID (inner join)
+            outDF = joinLookup(chunk[["COMID"] + dataCols])
+            if len(outDF) == 0: continue
+            #Number the records consecutively across chunks
+            nTotal = sum(nRows)
+            outDF.index = np.arange(nTotal,nTotal + len(outDF))
+            outDF.to_csv(outObj,index_label="OID",na_rep="-9999",header=(nTotal == 0))
+            nRows[-1] += len(outDF)
+    outObj.close()
+    print "...wrote {} records and {} columns to {}".format(sum(nRows),len(lookupCols) + len(dataCols),outFN)
+    print sc.memoryReport("merged")
+    return nRows
+
+def mergeTheme(job):
+    '''Merges the regional files of a theme (run in a worker process); returns the theme,
+       its input files, and an error message (None if the merge succeeded)'''
+    theme, inFiles, outFN = job
+    print "Merging {}".format(theme)
+    #Make sure every region's file has the same columns before writing anything
+    mismatch = headerMismatch(inFiles)
+    if mismatch:
+        return theme, inFiles, mismatch
+    #Write to a temporary file so a failed or interrupted merge never replaces the output
+    tmpFN = outFN + ".tmp"
+    try:
+        if chunkSize > 0:
+            nRows = mergeStreaming(inFiles,tmpFN,chunkSize)
+        else:
+            nRows = mergeInMemory(inFiles,tmpFN)
+    except Exception, e:
+        if os.path.exists(tmpFN): os.remove(tmpFN)
+        return theme, inFiles, "{}: {}".format(type(e).__name__,e)
+    #Make sure every region contributed records
+    empty = [os.path.basename(fn) for fn, n in zip(inFiles,nRows) if n == 0]
+    if empty:
+        os.remove(tmpFN)
+        return theme, inFiles, "no catchment records from {}".format(", ".join(empty))
+    if os.path.exists(outFN): os.remove(outFN)
+    os.rename(tmpFN,outFN)
+    return theme, inFiles, None
+
+##--PROCEDURE--
+if __name__ == "__main__":
+    print "Merging regions: {}".format(", ".join(regions))
+    if not os.path.exists(outFldr): os.mkdir(outFldr)
+
+    #Build the binary HUC12 lookup, if needed, before the workers use it
+    lookupSourceFN = sc.huc12LookupSource(rootFldr)
+    sc.huc12Lookup(rootFldr)
+    print sc.memoryReport("lookup")
+
+    #Read the build manifest
+    manifest = sc.readManifest(manifestFN)
+
+    #List the themes needing a merge: those whose regional files (or lookup) have changed
+    jobs = []
+    failed = []
+    themes = listThemes(regionFldr,regions)
+    for theme in sorted(themes.keys()):
+        missing = [r for r in regions if not r in themes[theme]]
+        if missing:
+            failed.append((theme,"no file for region(s) {}".format(", ".join(missing))))
+            continue
+        inFiles = [themes[theme][r] for r in regions]
+        outFN = os.path.join(outFldr,theme)
+        if not sc.needsBuild(outFN,inFiles + [lookupSourceFN],baseFldr,manifest):
+            continue
+        jobs.append((theme,inFiles,outFN))
+    print "{} of {} themes to merge using {} processes".format(len(jobs),len(themes),nProcesses)
+
+    #Merge the themes in parallel, recording each in the manifest as it finishes
+    rebuilt = []
+    pool = multiprocessing.Pool(max(1,min(nProcesses,len(jobs))))
+    for theme, inFiles, error in pool.imap_unordered(mergeTheme,jobs):
+        if error:
+            failed.append((theme,error))
+            continue
+        sc.recordBuild(os.path.join(outFldr,theme),inFiles + [lookupSourceFN],baseFldr,manifest,time.time())
+        sc.writeManifest(manifestFN,manifest)
+        rebuilt.append(theme)
+    pool.close()
+    pool.join()
+
+    #Report what was rebuilt and what species outputs are now out of date
+    print "{} merged files rebuilt".format(len(rebuilt))
+    for f in sorted(rebuilt): print "   {}".format(f)
+    stale = sc.staleSpeciesFiles(speciesFldr,baseFldr,manifest)
+    if stale:
+        print "{} species files/models are out of date and should be rebuilt:".format(len(stale))
+        for f, reason in stale: print "   {} ({})".format(f,reason)
+    if failed:
+        print "{} themes failed:".format(len(failed))
+        for theme, error in sorted(failed): print "   {} ({})".format(theme,error)
+        sys.exit(1)
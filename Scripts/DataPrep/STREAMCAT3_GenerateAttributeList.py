@@ -2,17 +2,28 @@
 #
 # Creates a CSV file listing all the attributes included in the Stream Cat data alongside the file
 #  in which they occur. This is used in later scripts to extract specific attributes from the proper
-#  file. 
+#  file.
+#
+# Also creates an attribute catalog (StreamCatCatalog.db, a SQLite database) holding, for each
+#  attribute, its dtype, its count of missing (-9999) values and its min/max/mean, as well as the
+#  count, missing count and min/max of each attribute within each HUC8. Scripts query the catalog
+#  (see STREAMCAT_utils.nullAttributes) to skip attributes with no data in a set of HUC8s
+#  without loading them.
 #
 # June 2016
 # John.Fay@duke.edu
 
-import sys, os, pandas
+import sys, os, pandas, sqlite3
+import numpy as np
 
 # Get the files
 rootFldr = os.path.dirname(os.path.dirname(os.path.dirname(sys.argv[0])))
 streamCatFldr = os.path.join(rootFldr,'Data','StreamCat')
-files = os.listdir(streamCatFldr)
+# Use the merged files, if present
+dataFldr = os.path.join(streamCatFldr,'AllRegions')
+if not os.path.exists(dataFldr):
+    dataFldr = streamCatFldr
+files = os.listdir(dataFldr)
 
 # Set the outpuf file name
 outFN = os.path.join(streamCatFldr,'StreamCatInfo.csv')
@@ -22,15 +33,24 @@ outFObj.write("File, Attirbute\n")
 # Set the filter (filenames not to report
 filter = ("OID","GRIDCODE","FEATUREID","REACHCODE","HUC_12")
 
+# Create the catalog database
+catalogFN = os.path.join(streamCatFldr,'StreamCatCatalog.db')
+if os.path.exists(catalogFN): os.remove(catalogFN)
+conn = sqlite3.connect(catalogFN)
+conn.execute('''CREATE TABLE attributes (File TEXT, Attribute TEXT, Dtype TEXT, Count INTEGER,
+                NullCount INTEGER, Min REAL, Max REAL, Mean REAL)''')
+conn.execute('''CREATE TABLE huc8stats (File TEXT, Attribute TEXT, HUC8 TEXT, Count INTEGER,
+                NullCount INTEGER, Min REAL, Max REAL)''')
+
 #Set the current working directory
-os.chdir(streamCatFldr)
+os.chdir(dataFldr)
 
 #Loop through all files
 for fName in files:
     #Skip if not a csv file
     if fName[-4:] <> '.csv': continue
     #Skip if name is the output file
-    if fName == outFN: continue
+    if fName == os.path.basename(outFN): continue
     #Get the header line
     with open(fName,'rt') as fObj:
         headerLine = fObj.readline()[:-1]
@@ -41,5 +61,35 @@ for fName in files:
         if headerItem not in filter:
             outFObj.write("{}, {}\n".format(fName,headerItem))
 
+    #Compute the catalog statistics for the file's attributes
+    print "Cataloging {}".format(fName)
+    dataDF = pandas.read_csv(fName,dtype={"HUC_12":np.str})
+    huc8s = dataDF["HUC_12"].str[:8]
+    attributes = [h for h in headerItems if h not in filter]
+    #Missing values (-9999, or -9998 in older files) are set to NaN so they drop out of the stats
+    valuesDF = dataDF[attributes].astype(np.float64)
+    nullMask = valuesDF.isnull() | (valuesDF <= -9998)
+    valuesDF = valuesDF.mask(nullMask)
+    for attribute in attributes:
+        values = valuesDF[attribute]
+        conn.execute("INSERT INTO attributes VALUES (?,?,?,?,?,?,?,?)",
+                     (fName,attribute,str(dataDF[attribute].dtype),int(values.count()),
+                      int(nullMask[attribute].sum()),values.min(),values.max(),values.mean()))
+    #Per HUC8 statistics
+    grouped = valuesDF.groupby(huc8s)
+    counts = grouped.count(); mins = grouped.min(); maxs = grouped.max()
+    nulls = nullMask.groupby(huc8s).sum()
+    for attribute in attributes:
+        rows = zip([fName]*len(counts),[attribute]*len(counts),counts.index,
+                   counts[attribute].astype(int).tolist(),nulls[attribute].astype(int).tolist(),
+                   mins[attribute].tolist(),maxs[attribute].tolist())
+        conn.executemany("INSERT INTO huc8stats VALUES (?,?,?,?,?,?,?)",rows)
+
 outFObj.close()
-    
\ No newline at end of file
+
+#Index and close the catalog
+conn.execute("CREATE INDEX idx_attribute ON attributes (Attribute)")
+conn.execute("CREATE INDEX idx_huc8 ON huc8stats (HUC8)")
+conn.commit()
+conn.close()
+print "Catalog written to {}".format(catalogFN)
@@ -0,0 +1,235 @@
+#STREAMCAT4_CreateAttributeStore.py
+#
+# Description: Converts the merged StreamCat CSV files (in Data/StreamCat/AllRegions) into
+#  a typed, columnar attribute store (Data/StreamCat/Store): a folder of numpy arrays, one
+#  per column, that can be memory mapped so scripts read only the columns and catchment
+#  rows they need instead of parsing every CSV file on every run.
+#
+#  Store layout:
+#   Store/keys/<Key>.npy      - OID, GRIDCODE, FEATUREID, REACHCODE, HUC_12 (shared by all files)
+#   Store/<File>/<Column>.npy - attribute columns of each StreamCat file
+#   Store/keys/hucIndex.npz   - row range of each HUC2, 4, 6, 8, 10 and 12 code
+#   Store/schema.csv          - File, Column, Dtype listing, in original CSV column order
+#   Store/matrix.npy          - all attributes, deduplicated, as one catchment x attribute matrix
+#   Store/registry.csv        - Attribute, File, Dtype, CatWs, Position of each matrix column
+#   Store/huc8stats/<HUC8>.npz - attribute statistics of each HUC8, cached when first used by
+#                               the species scripts (see SPECIES_utils.py)
+#
+#  Attributes are stored as float32 (integer columns as int16 or int32, whichever holds
+#  their range; see the dtype schema in STREAMCAT_utils.py); REACHCODE and HUC_12 as
+#  fixed width strings. Rows are sorted on HUC_12 and REACHCODE, so every HUC is a
+#  contiguous block of rows, and the rows of every file are aligned to the key arrays on
+#  FEATUREID.
+#  Use the functions in STREAMCAT_utils.py (readStore, huc8Rows, ...) to read the store.
+#
+#  This script must be run AFTER STREAMCAT2_MergeCSVFiles.py. It needs only be re-run when
+#  the AllRegions files change: the files each store folder was converted from are recorded
+#  in StreamCat/BuildManifest.csv, and on re-runs only the changed files are converted
+#  again (the registry and matrix are then rebuilt from the stored columns). The manifest
+#  also records a fingerprint of each file's key rows (KeyRows and KeyMD5; see
+#  keyFingerprint in STREAMCAT_utils.py): if the changed files' key rows match those
+#  recorded, the stored key arrays are kept and the unchanged files are not read at all.
+#  Otherwise the keys of every file are read, and the store is rebuilt from scratch if the
+#  set of catchments has changed.
+
+import sys, os, csv, shutil, time
+import pandas as pd
+import numpy as np
+import STREAMCAT_utils as sc
+
+#Workspaces
+rootFldr = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(sys.argv[0]))))
+allRegionsFldr = os.path.join(rootFldr,"Data","StreamCat","AllRegions")
+streamCatInfoCSV = os.path.join(rootFldr,"Data","StreamCat","StreamCatInfo.csv")
+storeFldr = sc.storeFolder(allRegionsFldr)
+streamCatFldr = os.path.dirname(allRegionsFldr)
+manifestFN = sc.buildManifestFile(streamCatFldr)
+
+##--FUNCTIONS--
+def readKeys(csvFile):
+    '''Returns a dataframe of the key columns of a merged StreamCat file'''
+    return pd.read_csv(os.path.join(allRegionsFldr,csvFile),usecols=sc.keyCols,
+                       dtype={"REACHCODE":np.str,"HUC_12":np.str})
+
+def storeKeys():
+    '''Returns a dataframe of the key arrays saved in the store'''
+    return pd.DataFrame(dict([(col,np.load(os.path.join(storeFldr,"keys",col + ".npy")))
+                              for col in sc.keyCols]),columns=sc.keyCols)
+
+def recordedFingerprint(csvFile):
+    '''Returns the key fingerprint recorded in the manifest when a file was last converted'''
+    rec = manifest.get(sc.relativeName(os.path.join(storeFldr,csvFile[:-4]),streamCatFldr),{})
+    return rec.get("KeyRows"), rec.get("KeyMD5")
+
+def convertFile(csvFile):
+    '''Writes the attribute columns of a merged StreamCat file to the store, returning its
+       (File, Column, Dtype) schema entries'''
+    fileSchema = []
+    dataDF = pd.read_csv(os.path.join(allRegionsFldr,csvFile),dtype={"REACHCODE":np.str,"HUC_12":np.str})
+    rows = rowIndex.reindex(dataDF["FEATUREID"].values).values
+    fileFldr = os.path.join(storeFldr,csvFile[:-4])
+    if os.path.exists(fileFldr): shutil.rmtree(fileFldr)
+    os.mkdir(fileFldr)
+    for col in dataDF.columns:
+        if col in sc.keyCols:
+            fileSchema.append((csvFile,col,np.dtype(sc.storeKeyDtypes[col]).str))
+            continue
+        dtype = sc.schemaDtype(dataDF[col])
+        #Catchments missing from the file get the StreamCat no data value
+        arr = np.empty(len(rowIndex),dtype=dtype)
+        arr.fill(-9999)
+        arr[rows] = dataDF[col].fillna(-9999).values.astype(dtype)
+        np.save(os.path.join(fileFldr,col + ".npy"),arr)
+        fileSchema.append((csvFile,col,np.dtype(dtype).str))
+    return fileSchema
+
+##--PROCEDURE--
+#List the merged StreamCat files
+csvFiles = sorted([f for f in os.listdir(allRegionsFldr) if f[-4:].lower() == ".csv"])
+print "Creating attribute store from {} StreamCat files".format(len(csvFiles))
+
+#Find the files that have changed since they were converted (see the build manifest)
+manifest = sc.readManifest(manifestFN)
+changedFiles = []
+for csvFile in csvFiles:
+    fileFldr = os.path.join(storeFldr,csvFile[:-4])
+    if sc.needsBuild(fileFldr,[os.path.join(allRegionsFldr,csvFile)],streamCatFldr,manifest):
+        changedFiles.append(csvFile)
+schemaFN = os.path.join(storeFldr,"schema.csv")
+storeExists = os.path.exists(schemaFN) and os.path.exists(sc.matrixFile(storeFldr))
+if storeExists and not changedFiles:
+    print "No files have changed; the store is up to date"
+    sys.exit(0)
+
+#Fingerprint the key rows of the changed files. If the store holds the same files and each
+# changed file's key rows are those recorded when it was last converted, the stored keys
+# still hold (they are built from the key rows of all files) and no other file is read.
+print "Collecting catchment keys"
+fingerprints = {}
+for csvFile in changedFiles:
+    fingerprints[csvFile] = sc.keyFingerprint(readKeys(csvFile))
+sameKeys = (storeExists and sorted(sc.storeFiles(storeFldr)) == csvFiles and
+            all([fingerprints[f] == recordedFingerprint(f) for f in changedFiles]))
+if sameKeys:
+    print "...key rows of the changed files are unchanged; keeping the stored keys"
+    keyDF = storeKeys()
+else:
+    #Build the key arrays from the union of the catchments in all files
+    keyFrames = []
+    for csvFile in csvFiles:
+        keyFrames.append(readKeys(csvFile))
+        fingerprints[csvFile] = sc.keyFingerprint(keyFrames[-1])
+    keyDF = pd.concat(keyFrames).drop_duplicates("FEATUREID")
+    del keyFrames
+
+    #Sort the catchments on HUC so each HUC's catchments are contiguous
+    keyDF.sort_values(["HUC_12","REACHCODE"],kind="mergesort",inplace=True)
+    keyDF.reset_index(drop=True,inplace=True)
+print "...{} catchments".format(len(keyDF))
+
+#Only the changed files need converting if the store's catchment rows are unchanged
+if sameKeys:
+    rebuild = False
+elif storeExists:
+    storedIDs = np.load(os.path.join(storeFldr,"keys","FEATUREID.npy"))
+    storedHUCs = np.load(os.path.join(storeFldr,"keys","HUC_12.npy"))
+    rebuild = not (np.array_equal(storedIDs,keyDF["FEATUREID"].values) and
+                   np.array_equal(storedHUCs,keyDF["HUC_12"].values.astype(sc.storeKeyDtypes["HUC_12"])))
+    if rebuild: print "Catchments have changed; rebuilding the store"
+else:
+    rebuild = True
+
+if rebuild:
+    #Start with a fresh store folder
+    if os.path.exists(storeFldr):
+        print "Removing existing store"
+        shutil.rmtree(storeFldr)
+    os.mkdir(storeFldr)
+    os.mkdir(os.path.join(storeFldr,"keys"))
+    changedFiles = csvFiles
+    oldSchema = []
+else:
+    print "Updating {} changed files".format(len(changedFiles))
+    #Keep the schema entries of the unchanged files
+    oldSchema = sc.storeSchema(storeFldr)
+    #Remove the store folders of files no longer in the AllRegions folder
+    for fileName in sc.storeFiles(storeFldr):
+        if not fileName in csvFiles:
+            print "Removing {} from the store".format(fileName)
+            shutil.rmtree(os.path.join(storeFldr,fileName[:-4]))
+            manifest.pop(sc.relativeName(os.path.join(storeFldr,fileName[:-4]),streamCatFldr),None)
+
+if not sameKeys:
+    #Save the keys (OIDs are taken from the first file listing each catchment, so may change)
+    for col in sc.keyCols:
+        np.save(os.path.join(storeFldr,"keys",col + ".npy"),keyDF[col].values.astype(sc.storeKeyDtypes[col]))
+
+    #Index the row range of each HUC code
+    print "Indexing HUC row ranges"
+    hucIndex = sc.buildHUCIndex(keyDF["HUC_12"].values.astype(sc.storeKeyDtypes["HUC_12"]))
+    np.savez(os.path.join(storeFldr,"keys","hucIndex.npz"),**hucIndex)
+    for level in sc.hucLevels:
+        print "...{} HUC{}s".format(len(hucIndex["huc{}".format(level)]),level)
+
+#Index of FEATUREID to store row, used to align each file's rows to the keys
+rowIndex = pd.Series(np.arange(len(keyDF)),index=keyDF["FEATUREID"].values)
+
+#Convert each (changed) file
+fileSchemas = {}
+for f, col, dtype in oldSchema:
+    fileSchemas.setdefault(f,[]).append((f,col,dtype))
+for csvFile in changedFiles:
+    print "Converting {}".format(csvFile)
+    fileSchemas[csvFile] = convertFile(csvFile)
+    sc.recordBuild(os.path.join(storeFldr,csvFile[:-4]),[os.path.join(allRegionsFldr,csvFile)],
+                   streamCatFldr,manifest,time.time())
+#Record the key fingerprint of each file read (so unchanged files converted before the
+# fingerprint was recorded get one too)
+for csvFile, (keyRows, keyMD5) in fingerprints.items():
+    rec = manifest.get(sc.relativeName(os.path.join(storeFldr,csvFile[:-4]),streamCatFldr))
+    if rec: rec.update({"KeyRows":keyRows,"KeyMD5":keyMD5})
+schema = []
+for csvFile in csvFiles:
+    schema.extend(fileSchemas[csvFile])
+
+#Write the schema
+with open(os.path.join(storeFldr,"schema.csv"),'wb') as fileObj:
+    writer = csv.writer(fileObj)
+    writer.writerow(("File","Column","Dtype"))
+    writer.writerows(schema)
+
+#Build the attribute registry: one entry per attribute, in the order listed in the
+# StreamCatInfo file (created by STREAMCAT3_GenerateAttributeList.py), each taken from
+# the first file in which it occurs
+print "Creating attribute registry"
+storedAttributes = [(f,col) for f, col, dtype in schema if not col in sc.keyCols]
+storedDtypes = dict(((f,col),dtype) for f, col, dtype in schema)
+if os.path.exists(streamCatInfoCSV):
+    listedAttributes = [a for a in sc.readAttributeList(streamCatInfoCSV) if a in storedDtypes]
+else:
+    listedAttributes = []
+registry = []
+seen = set()
+for fileName, attribute in listedAttributes + storedAttributes:
+    if attribute in seen: continue
+    seen.add(attribute)
+    registry.append((attribute,fileName,storedDtypes[(fileName,attribute)],
+                     sc.attributeScope(attribute),len(registry)))
+with open(os.path.join(storeFldr,"registry.csv"),'wb') as fileObj:
+    writer = csv.writer(fileObj)
+    writer.writerow(("Attribute","File","Dtype","CatWs","Position"))
+    writer.writerows(registry)
+print "...{} unique attributes".format(len(registry))
+
+#Build the attribute matrix, one column at a time, directly on disk
+print "Creating attribute matrix"
+matrix = np.lib.format.open_memmap(sc.matrixFile(storeFldr),mode='w+',dtype=np.float32,
+                                   shape=(len(keyDF),len(registry)))
+for attribute, fileName, dtype, catWs, position in registry:
+    matrix[:,position] = sc.loadColumn(storeFldr,fileName,attribute)
+matrix.flush()
+del matrix
+
+#Save the build manifest
+sc.writeManifest(manifestFN,manifest)
+print "Attribute store written to {}".format(storeFldr)
@@ -0,0 +1,716 @@
+#STREAMCAT_utils.py
+#
+# A set of functions used by the STREAMCAT scripts to fetch, merge, and
+#  track the StreamCat data files, and to read the StreamCat attribute store.
+
+import sys, os, csv, hashlib, sqlite3
+import numpy as np
+import pandas as pd
+
+def fileMD5(fileName,blockSize=2**20):
+    '''Returns the MD5 checksum (hex string) of a file, read in blocks'''
+    md5 = hashlib.md5()
+    with open(fileName,'rb') as fileObj:
+        block = fileObj.read(blockSize)
+        while block:
+            md5.update(block)
+            block = fileObj.read(blockSize)
+    return md5.hexdigest()
+
+def readManifest(manifestFN):
+    '''Returns a dictionary of manifest records (dicts) keyed by file name;
+       an empty dictionary is returned if the manifest does not exist'''
+    manifest = {}
+    if not os.path.exists(manifestFN):
+        return manifest
+    with open(manifestFN,'rb') as fileObj:
+        for rec in csv.DictReader(fileObj):
+            manifest[rec["File"]] = rec
+    return manifest
+
+def writeManifest(manifestFN,manifest):
+    '''Writes a dictionary of manifest records (see readManifest) to a CSV file'''
+    #Use the union of the record keys as columns, keeping File first
+    fldNames = ["File"]
+    for rec in manifest.values():
+        for fld in sorted(rec.keys()):
+            if not fld in fldNames: fldNames.append(fld)
+    #Write to a temporary file and then swap it in so a crash never leaves a partial manifest
+    tmpFN = manifestFN + ".tmp"
+    with open(tmpFN,'wb') as fileObj:
+        writer = csv.DictWriter(fileObj,fldNames)
+        writer.writerow(dict(zip(fldNames,fldNames)))
+        for fileName in sorted(manifest.keys()):
+            writer.writerow(manifest[fileName])
+    if os.path.exists(manifestFN): os.remove(manifestFN)
+    os.rename(tmpFN,manifestFN)
+    return manifestFN
+
+##--BUILD MANIFEST--
+# The build manifest (Data/StreamCat/BuildManifest.csv) records the Size, MTime and MD5
+#  of each regional input and each derived (AllRegions and Store) file, keyed by its path
+#  relative to the StreamCat folder. Derived files also record when they were Built and the
+#  Sources (path@MD5 list) they were built from, so a theme is rebuilt only when one of its
+#  inputs has changed. Checksums are only recomputed when a file's size or mtime changes.
+def buildManifestFile(streamCatFldr):
+    '''Returns the filename of the build manifest in the StreamCat folder'''
+    return os.path.join(streamCatFldr,"BuildManifest.csv")
+
+def relativeName(fileName,streamCatFldr):
+    '''Returns the manifest key of a file: its path relative to the StreamCat folder'''
+    return os.path.relpath(fileName,streamCatFldr).replace("\\","/")
+
+def currentMD5(fileName,streamCatFldr,manifest):
+    '''Returns the MD5 of a file, updating the file's manifest record. The recorded
+       checksum is reused if the file's size and mtime are unchanged.'''
+    relName = relativeName(fileName,streamCatFldr)
+    size = str(os.path.getsize(fileName))
+    mtime = str(int(os.path.getmtime(fileName)))
+    rec = manifest.get(relName)
+    if rec and rec.get("Size") == size and rec.get("MTime") == mtime and rec.get("MD5"):
+        return rec["MD5"]
+    if not rec:
+        rec = manifest[relName] = {"File":relName}
+    rec.update({"Size":size,"MTime":mtime,"MD5":fileMD5(fileName)})
+    return rec["MD5"]
+
+def sourceList(sourceFiles,streamCatFldr,manifest):
+    '''Returns the Sources string (path@MD5 items separated by ";") for a list of files'''
+    return ";".join(["{}@{}".format(relativeName(fn,streamCatFldr),currentMD5(fn,streamCatFldr,manifest))
+                     for fn in sourceFiles])
+
+def needsBuild(outFN,sourceFiles,streamCatFldr,manifest):
+    '''Returns True if the derived file is missing, has no manifest record, or was built
+       from sources that have since changed'''
+    rec = manifest.get(relativeName(outFN,streamCatFldr))
+    if not os.path.exists(outFN) or not rec:
+        return True
+    return rec.get("Sources") <> sourceList(sourceFiles,streamCatFldr,manifest)
+
+def recordBuild(outFN,sourceFiles,streamCatFldr,manifest,builtTime):
+    '''Records a derived file (or folder) and the sources it was built from in the manifest'''
+    relName = relativeName(outFN,streamCatFldr)
+    manifest.pop(relName,None)
+    if os.path.isfile(outFN):
+        currentMD5(outFN,streamCatFldr,manifest)
+    else:
+        manifest[relName] = {"File":relName}
+    manifest[relName].update({"Built":str(int(builtTime)),
+                              "Sources":sourceList(sourceFiles,streamCatFldr,manifest)})
+
+def staleSpeciesFiles(speciesFldr,streamCatFldr,manifest):
+    '''Returns a list of (species file, reason) tuples for the species data (SWD) files and
+       Maxent model folders in the species folder built before the AllRegions files
+       supplying their attributes were last rebuilt'''
+    #Map each attribute to the AllRegions file it comes from, and get each file's build time
+    # (attributes in more than one file, e.g. CatAreaSqKm, are skipped)
+    attributeFiles = {}
+    builtTimes = {}
+    allRegionsFldr = os.path.join(streamCatFldr,"AllRegions")
+    for relName, rec in manifest.items():
+        if not (relName.startswith("AllRegions/") and rec.get("Built")): continue
+        fileName = os.path.join(allRegionsFldr,relName.split("/")[-1])
+        if not os.path.exists(fileName): continue
+        builtTimes[relName] = int(rec["Built"])
+        with open(fileName,'rt') as fileObj:
+            for attribute in fileObj.readline().strip().split(","):
+                if attribute in keyCols: continue
+                attributeFiles.setdefault(attribute,[]).append(relName)
+    stale = []
+    if not os.path.exists(speciesFldr):
+        return stale
+    for f in sorted(os.listdir(speciesFldr)):
+        fileName = os.path.join(speciesFldr,f)
+        if f[-4:].lower() <> ".csv" or not os.path.isfile(fileName): continue
+        swdTime = os.path.getmtime(fileName)
+        with open(fileName,'rt') as fileObj:
+            header = fileObj.readline().strip().split(",")
+        newer = set()
+        for attribute in header:
+            sources = attributeFiles.get(attribute,[])
+            if len(sources) == 1 and builtTimes[sources[0]] > swdTime:
+                newer.add(sources[0].split("/")[-1])
+        if newer:
+            stale.append((f,"uses attributes from rebuilt {}".format(", ".join(sorted(newer)))))
+        #The Maxent model folder is named for the species (see AQUATIC_CreateMaxentBatchFile.py)
+        modelFldr = fileName[:-8] if f.endswith("_swd.csv") else fileName[:-4]
+        if os.path.isdir(modelFldr):
+            modelFiles = [os.path.join(modelFldr,m) for m in os.listdir(modelFldr)]
+            modelTime = max([os.path.getmtime(m) for m in modelFiles] or [0])
+            if newer:
+                stale.append((os.path.basename(modelFldr),"model built from stale {}".format(f)))
+            elif modelTime < swdTime:
+                stale.append((os.path.basename(modelFldr),"model older than {}".format(f)))
+    return stale
+
+##--DTYPE SCHEMA--
+# Column types used for catchment records across the pipeline, applied when the data are
+#  read (readCSV, readStore, readMatrix) rather than cast afterwards: catchment keys as
+#  int32, HUC_12 as an (ordered) categorical, REACHCODE as a string (it is nearly unique to
+#  each catchment, so a categorical saves nothing), and attributes as float32. Integer
+#  (count) attributes are given the smallest int type holding their range (schemaDtype),
+#  both in the attribute store and when read from the CSV files (readCSV).
+keyDtypes = {"OID":np.int32,"GRIDCODE":np.int32,"FEATUREID":np.int32,"COMID":np.int32,
+             "REACHCODE":np.str,"HUC_12":"category"}
+#The key columns as saved in the attribute store (keys/<col>.npy): the text keys as fixed
+# width byte strings (a REACHCODE is 14 digits, a HUC_12 12)
+storeKeyDtypes = dict(keyDtypes,REACHCODE='S14',HUC_12='S12')
+attributeDtype = np.float32
+
+def intDtype(minValue,maxValue):
+    '''Returns the smallest integer type holding the range of values (and -9999)'''
+    for dtype in (np.int16,np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= min(minValue,-9999) and max(maxValue,0) <= info.max:
+            return dtype
+    return np.int64
+
+def schemaDtype(values):
+    '''Returns the type of an attribute column: the smallest int type holding its range, for
+       integer columns, otherwise attributeDtype'''
+    values = np.asarray(values)
+    if values.dtype.kind in ('i','u','b'):
+        if len(values) == 0:
+            return intDtype(0,0)
+        return intDtype(values.min(),values.max())
+    return attributeDtype
+
+def toCategorical(arr):
+    '''Returns an ordered categorical of the values in an array'''
+    categories, codes = np.unique(np.asarray(arr),return_inverse=True)
+    return pd.Categorical.from_codes(codes,categories.astype(object),ordered=True)
+
+def csvDtypes(csvFile):
+    '''Returns the read_csv dtypes of the key columns in a StreamCat (or species) CSV file
+       (the types of the attribute columns are set from their values; see readCSV)'''
+    with open(csvFile,'rt') as fileObj:
+        columns = fileObj.readline().strip().split(",")
+    return dict([(col,keyDtypes[col]) for col in columns if col in keyDtypes])
+
+def readCSV(csvFile,chunkRows=100000,**kwargs):
+    '''Reads a StreamCat CSV file into a dataframe using the pipeline column types. The file
+       is read in chunks of rows, each attribute column cast to int32 (integer columns) or
+       attributeDtype as it is read; integer columns are then given their schema type.'''
+    dtypes = csvDtypes(csvFile)
+    if "usecols" in kwargs:
+        dtypes = dict([(col,dtypes[col]) for col in kwargs["usecols"] if col in dtypes])
+    #Categorical columns are read as text and made categorical once all chunks are read
+    categories = [col for col, dtype in dtypes.items() if dtype == "category"]
+    readTypes = dict([(col,np.str if col in categories else dtype) for col, dtype in dtypes.items()])
+    chunks = []
+    for chunk in pd.read_csv(csvFile,dtype=readTypes,chunksize=chunkRows,**kwargs):
+        for col in chunk.columns:
+            if col in dtypes: continue
+            if chunk[col].dtype.kind in ('i','u','b'):
+                chunk[col] = chunk[col].values.astype(np.promote_types(schemaDtype(chunk[col]),np.int32))
+            else:
+                chunk[col] = chunk[col].values.astype(attributeDtype)
+        chunks.append(chunk)
+    dataDF = pd.concat(chunks,ignore_index=True) if len(chunks) > 1 else chunks[0]
+    for col in dataDF.columns:
+        if col in categories:
+            dataDF[col] = toCategorical(dataDF[col].values)
+        elif not col in dtypes:
+            dataDF[col] = dataDF[col].values.astype(schemaDtype(dataDF[col]))
+    return dataDF
+
+def memoryUsage():
+    '''Returns the (current, peak) memory use of this process in MB; None where unavailable'''
+    try:
+        import psutil
+        memInfo = psutil.Process(os.getpid()).memory_info()
+        peak = getattr(memInfo,"peak_wset",None) #Windows only
+        return memInfo.rss / 2.0**20, (peak or memInfo.rss) / 2.0**20
+    except ImportError:
+        pass
+    try:
+        import resource
+        #ru_maxrss is in KB on Linux
+        return None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2.0**10
+    except ImportError:
+        return None, None
+
+def memoryReport(stage,dataDF=None):
+    '''Returns a line reporting the size of a dataframe and the process' memory use'''
+    items = ["Memory [{}]:".format(stage)]
+    if dataDF is not None:
+        items.append("frame {:.1f} MB".format(dataDF.memory_usage(deep=True).sum() / 2.0**20))
+    current, peak = memoryUsage()
+    if current is not None: items.append("process {:.1f} MB".format(current))
+    if peak is not None: items.append("peak {:.1f} MB".format(peak))
+    return " ".join(items)
+
+##--HUC12 LOOKUP--
+# The HUC12 lookup (GRIDCODE, FEATUREID, REACHCODE and HUC_12 of each NHD catchment) ships
+#  as a 7-zip archive. huc12Lookup converts it, once, into a folder of numpy arrays
+#  (Data/ToolData/HUC12Lookup): the FEATUREIDs sorted, with the GRIDCODE, REACHCODE (S14)
+#  and HUC_12 code (an index into a sorted table of the HUC_12 values) of each, plus the
+#  order of the GRIDCODEs. The arrays are memory mapped, and FEATUREIDs or GRIDCODEs are
+#  resolved with a binary search (lookupRows) rather than by parsing text. The lookup is
+#  rebuilt if its source file changes.
+lookupCols = ("GRIDCODE","FEATUREID","REACHCODE","HUC_12")
+
+def huc12LookupFolder(rootFldr):
+    '''Returns the folder holding the binary HUC12 lookup'''
+    return os.path.join(rootFldr,"Data","ToolData","HUC12Lookup")
+
+def huc12LookupSource(rootFldr):
+    '''Returns the HUC12 lookup source file: an extracted HUC12Lookup.csv, if present,
+       otherwise the HUC12Lookup.7z archive'''
+    for fldr in (("Data","Tooldata"),("Data","ToolData"),("Data",)):
+        for ext in (".csv",".7z"):
+            sourceFN = os.path.join(rootFldr,*(fldr + ("HUC12Lookup" + ext,)))
+            if os.path.exists(sourceFN):
+                return sourceFN
+    raise IOError("No HUC12Lookup.csv or HUC12Lookup.7z file found in {}".format(os.path.join(rootFldr,"Data")))
+
+def readLookupSource(sourceFN,sevenZip="7z"):
+    '''Returns a dataframe of the HUC12 lookup CSV; 7-zip archives are decompressed
+       through the 7z executable to a pipe, without unpacking to disk'''
+    dtypes = {"GRIDCODE":np.int32,"FEATUREID":np.int32,"REACHCODE":np.str,"HUC_12":np.str}
+    if sourceFN[-3:].lower() <> ".7z":
+        return pd.read_csv(sourceFN,usecols=lookupCols,dtype=dtypes)
+    import subprocess
+    try:
+        proc = subprocess.Popen([sevenZip,"e","-so",sourceFN],stdout=subprocess.PIPE)
+    except OSError:
+        raise IOError("Could not run {} to read {}; install 7-zip or extract HUC12Lookup.csv".format(sevenZip,sourceFN))
+    lookupDF = pd.read_csv(proc.stdout,usecols=lookupCols,dtype=dtypes)
+    if proc.wait() <> 0:
+        raise IOError("{} failed to extract {}".format(sevenZip,sourceFN))
+    return lookupDF
+
+def buildHUC12Lookup(sourceFN,lookupFldr,sevenZip="7z"):
+    '''Converts the HUC12 lookup CSV (or 7z archive) into the binary lookup arrays'''
+    lookupDF = readLookupSource(sourceFN,sevenZip)
+    #Sort on FEATUREID, keeping the first record of any duplicated catchment
+    lookupDF = lookupDF.drop_duplicates("FEATUREID").sort_values("FEATUREID")
+    hucTable, hucCodes = np.unique(lookupDF["HUC_12"].fillna("").values.astype('S12'),return_inverse=True)
+    if not os.path.exists(lookupFldr): os.makedirs(lookupFldr)
+    np.save(os.path.join(lookupFldr,"FEATUREID.npy"),lookupDF["FEATUREID"].values.astype(np.int32))
+    np.save(os.path.join(lookupFldr,"GRIDCODE.npy"),lookupDF["GRIDCODE"].values.astype(np.int32))
+    np.save(os.path.join(lookupFldr,"REACHCODE.npy"),lookupDF["REACHCODE"].fillna("").values.astype('S14'))
+    np.save(os.path.join(lookupFldr,"HUCCODE.npy"),hucCodes.astype(np.int32))
+    np.save(os.path.join(lookupFldr,"hucTable.npy"),hucTable)
+    gridcodes = lookupDF["GRIDCODE"].values
+    np.save(os.path.join(lookupFldr,"gridOrder.npy"),np.argsort(gridcodes,kind="mergesort").astype(np.int32))
+    #Record the source, so the lookup is rebuilt when it changes
+    writeManifest(os.path.join(lookupFldr,"manifest.csv"),
+                  {"Source":{"File":"Source","Name":os.path.basename(sourceFN),
+                             "Size":str(os.path.getsize(sourceFN)),
+                             "MTime":str(int(os.path.getmtime(sourceFN)))}})
+    return len(lookupDF)
+
+def huc12Lookup(rootFldr,sevenZip="7z"):
+    '''Returns the binary HUC12 lookup as a dictionary of memory mapped arrays, building
+       it first if it does not exist or its source has changed'''
+    lookupFldr = huc12LookupFolder(rootFldr)
+    sourceFN = huc12LookupSource(rootFldr)
+    source = readManifest(os.path.join(lookupFldr,"manifest.csv")).get("Source")
+    if not (source and source["Name"] == os.path.basename(sourceFN) and
+            source["Size"] == str(os.path.getsize(sourceFN)) and
+            source["MTime"] == str(int(os.path.getmtime(sourceFN)))):
+        print "Building binary HUC12 lookup from {}".format(sourceFN)
+        buildHUC12Lookup(sourceFN,lookupFldr,sevenZip)
+    return loadHUC12Lookup(lookupFldr)
+
+def loadHUC12Lookup(lookupFldr):
+    '''Returns the (already built) binary HUC12 lookup as a dictionary of memory mapped arrays'''
+    lookup = {}
+    for name in ("FEATUREID","GRIDCODE","REACHCODE","HUCCODE","hucTable","gridOrder"):
+        lookup[name] = np.load(os.path.join(lookupFldr,name + ".npy"),mmap_mode='r')
+    return lookup
+
+def lookupRows(lookup,values,key="FEATUREID"):
+    '''Returns the lookup row of each FEATUREID (or GRIDCODE, if key is "GRIDCODE") in the
+       list, or -1 for values not in the lookup'''
+    values = np.asarray(values)
+    if key == "FEATUREID":
+        keys = lookup["FEATUREID"]
+        order = None
+    else:
+        order = lookup["gridOrder"]
+        keys = np.asarray(lookup["GRIDCODE"])[order]
+    pos = np.searchsorted(keys,values)
+    pos[pos == len(keys)] = 0
+    found = len(keys) > 0 and keys[pos] == values
+    rows = pos if order is None else np.asarray(order)[pos]
+    return np.where(found,rows,-1)
+
+def lookupValues(lookup,rows,column):
+    '''Returns the GRIDCODE, FEATUREID, REACHCODE or HUC_12 values of the lookup rows;
+       rows of -1 (not found) get 0 or an empty string'''
+    rows = np.asarray(rows)
+    found = rows >= 0
+    if column == "HUC_12":
+        arr = lookup["hucTable"][lookup["HUCCODE"][np.where(found,rows,0)]]
+    else:
+        arr = lookup[column][np.where(found,rows,0)]
+    arr = np.array(arr)
+    arr[~found] = 0 if arr.dtype.kind <> 'S' else ""
+    return arr
+
+def lookupFrame(lookup,rows=None):
+    '''Returns a dataframe of the GRIDCODE, FEATUREID, REACHCODE and HUC_12 of the lookup
+       rows (default all), using the pipeline column types'''
+    if rows is None:
+        rows = np.arange(len(lookup["FEATUREID"]))
+    data = {}
+    for col in lookupCols:
+        arr = lookupValues(lookup,rows,col)
+        if keyDtypes[col] == "category":
+            arr = toCategorical(arr)
+        elif arr.dtype.kind == 'S':
+            arr = arr.astype(object)
+        data[col] = arr
+    return pd.DataFrame(data,columns=lookupCols)
+
+def inHUCs(lookup,featureIDs,hucList):
+    '''Returns a boolean array flagging the FEATUREIDs whose HUC_12 falls within any of the
+       HUCs (of any level) in the list'''
+    hucTable = np.asarray(lookup["hucTable"])
+    #Flag the HUC_12 codes within the HUCs (a test on the short code table only)
+    inTable = np.zeros(len(hucTable),dtype=np.bool)
+    for huc in set([str(h) for h in hucList]):
+        inTable |= np.char.startswith(hucTable,huc)
+    rows = lookupRows(lookup,featureIDs)
+    return (rows >= 0) & inTable[np.asarray(lookup["HUCCODE"])[np.where(rows >= 0,rows,0)]]
+
+##--ATTRIBUTE CATALOG--
+# The catalog (StreamCatCatalog.db) is a SQLite database created by
+#  STREAMCAT3_GenerateAttributeList.py. Its "attributes" table lists each attribute's file,
+#  dtype, Count, NullCount, Min, Max and Mean; its "huc8stats" table lists the Count,
+#  NullCount, Min and Max of each attribute within each HUC8.
+def catalogFile(streamCatFldr):
+    '''Returns the filename of the attribute catalog in the StreamCat folder'''
+    return os.path.join(streamCatFldr,"StreamCatCatalog.db")
+
+def huc8Stats(catalogFN,huc8List):
+    '''Returns a dataframe of the Count and NullCount of each attribute summed over the
+       HUC8s in the list, indexed on attribute name'''
+    conn = sqlite3.connect(catalogFN)
+    #Load the HUC8s into a temporary table to join on (avoids SQL variable limits)
+    conn.execute("CREATE TEMP TABLE selhucs (HUC8 TEXT PRIMARY KEY)")
+    conn.executemany("INSERT OR IGNORE INTO selhucs VALUES (?)",[(str(h),) for h in huc8List])
+    #Use each attribute's first file (duplicated attributes hold the same values)
+    sql = '''SELECT s.Attribute, SUM(s.Count) AS Count, SUM(s.NullCount) AS NullCount
+             FROM huc8stats s JOIN selhucs h ON s.HUC8 = h.HUC8
+             WHERE s.File = (SELECT MIN(a.File) FROM attributes a WHERE a.Attribute = s.Attribute)
+             GROUP BY s.Attribute'''
+    statsDF = pd.read_sql_query(sql,conn,index_col="Attribute")
+    conn.close()
+    return statsDF
+
+def nullAttributes(catalogFN,huc8List,allNull=False):
+    '''Returns the attributes with missing (-9999) values in any of the HUC8s in the list,
+       or, if allNull is True, only those with no valid values at all in these HUC8s'''
+    statsDF = huc8Stats(catalogFN,huc8List)
+    if allNull:
+        return [str(a) for a in statsDF.index[statsDF["Count"] == 0]]
+    return [str(a) for a in statsDF.index[statsDF["NullCount"] > 0]]
+
+##--ATTRIBUTE STORE--
+# The attribute store is a folder of numpy (.npy) files built from the AllRegions CSV
+#  files by STREAMCAT4_CreateAttributeStore.py. Each StreamCat file gets a subfolder
+#  holding one array per column; the catchment key columns shared by all files are
+#  stored once, in the "keys" subfolder. Row i of every array refers to the same
+#  catchment. Arrays are memory mapped when read, so only the rows and columns
+#  requested are pulled from disk.
+#
+# Rows are sorted on HUC_12 (then REACHCODE), so the catchments of any HUC form a
+#  contiguous block of rows. keys/hucIndex.npz lists, for each HUC2, 4, 6, 8, 10 and 12
+#  code, the first and last+1 row of its block; a HUC selection is then a set of slices.
+#
+# The store also holds a single, deduplicated catchment x attribute matrix (matrix.npy,
+#  float32, one row per catchment) and a registry (registry.csv) listing each attribute's
+#  source file, stored dtype, CAT/WS scope and column position in the matrix. Use
+#  readMatrix to pull attributes by name without concatenating the individual files.
+keyCols = ("OID","GRIDCODE","FEATUREID","REACHCODE","HUC_12")
+hucLevels = (2,4,6,8,10,12)
+
+def storeFolder(allRegionsFldr):
+    '''Returns the attribute store folder for an AllRegions folder (its sibling "Store" folder)'''
+    return os.path.join(os.path.dirname(os.path.abspath(allRegionsFldr)),"Store")
+
+def storeSchema(storeFldr):
+    '''Returns the store's schema: a list of (File, Column, Dtype) tuples in file/column order'''
+    schema = []
+    with open(os.path.join(storeFldr,"schema.csv"),'rb') as fileObj:
+        for rec in csv.DictReader(fileObj):
+            schema.append((rec["File"],rec["Column"],rec["Dtype"]))
+    return schema
+
+def storeFiles(storeFldr):
+    '''Returns the list of StreamCat file names held in the store'''
+    files = []
+    for fileName, column, dtype in storeSchema(storeFldr):
+        if not fileName in files: files.append(fileName)
+    return files
+
+def storeColumns(storeFldr,fileName):
+    '''Returns the columns of a StreamCat file, as ordered in the original CSV'''
+    return [col for f, col, dtype in storeSchema(storeFldr) if f == fileName]
+
+def keyFingerprint(keyDF):
+    '''Returns the (KeyRows, KeyMD5) fingerprint of a StreamCat file's key columns: the number
+       of rows and an MD5 of the key rows, sorted on FEATUREID, in their store types. It is
+       recorded in the build manifest when a file is converted to the store.'''
+    keys = [keyDF[col].values.astype(storeKeyDtypes[col]) for col in keyCols]
+    #Sort on FEATUREID (the last lexsort key), ties on the other key columns
+    order = np.lexsort(keys + [keys[keyCols.index("FEATUREID")]])
+    md5 = hashlib.md5()
+    for arr in keys:
+        md5.update(np.ascontiguousarray(arr[order]).tobytes())
+    return str(len(keyDF)), md5.hexdigest()
+
+def loadColumn(storeFldr,fileName,column):
+    '''Returns the memory mapped array of a column'''
+    if column in keyCols:
+        arrFN = os.path.join(storeFldr,"keys",column + ".npy")
+    else:
+        arrFN = os.path.join(storeFldr,fileName[:-4],column + ".npy")
+    return np.load(arrFN,mmap_mode='r')
+
+def readAttributeList(streamCatInfoCSV):
+    '''Returns a list of (File, Attribute) tuples from the StreamCatInfo.csv file
+       created by STREAMCAT3_GenerateAttributeList.py'''
+    attributes = []
+    with open(streamCatInfoCSV,'rt') as fileObj:
+        fileObj.readline() #Skip the header
+        for line in fileObj:
+            items = [item.strip() for item in line.split(",")]
+            if len(items) >= 2 and items[1]:
+                attributes.append((items[0],items[1]))
+    return attributes
+
+def attributeScope(attribute):
+    '''Returns whether a StreamCat attribute describes the catchment ("CAT") or its
+       upstream watershed ("WS"), from the attribute's name'''
+    name = attribute[:-5] if attribute.endswith("Rp100") else attribute
+    if name.endswith("Cat") or name.startswith("Cat"):
+        return "CAT"
+    if name.endswith("Ws") or name.startswith("Ws"):
+        return "WS"
+    return ""
+
+def attributeRegistry(storeFldr):
+    '''Returns the attribute registry as a dataframe (Attribute, File, Dtype, CatWs, Position),
+       indexed on attribute name'''
+    regDF = pd.read_csv(os.path.join(storeFldr,"registry.csv"))
+    return regDF.set_index("Attribute",drop=False)
+
+def matrixFile(storeFldr):
+    '''Returns the filename of the store's attribute matrix'''
+    return os.path.join(storeFldr,"matrix.npy")
+
+def buildHUCIndex(hucs):
+    '''Returns a dictionary of HUC prefix index arrays (hucN, startN, stopN for each
+       level) from a sorted array of HUC12 codes'''
+    index = {}
+    for level in hucLevels:
+        prefixes = hucs.astype('S{}'.format(level))
+        #Sorted, so the first occurrence of each prefix starts its block of rows
+        codes, starts = np.unique(prefixes,return_index=True)
+        stops = np.append(starts[1:],len(hucs))
+        index["huc{}".format(level)] = codes
+        index["start{}".format(level)] = starts
+        index["stop{}".format(level)] = stops
+    return index
+
+def hucRanges(storeFldr,hucList):
+    '''Returns a list of (start, stop) row ranges holding the catchments within the HUCs in
+       the list. HUCs may be of any level (2 to 12 digits) and may be mixed.'''
+    indexFN = os.path.join(storeFldr,"keys","hucIndex.npz")
+    index = np.load(indexFN)
+    ranges = []
+    for level in hucLevels:
+        hucs = [str(h) for h in hucList if len(str(h)) == level]
+        if not hucs: continue
+        codes = index["huc{}".format(level)]
+        hucs = np.array(hucs,dtype=codes.dtype)
+        #Locate each HUC in the sorted code list; keep only those present
+        pos = np.searchsorted(codes,hucs).clip(0,len(codes)-1)
+        pos = pos[codes[pos] == hucs]
+        ranges.extend(zip(index["start{}".format(level)][pos],index["stop{}".format(level)][pos]))
+    return sorted(set(ranges))
+
+def hucRows(storeFldr,hucList):
+    '''Returns the store row numbers of catchments within the HUCs (of any level) in the list'''
+    if not os.path.exists(os.path.join(storeFldr,"keys","hucIndex.npz")):
+        #Store built without an index; scan the HUC12 codes
+        hucs = loadColumn(storeFldr,None,"HUC_12")
+        mask = np.zeros(len(hucs),dtype=np.bool)
+        for level in hucLevels:
+            codes = np.array([str(h) for h in hucList if len(str(h)) == level],dtype='S{}'.format(level))
+            if len(codes): mask |= np.in1d(hucs.astype(codes.dtype),codes)
+        return np.nonzero(mask)[0]
+    ranges = hucRanges(storeFldr,hucList)
+    if not ranges:
+        return np.array([],dtype=np.int64)
+    return np.unique(np.concatenate([np.arange(start,stop) for start, stop in ranges]))
+
+def huc8Rows(storeFldr,huc8List):
+    '''Returns the store row numbers of catchments within the HUC8s in the list'''
+    return hucRows(storeFldr,huc8List)
+
+def readRows(arr,rows):
+    '''Returns the given rows of an array, reading each run of consecutive rows as a slice'''
+    if len(rows) == 0:
+        return arr[:0]
+    breaks = np.nonzero(np.diff(rows) <> 1)[0] + 1
+    starts = np.append(rows[0],rows[breaks])
+    stops = np.append(rows[breaks-1],rows[-1]) + 1
+    if len(starts) == 1:
+        return np.array(arr[starts[0]:stops[0]])
+    return np.concatenate([arr[start:stop] for start, stop in zip(starts,stops)])
+
+def gridcodeRows(storeFldr,gridcodes):
+    '''Returns the store row numbers of the catchments with the GRIDCODEs in the list'''
+    codes = loadColumn(storeFldr,None,"GRIDCODE")
+    return np.nonzero(np.in1d(codes,np.array(gridcodes,dtype=codes.dtype)))[0]
+
+def readStore(storeFldr,fileName,columns=None,rows=None,dtypes=None):
+    '''Returns a dataframe of a stored StreamCat file, limited to the columns (default all)
+       and rows (row numbers or boolean mask; default all) given. The dataframe is indexed
+       on store row number, so frames read from different files can be concatenated on
+       axis 1. Columns in dtypes are converted to the type given (as in pandas.read_csv).'''
+    if columns is None:
+        columns = storeColumns(storeFldr,fileName)
+    if dtypes is None:
+        dtypes = {}
+    #Get the row numbers
+    nRows = len(loadColumn(storeFldr,fileName,"OID"))
+    if rows is None:
+        rows = np.arange(nRows)
+    else:
+        rows = np.asarray(rows)
+        if rows.dtype == np.bool:
+            rows = np.nonzero(rows)[0]
+    #Read the selected rows of each column
+    data = {}
+    for col in columns:
+        arr = readRows(loadColumn(storeFldr,fileName,col),rows)
+        if dtypes.get(col) == "category":
+            arr = toCategorical(arr)
+        else:
+            if arr.dtype.kind == 'S':
+                arr = arr.astype(object)
+            if col in dtypes:
+                arr = arr.astype(dtypes[col])
+        data[col] = arr
+    return pd.DataFrame(data,index=rows,columns=columns)
+
+def validAttributes(storeFldr,catalogFN,huc8List):
+    '''Returns the matrix attributes, in registry order, having at least one valid value in
+       the HUC8s in the list. All attributes are returned if the catalog does not exist.'''
+    attributes = list(attributeRegistry(storeFldr)["Attribute"])
+    if not os.path.exists(catalogFN):
+        return attributes
+    emptyAttributes = set(nullAttributes(catalogFN,huc8List,allNull=True))
+    return [a for a in attributes if not a in emptyAttributes]
+
+def readMatrix(storeFldr,attributes=None,rows=None,dtypes=None):
+    '''Returns a dataframe of the catchment keys and the named attributes (default all)
+       for the given rows (row numbers or boolean mask; default all) of the attribute
+       matrix. Like readStore, the dataframe is indexed on store row number.'''
+    registry = attributeRegistry(storeFldr)
+    if attributes is None:
+        attributes = list(registry["Attribute"])
+    if dtypes is None:
+        dtypes = {}
+    matrix = np.load(matrixFile(storeFldr),mmap_mode='r')
+    if rows is None:
+        rows = np.arange(matrix.shape[0])
+    else:
+        rows = np.asarray(rows)
+        if rows.dtype == np.bool:
+            rows = np.nonzero(rows)[0]
+    #Catchment keys
+    outDF = readStore(storeFldr,None,columns=keyCols,rows=rows,dtypes=dtypes)
+    #Read the selected rows (whole rows are contiguous) and then pick the attribute columns
+    positions = registry.loc[attributes,"Position"].values
+    values = readRows(matrix,rows)[:,positions]
+    for i, attribute in enumerate(attributes):
+        outDF[attribute] = values[:,i].astype(dtypes.get(attribute,registry.loc[attribute,"Dtype"]))
+    return outDF
+
+##--HUC8 EXTRACTION--
+# The species scripts read the catchment records within a set of HUC8s from the attribute
+#  matrix, if built (just the attributes with data in those HUC8s), or else from each file of
+#  the attribute store or, with no store, from each CSV file in the StreamCat folder, joining
+#  the files side by side with each attribute taken from the first file holding it.
+def extractFiles(storeFldr,csvFldr):
+    '''Returns the StreamCat files extractHUC8s reads: the files in the attribute store, if
+       built, or else the CSV files in the folder (in directory order)'''
+    if os.path.exists(storeFldr):
+        return storeFiles(storeFldr)
+    return [f for f in os.listdir(csvFldr)
+            if f[-4:] == ".csv" and not f in ("StreamCatInfo.csv","BuildManifest.csv")]
+
+def spatialSelect(storeFldr,dataFN,huc8List):
+    '''Returns a dataframe of the catchment attributes of a StreamCat file for the HUC8s
+       in the list'''
+    #Read just the HUC8 rows from the attribute store, if it has been created
+    if os.path.exists(storeFldr):
+        rows = huc8Rows(storeFldr,huc8List)
+        return readStore(storeFldr,os.path.basename(dataFN),rows=rows,dtypes=keyDtypes)
+    dataDF = readCSV(dataFN)
+    #Filter the catchment attributes for the HUC8s
+    return dataDF[dataDF["HUC_12"].str[:8].isin(huc8List)]
+
+def matrixSelect(storeFldr,catalogFN,huc8List):
+    '''Returns a dataframe of all catchment attributes for the HUC8s in the list, read
+       from the attribute matrix'''
+    rows = huc8Rows(storeFldr,huc8List)
+    #Skip attributes the catalog lists as having no data in these HUC8s
+    attributes = validAttributes(storeFldr,catalogFN,huc8List)
+    return readMatrix(storeFldr,attributes=attributes,rows=rows,dtypes=keyDtypes)
+
+def extractHUC8s(storeFldr,csvFldr,catalogFN,huc8List,report=None):
+    '''Returns a dataframe of all catchment attributes for the HUC8s in the list, read from
+       the attribute matrix, if built, or else from each StreamCat file. report, if given,
+       is called with a message for each step.'''
+    if report is None:
+        report = lambda txt: None
+    #Read all attributes for the HUC8 records at once from the attribute matrix, if built
+    if os.path.exists(matrixFile(storeFldr)):
+        report("Extracting records from the attribute matrix")
+        return matrixSelect(storeFldr,catalogFN,huc8List)
+    #Loop through the StreamCat files & create dataframes of just the HUC8 records in each
+    dataFrames = []
+    colNames = []
+    for f in extractFiles(storeFldr,csvFldr):
+        report("Extracting records from {}".format(f))
+        dataDF = spatialSelect(storeFldr,os.path.join(csvFldr,f),huc8List)
+        #Skip the columns (e.g. the catchment keys) read from an earlier file
+        newCols = [col for col in dataDF.columns if not col in colNames]
+        colNames.extend(newCols)
+        dataFrames.append(dataDF[newCols])
+    #Merge all file data frames into one
+    report("Merging data frames")
+    return pd.concat(dataFrames,axis=1)
+
+def huc8Attributes(storeFldr,catalogFN,huc8List):
+    '''Returns the attributes extractHUC8s reads for the HUC8s in the list, in its column
+       order, from the attribute store'''
+    if os.path.exists(matrixFile(storeFldr)):
+        return validAttributes(storeFldr,catalogFN,huc8List)
+    attributes = []
+    for f in storeFiles(storeFldr):
+        attributes.extend([col for col in storeColumns(storeFldr,f) if not (col in keyCols or col in attributes)])
+    return attributes
+
+def readRecords(storeFldr,rows,attributes):
+    '''Returns a dataframe of the catchment keys and the listed attributes of the given rows
+       of the attribute store'''
+    if os.path.exists(matrixFile(storeFldr)):
+        return readMatrix(storeFldr,attributes=attributes,rows=rows,dtypes=keyDtypes)
+    #Read each attribute from the first file holding it
+    dataFrames = [readStore(storeFldr,None,columns=keyCols,rows=rows,dtypes=keyDtypes)]
+    toRead = set(attributes)
+    for f in storeFiles(storeFldr):
+        cols = [col for col in storeColumns(storeFldr,f) if col in toRead]
+        toRead.difference_update(cols)
+        if cols:
+            dataFrames.append(readStore(storeFldr,f,columns=cols,rows=rows,dtypes=keyDtypes))
+    return pd.concat(dataFrames,axis=1)
@@ -0,0 +1,84 @@
+#SWD_WriterBenchmark.py
+#
+#Compares writing a Maxent SWD file with pandas' to_csv and with the SWD writer in
+# SPECIES_utils.py (writeSWD): the time to write and read back the file, its size, and
+# the largest relative error of the values read back. The written files are checked
+# against Maxent's SWD format (Species,X,Y header, no empty fields, numeric attributes)
+# and, if java is available, loaded by Maxent (maxent.jar in the DataPrep folder).
+#
+#Usage: SWD_WriterBenchmark.py [records] [attributes] [number of processes]
+
+import sys, os, time, subprocess, tempfile, shutil
+import numpy as np
+import pandas as pd
+import SPECIES_utils as su
+
+#Benchmark size
+nRows = 200000
+if len(sys.argv) > 1 and sys.argv[1] not in ("","#"): nRows = int(sys.argv[1])
+nAttributes = 100
+if len(sys.argv) > 2 and sys.argv[2] not in ("","#"): nAttributes = int(sys.argv[2])
+nProcesses = 4
+if len(sys.argv) > 3 and sys.argv[3] not in ("","#"): nProcesses = int(sys.argv[3])
+maxentJar = os.path.join(os.path.dirname(su.__file__),"maxent.jar")
+
+#Make a SWD dataframe like those of AQUATIC_CreateAllSpeciesSWDFiles.py: species, GRIDCODE
+# (X), REACHCODE (Y, text with leading zeros) and float64 attributes of differing scales
+np.random.seed(2016)
+sppDF = pd.DataFrame({"Species":np.where(np.random.rand(nRows) < 0.05,"Nocomis_leptocephalus","Background"),
+                      "X":np.random.randint(1,10**7,nRows),
+                      "Y":["{:014d}".format(r) for r in np.random.randint(3010000000000,3100000000000,nRows)]},
+                     columns=["Species","X","Y"])
+scales = 10.0 ** np.random.randint(-2,6,nAttributes)
+for i in range(nAttributes):
+    sppDF["Attribute{}".format(i)] = np.random.rand(nRows) * scales[i]
+print "Benchmark dataframe: {} records, {} columns".format(nRows,sppDF.shape[1])
+
+def checkSWD(outFN):
+    '''Returns a list of the ways a file departs from Maxent's SWD format'''
+    problems = []
+    with open(outFN,'rt') as fileObj:
+        header = fileObj.readline().strip().split(",")
+        if header[:3] <> ["Species","X","Y"]:
+            problems.append("header does not begin with Species,X,Y")
+        for line in fileObj:
+            items = line.strip().split(",")
+            if len(items) <> len(header) or "" in items:
+                problems.append("empty or missing fields")
+                break
+    swdDF = pd.read_csv(outFN,dtype={"Y":str})
+    if not all([dtype.kind in 'if' for dtype in swdDF.dtypes[3:]]):
+        problems.append("non numeric attributes")
+    return problems
+
+def runMaxent(outFN,outFldr):
+    '''Runs Maxent on a SWD file (as samples and background); returns its exit code'''
+    cmd = ["java","-mx1024m","-jar",maxentJar,"samplesfile="+outFN,"environmentallayers="+outFN,
+           "outputdirectory="+outFldr,"autorun","nowarnings","novisible","noaskoverwrite"]
+    return subprocess.call(cmd)
+
+#Write and read back the file with each writer
+tmpFldr = tempfile.mkdtemp()
+writers = [("to_csv",lambda fn: sppDF.to_csv(fn,index=False)),
+           ("writeSWD",lambda fn: su.writeSWD(fn,sppDF)),
+           ("writeSWD ({} processes)".format(nProcesses),lambda fn: su.writeSWD(fn,sppDF,nProcesses=nProcesses))]
+attributes = sppDF.values[:,3:].astype(np.float64)
+haveJava = os.system("java -version > {} 2>&1".format(os.devnull)) == 0
+for name, writer in writers:
+    outFN = os.path.join(tmpFldr,"swd.csv")
+    start = time.time()
+    writer(outFN)
+    writeTime = time.time() - start
+    start = time.time()
+    swdDF = pd.read_csv(outFN,dtype={"Y":str})
+    readTime = time.time() - start
+    error = np.max(np.abs(swdDF.values[:,3:].astype(np.float64) - attributes) / np.abs(attributes))
+    sameKeys = (swdDF.Species.values == sppDF.Species.values).all() and (swdDF.Y.values == sppDF.Y.values).all()
+    print "{}: wrote {:.1f} MB in {:.1f}s, read in {:.1f}s; largest relative error {:.1e}".format(
+        name,os.path.getsize(outFN) / 1048576.0,writeTime,readTime,error)
+    problems = checkSWD(outFN)
+    if not sameKeys: problems.append("species or keys changed")
+    print "   SWD format: {}".format(", ".join(problems) if problems else "OK")
+    if haveJava and os.path.exists(maxentJar):
+        print "   Maxent exit code: {}".format(runMaxent(outFN,tmpFldr))
+shutil.rmtree(tmpFldr)